@@ -10,7 +10,10 @@ import math
 import random
 
 # Import your existing modules
-from model_runner import HouseModelInference, fix_json_string, attempt_json_parse
+from model_runner import fix_json_string, attempt_json_parse, is_house
+from model_service import get_model_service
+from json_stream import HouseStreamTracker
+from generation_cache import GenerationCache
 from validator import ProcTHORValidator
 from visualizer import plot_enhanced_floor_plan
 
@@ -19,6 +22,10 @@ MODEL_PATH = r"D:\CLASS NOTES\8th Sem\Project Exhibition 2\Testing_New\flan-t5-h
 RAW_OUTPUT_PATH = "generated_house_raw.txt"
 JSON_OUTPUT_PATH = r"D:\CLASS NOTES\8th Sem\Project Exhibition 2\Testing_New\output.json"
 ATTEMPTED_FIX_PATH = "house_fixed.json.attempted_fix.txt"
+CONSTRAINED_DECODING = True  # Keep the model on the house JSON grammar so output parses first time
+# Stream greedily with live progress and stop degenerate output early;
+# False waits for the full beam-2 decode, which is slower but more accurate
+STREAM_GENERATION = True
 
 # Modern color scheme
 COLORS = {
@@ -285,6 +292,16 @@ class HouseGeneratorApp:
         
         # Set light theme initially
         self.is_dark_theme = False
+        
+        # Load and warm up the model in the background so the first click doesn't pay for it
+        self.model_service = get_model_service(
+            MODEL_PATH, constrained=CONSTRAINED_DECODING, cache=GenerationCache()
+        )
+        # Built once like the model: loading the templates on every click would cost seconds
+        self._validator = None
+        self._validator_lock = threading.Lock()
+        threading.Thread(target=self.warm_up, daemon=True).start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def setup_window(self):
         self.root.title("House Plan Creator")
@@ -1050,6 +1067,20 @@ class HouseGeneratorApp:
         thread.daemon = True
         thread.start()
     
+    def warm_up(self):
+        """Load the model and the validator's templates before the first click"""
+        try:
+            self.model_service.get()
+        finally:
+            self.get_validator()
+
+    def get_validator(self):
+        """The shared ProcTHORValidator, built on first use"""
+        with self._validator_lock:
+            if self._validator is None:
+                self._validator = ProcTHORValidator(template_file="procthor_10k.jsonl")
+            return self._validator
+
     def run_pipeline(self, description):
         """Run the house generation pipeline"""
         try:
@@ -1057,33 +1088,51 @@ class HouseGeneratorApp:
             self.update_status("Running the model to generate your house...")
             time.sleep(0.5)  # Ensure UI updates
             
-            model = HouseModelInference(model_path=MODEL_PATH)
-            raw_output = model.generate_house_text(description)
+            model = self.model_service.get()
+            aborted = False
+            if STREAM_GENERATION:
+                tracker = HouseStreamTracker()
+                for _ in model.stream_house_text(description, tracker=tracker):
+                    self.update_status(f"Generating your house... ({len(tracker.text)} characters)")
+                aborted = tracker.aborted
+                raw_output = tracker.text
+                if raw_output and not aborted:
+                    raw_output = model.decode_output(raw_output)
+            else:
+                raw_output = model.generate_house_text(description)
 
-            if not raw_output:
+            if aborted:
+                # Degenerate output won't survive repair, hand it straight to the validator
+                self.update_status("Model output degenerated, using the closest template...")
+                json_data = None
+                fixed_json_text = raw_output or description
+            elif not raw_output:
                 self.update_status("[ERROR] Model output was empty.")
                 self.finish_processing(success=False)
                 return
-
-            # Step 2: Try to fix and parse JSON
-            self.update_status("Processing model output...")
-            time.sleep(0.3)  # Ensure UI updates
-            
-            fixed_json_text = fix_json_string(raw_output)
-            json_data = attempt_json_parse(fixed_json_text)
-
-            if json_data:
-                self.update_status("JSON parsed successfully!")
             else:
-                self.update_status("Could not parse JSON. Applying fixes...")
-                with open(ATTEMPTED_FIX_PATH, 'w') as f:
-                    f.write(fixed_json_text)
+                # Step 2: Try to fix and parse JSON
+                self.update_status("Processing model output...")
+                time.sleep(0.3)  # Ensure UI updates
+                
+                fixed_json_text = fix_json_string(raw_output)
+                json_data = attempt_json_parse(fixed_json_text)
+
+                if is_house(json_data):
+                    self.update_status("JSON parsed successfully!")
+                else:
+                    self.update_status("Could not parse JSON. Applying fixes...")
+                    with open(ATTEMPTED_FIX_PATH, 'w') as f:
+                        f.write(fixed_json_text)
+                    # Repair found no rooms: the raw text still carries the keywords the validator needs
+                    json_data = None
+                    fixed_json_text = raw_output
 
             # Step 3: Validate
             self.update_status("Validating house structure...")
             time.sleep(0.3)  # Ensure UI updates
             
-            validator = ProcTHORValidator(template_file="procthor_10k.jsonl")
+            validator = self.get_validator()
             validated_json = validator.validate(json_data if json_data else fixed_json_text)
 
             # Step 4: Save
@@ -1111,6 +1160,11 @@ class HouseGeneratorApp:
             self.update_status(f"Error: {str(e)}")
             self.finish_processing(success=False)
     
+    def on_close(self):
+        """Release the resident model before closing the window"""
+        self.model_service.unload()
+        self.root.destroy()
+    
     def update_status(self, message):
         """Update status message (thread-safe)"""
         self.root.after(0, lambda: self.status_label.config(text=message))
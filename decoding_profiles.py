@@ -0,0 +1,137 @@
+#decoding_profiles
+import argparse
+import json
+import os
+import sys
+import time
+
+# Named generate() settings. beam-2 is what HouseModelInference always used
+# before profiles existed, so it stays the default.
+DECODING_PROFILES = {
+    "greedy-fast": {"num_beams": 1, "do_sample": False},
+    "beam-2": {"num_beams": 2, "do_sample": False, "early_stopping": True},
+    "beam-4": {"num_beams": 4, "do_sample": False, "early_stopping": True},
+    "sample-0.7": {"num_beams": 1, "do_sample": True, "temperature": 0.7, "top_p": 0.9},
+    "sample-1.0": {"num_beams": 1, "do_sample": True, "temperature": 1.0, "top_k": 50},
+}
+DEFAULT_PROFILE = "beam-2"
+# The onnx backend, speculative decoding and streaming only decode greedily
+GREEDY_PROFILE = "greedy-fast"
+
+
+def check_profile(name):
+    if name not in DECODING_PROFILES:
+        raise ValueError(f"Unknown decoding profile: {name} (expected one of {', '.join(DECODING_PROFILES)})")
+    return name
+
+
+def is_sampling(name):
+    return DECODING_PROFILES[name].get("do_sample", False)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def benchmark_profiles(model, descriptions, profiles=None, max_length=None):
+    """Run every profile over the descriptions and measure latency, throughput and JSON validity.
+
+    Pass a HouseModelInference without a cache, or cached results will be
+    timed. Tokens are counted by re-tokenizing each output. raw_parse_rate
+    counts outputs that parse as they are into a house with rooms, parse_rate
+    those that do after fix_json_string(). Returns {profile: metrics}.
+    """
+    from model_runner import attempt_json_parse, fix_json_string, is_house
+
+    results = {}
+    for name in profiles or list(DECODING_PROFILES):
+        check_profile(name)
+        latencies = []
+        tokens = 0
+        parsed_raw = 0
+        parsed = 0
+        for description in descriptions:
+            start = time.perf_counter()
+            raw_text = model.generate_house_text(description, max_length=max_length, profile=name)
+            latencies.append(time.perf_counter() - start)
+            if not raw_text:
+                continue
+            tokens += len(model.tokenizer(raw_text, verbose=False)["input_ids"])
+            if is_house(attempt_json_parse(raw_text)):
+                parsed_raw += 1
+                parsed += 1
+            elif is_house(attempt_json_parse(fix_json_string(raw_text))):
+                parsed += 1
+
+        latencies.sort()
+        results[name] = {
+            "p50_latency": _percentile(latencies, 0.5),
+            "p95_latency": _percentile(latencies, 0.95),
+            "tokens_per_sec": tokens / sum(latencies) if sum(latencies) else 0.0,
+            "raw_parse_rate": parsed_raw / len(descriptions),
+            "parse_rate": parsed / len(descriptions),
+        }
+    return results
+
+
+def print_benchmark(results):
+    print(f"\n{'profile':<14}{'p50 (s)':>10}{'p95 (s)':>10}{'tokens/s':>10}{'raw ok':>8}{'fixed ok':>10}")
+    for name, metrics in results.items():
+        print(f"{name:<14}{metrics['p50_latency']:>10.3f}{metrics['p95_latency']:>10.3f}"
+              f"{metrics['tokens_per_sec']:>10.1f}{metrics['raw_parse_rate']:>8.1%}{metrics['parse_rate']:>10.1%}")
+
+
+def choose_profile(results, latency_budget):
+    """Best profile whose p95 latency fits the budget: highest parse rate, then lowest p50.
+
+    Falls back to the profile with the lowest p95 when none fits.
+    """
+    fitting = {name: m for name, m in results.items() if m["p95_latency"] <= latency_budget}
+    if not fitting:
+        fastest = min(results, key=lambda name: results[name]["p95_latency"])
+        print(f"No profile fits a {latency_budget:.3f}s budget, using the fastest: {fastest}")
+        return fastest
+    return max(fitting, key=lambda name: (fitting[name]["parse_rate"], -fitting[name]["p50_latency"]))
+
+
+def load_benchmark(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decoding profiles on held-out prompts")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the trained model directory")
+    parser.add_argument("--descriptions_file", type=str, required=True,
+                        help="Held-out prompts, one description per line")
+    parser.add_argument("--profiles", type=str, nargs="+", choices=list(DECODING_PROFILES),
+                        help="Profiles to run (default: all)")
+    parser.add_argument("--max_length", type=int, help="Maximum output length in tokens")
+    parser.add_argument("--output", type=str, default="profile_benchmark.json",
+                        help="Where to save the results (default: profile_benchmark.json)")
+    parser.add_argument("--latency_budget", type=float, metavar="SECONDS",
+                        help="Also report the best profile whose p95 latency fits this budget")
+    args = parser.parse_args()
+
+    with open(args.descriptions_file, 'r') as f:
+        descriptions = [line.strip() for line in f if line.strip()]
+    if not descriptions:
+        print(f"No descriptions in {args.descriptions_file}")
+        return 1
+
+    from model_runner import HouseModelInference
+    model = HouseModelInference(args.model_path)
+    model.warmup(descriptions[0], max_length=16)
+    results = benchmark_profiles(model, descriptions, args.profiles, args.max_length)
+    print_benchmark(results)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {os.path.abspath(args.output)}")
+
+    if args.latency_budget is not None:
+        print(f"Best profile within {args.latency_budget:.3f}s: {choose_profile(results, args.latency_budget)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
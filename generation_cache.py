@@ -0,0 +1,132 @@
+#generation_cache
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Shared location so the GUI and the CLI hit the same cache whatever their working directory
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".house_planner", "generation_cache.sqlite")
+
+
+def normalize_description(text):
+    """Lower-case and collapse whitespace so trivially edited prompts share a cache entry."""
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+class GenerationCache:
+    """Prompt-to-raw-output cache: an in-memory LRU in front of a size-bounded SQLite store.
+
+    Keys combine the normalized description, a checkpoint fingerprint and the
+    generation parameters, so changing the model or decoding settings never
+    returns a stale output. The SQLite store is evicted least-recently-used
+    first once it grows past max_disk_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, memory_entries=256, max_disk_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, raw_text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(description, checkpoint_hash, **params):
+        """Build the cache key for a description under a checkpoint and generation parameters."""
+        payload = json.dumps(
+            [normalize_description(description), checkpoint_hash, sorted(params.items())],
+            default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached raw text for key, or None on a miss."""
+        with self._lock:
+            raw_text = self._memory.get(key)
+            if raw_text is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return raw_text
+
+            row = self._db.execute("SELECT raw_text FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            raw_text = row[0]
+            self._db.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember(key, raw_text)
+            self.hits += 1
+            return raw_text
+
+    def put(self, key, raw_text):
+        """Store raw text under key in memory and on disk."""
+        size = len(raw_text.encode())
+        with self._lock:
+            self._remember(key, raw_text)
+            self._db.execute(
+                "INSERT OR REPLACE INTO generations (key, raw_text, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, raw_text, size, time.time())
+            )
+            self._evict()
+            self._db.commit()
+
+    def _remember(self, key, raw_text):
+        self._memory[key] = raw_text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = self._db.execute("SELECT key, size FROM generations ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+            self._memory.pop(key, None)
+            total -= size
+
+    def stats(self):
+        """Hit/miss counters and current sizes."""
+        with self._lock:
+            entries, disk_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "disk_entries": entries,
+                "disk_bytes": disk_bytes,
+            }
+
+    def clear(self):
+        """Drop every cached generation."""
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM generations")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,250 @@
+#generation_stats
+import json
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class GenerationStats:
+    """Per-stage timings and counters for one generate call (one prompt or one batch).
+
+    Times are in seconds. decoder_step_times holds one entry per decoder
+    forward pass; with beam search a pass covers every beam, and with
+    speculative decoding it verifies a whole draft.
+    """
+
+    def __init__(self, prompts=1, backend="torch", profile=None):
+        self.prompts = prompts
+        self.backend = backend
+        self.profile = profile
+        self.cached = 0
+        self.tokenize_time = 0.0
+        self.encoder_time = 0.0
+        self.decoder_step_times = []
+        self.generate_time = 0.0
+        self.total_time = 0.0
+        self.tokens_generated = 0
+        self.peak_memory_mb = None
+
+    @property
+    def decoder_time(self):
+        return sum(self.decoder_step_times)
+
+    @property
+    def tokens_per_sec(self):
+        return self.tokens_generated / self.generate_time if self.generate_time else 0.0
+
+    def to_dict(self):
+        steps = self.decoder_step_times
+        return {
+            "prompts": self.prompts,
+            "cached": self.cached,
+            "backend": self.backend,
+            "profile": self.profile,
+            "tokenize_time": self.tokenize_time,
+            "encoder_time": self.encoder_time,
+            "decoder_steps": len(steps),
+            "decoder_time": self.decoder_time,
+            "decoder_step_mean": self.decoder_time / len(steps) if steps else 0.0,
+            "decoder_step_max": max(steps) if steps else 0.0,
+            "generate_time": self.generate_time,
+            "total_time": self.total_time,
+            "tokens_generated": self.tokens_generated,
+            "tokens_per_sec": self.tokens_per_sec,
+            "peak_memory_mb": self.peak_memory_mb,
+        }
+
+    def summary(self):
+        data = self.to_dict()
+        memory = f", peak memory {data['peak_memory_mb']:.0f} MB" if data["peak_memory_mb"] is not None else ""
+        return (f"tokenize {data['tokenize_time'] * 1000:.1f} ms, encoder {data['encoder_time'] * 1000:.1f} ms, "
+                f"{data['decoder_steps']} decoder steps ({data['decoder_step_mean'] * 1000:.1f} ms mean), "
+                f"{data['tokens_generated']} tokens at {data['tokens_per_sec']:.1f} tokens/s{memory}")
+
+
+def _cuda_torch(device):
+    """torch for a CUDA device, else None; only torch-backend callers pass CUDA devices.
+
+    torch is imported here rather than at module level so the onnx backend,
+    which always runs on CPU, never loads it.
+    """
+    if not str(device).startswith("cuda"):
+        return None
+    import torch
+    return torch
+
+
+def _synchronize(device):
+    torch = _cuda_torch(device)
+    if torch is not None:
+        torch.cuda.synchronize(device)
+
+
+class StageTimer:
+    """Context manager that times encoder and decoder forward passes of a torch seq2seq model.
+
+    Forward hooks are attached to model.get_encoder() and model.get_decoder()
+    for the duration of the block only, and every pass is recorded in stats.
+    """
+
+    def __init__(self, model, stats, device="cpu"):
+        self.model = model
+        self.stats = stats
+        self.device = device
+        self._handles = []
+        self._starts = {}
+
+    def _pre_hook(self, name):
+        def hook(module, args, kwargs=None):
+            _synchronize(self.device)
+            self._starts[name] = time.perf_counter()
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, args, output):
+            _synchronize(self.device)
+            elapsed = time.perf_counter() - self._starts.pop(name, time.perf_counter())
+            if name == "encoder":
+                self.stats.encoder_time += elapsed
+            else:
+                self.stats.decoder_step_times.append(elapsed)
+        return hook
+
+    def __enter__(self):
+        for name, module in (("encoder", self.model.get_encoder()), ("decoder", self.model.get_decoder())):
+            self._handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self._handles.append(module.register_forward_hook(self._post_hook(name)))
+        return self
+
+    def __exit__(self, *exc_info):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+
+def current_rss_mb():
+    """Resident set size of this process right now, in MB (None where /proc/self/statm is unavailable)."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class RssPeakSampler:
+    """Peak RSS between reset() and read(), sampled every interval seconds by a daemon thread.
+
+    ru_maxrss only knows the peak of the whole process lifetime, so on CPU
+    this is what makes a per-generation peak. The thread only samples while
+    a measurement is open and waits on an Event otherwise. RSS is
+    process-wide: calls running concurrently in other threads count towards
+    the same peak, and the first of them to read pauses sampling until the
+    next reset().
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._sampling = threading.Event()
+        self._stop = threading.Event()
+
+    def reset(self):
+        """Start a new measurement from the current RSS."""
+        rss = current_rss_mb()
+        with self._lock:
+            self.peak = rss
+            if rss is None:
+                return
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._sampling.set()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        with self._lock:
+            if rss is not None and self.peak is not None:
+                self.peak = max(self.peak, rss)
+            return self.peak
+
+    def _run(self):
+        while True:
+            self._sampling.wait()
+            if self._stop.wait(self.interval):
+                return
+            if self._sampling.is_set():
+                self._sample()
+
+    def read(self):
+        """Peak RSS in MB since the last reset() (None before the first one); sampling pauses until the next reset()"""
+        self._sampling.clear()
+        return self._sample()
+
+    def stop(self):
+        """End the sampling thread; the peak stays readable and reset() starts it again"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._sampling.set()
+            thread.join()
+            self._sampling.clear()
+
+
+_rss_sampler = RssPeakSampler()
+
+
+def reset_peak_memory(device):
+    torch = _cuda_torch(device)
+    if torch is not None:
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        _rss_sampler.reset()
+
+
+def lifetime_peak_rss_mb():
+    """Peak RSS of the process over its whole lifetime (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def peak_memory_mb(device):
+    """Peak CUDA allocation, or peak sampled RSS on CPU, since the last reset_peak_memory() (None if unknown).
+
+    On CPU without /proc (macOS, Windows), or before the first reset, this
+    falls back to the process-lifetime peak RSS.
+    """
+    torch = _cuda_torch(device)
+    if torch is not None:
+        return torch.cuda.max_memory_allocated(device) / (1024 * 1024)
+    peak = _rss_sampler.read()
+    return peak if peak is not None else lifetime_peak_rss_mb()
+
+
+class MetricsLog:
+    """Appends one JSON line per record to a metrics file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, event, **fields):
+        record = {"time": time.time(), "event": event, **fields}
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
@@ -0,0 +1,311 @@
+#house_format
+import argparse
+import json
+import os
+import re
+import sys
+
+# Compact, reversible house text format.
+#
+# Keys are implied by position and every container is a JSON array, so the
+# text needs no '{' / '}' (which the T5 vocabulary cannot produce) and is
+# read back with json.loads:
+#
+#   house:  [id, numRooms, floors, [dim_x, dim_y], [room, ...], extras]
+#   room:   [roomType, floorLevel, [object, ...]]            name == roomType
+#           [roomType, floorLevel, [object, ...], name]      otherwise
+#   object: [objectType, [x, y, z]]                          assetId == objectType
+#           [objectType, [x, y, z], assetId]                 otherwise
+#
+# An id of the form "house_<digits>" is written as the bare integer. Any
+# other top-level keys (objects, doors, windows, ...) go in extras, written
+# generically: a dict becomes [":", key, value, ...], and a list that would
+# read as a marker is escaped as ["::", item, ...]. A top-level "objects"
+# list that just repeats the room objects is written as [":rooms"].
+# extras is left out when empty. Rooms or objects with keys outside the
+# layout are not compactable; encode_compact raises ValueError for them
+# rather than dropping data.
+
+HOUSE_KEYS = ("id", "numRooms", "floors", "dimensions", "rooms")
+DIMENSION_KEYS = ("x", "y")
+ROOM_KEYS = ("roomType", "name", "floorLevel", "objects")
+OBJECT_KEYS = ("objectType", "assetId", "position")
+POSITION_KEYS = ("x", "y", "z")
+
+HOUSE_ID_PATTERN = re.compile(r'house_([1-9]\d*|0)')
+
+# json.dumps' default ", " tokenizes shorter than "," with the T5 sentencepiece
+# vocabulary: the space folds into the next token's word-boundary marker
+COMPACT_SEPARATORS = (", ", ": ")
+
+DICT_MARKER = ":"
+LIST_ESCAPE = "::"
+DERIVED_OBJECTS = ":rooms"
+MARKERS = (DICT_MARKER, LIST_ESCAPE, DERIVED_OBJECTS)
+
+
+def _check_keys(data, keys, what):
+    if not isinstance(data, dict) or set(data) != set(keys):
+        raise ValueError(f"{what} does not match the compact layout: {sorted(data) if isinstance(data, dict) else data}")
+
+
+def _encode_value(value):
+    if isinstance(value, dict):
+        encoded = [DICT_MARKER]
+        for key, item in value.items():
+            encoded += [key, _encode_value(item)]
+        return encoded
+    if isinstance(value, list):
+        encoded = [_encode_value(item) for item in value]
+        if encoded and encoded[0] in MARKERS:
+            encoded.insert(0, LIST_ESCAPE)
+        return encoded
+    return value
+
+
+def _decode_value(value):
+    if not isinstance(value, list):
+        return value
+    if value and value[0] == DICT_MARKER:
+        pairs = value[1:]
+        keys = pairs[::2]
+        if not all(isinstance(key, str) for key in keys):
+            raise ValueError(f"Compact object keys must be strings, got {keys!r}")
+        return {pairs[i]: _decode_value(pairs[i + 1]) if i + 1 < len(pairs) else None
+                for i in range(0, len(pairs), 2)}
+    if value and value[0] == LIST_ESCAPE:
+        value = value[1:]
+    return [_decode_value(item) for item in value]
+
+
+def _room_objects(rooms):
+    """The top-level objects list as ProcTHOR derives it from the room objects."""
+    return [
+        {"objectType": obj.get("objectType"), "id": obj.get("assetId")}
+        for room in rooms for obj in room.get("objects", [])
+    ]
+
+
+def encode_compact(house):
+    """Encode a house dict as compact text. Raises ValueError if it doesn't fit the layout."""
+    if not isinstance(house, dict) or not set(HOUSE_KEYS) <= set(house):
+        raise ValueError(f"house does not match the compact layout: {sorted(house) if isinstance(house, dict) else house}")
+    _check_keys(house["dimensions"], DIMENSION_KEYS, "dimensions")
+
+    house_id = house["id"]
+    if not isinstance(house_id, str):
+        raise ValueError(f"house id must be a string, got {house_id!r}")
+    match = HOUSE_ID_PATTERN.fullmatch(house_id)
+    compact_id = int(match.group(1)) if match else house_id
+
+    rooms = []
+    for room in house["rooms"]:
+        _check_keys(room, ROOM_KEYS, "room")
+        objects = []
+        for obj in room["objects"]:
+            _check_keys(obj, OBJECT_KEYS, "object")
+            _check_keys(obj["position"], POSITION_KEYS, "position")
+            compact_obj = [obj["objectType"], [obj["position"][axis] for axis in POSITION_KEYS]]
+            if obj["assetId"] != obj["objectType"]:
+                compact_obj.append(obj["assetId"])
+            objects.append(compact_obj)
+        compact_room = [room["roomType"], room["floorLevel"], objects]
+        if room["name"] != room["roomType"]:
+            compact_room.append(room["name"])
+        rooms.append(compact_room)
+
+    compact = [
+        compact_id,
+        house["numRooms"],
+        house["floors"],
+        [house["dimensions"][axis] for axis in DIMENSION_KEYS],
+        rooms,
+    ]
+
+    extras = [DICT_MARKER]
+    for key, value in house.items():
+        if key in HOUSE_KEYS:
+            continue
+        if key == "objects" and value == _room_objects(house["rooms"]):
+            extras += [key, [DERIVED_OBJECTS]]
+        else:
+            extras += [key, _encode_value(value)]
+    if len(extras) > 1:
+        compact.append(extras)
+    return json.dumps(compact, separators=COMPACT_SEPARATORS)
+
+
+def close_compact_text(text):
+    """Close an unterminated string and any open arrays in truncated compact text."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+
+    if in_string:
+        text = text[:-1] if escaped else text
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    return text + "]" * max(depth, 0)
+
+
+def _item(values, index, default=None):
+    return values[index] if isinstance(values, list) and len(values) > index else default
+
+
+def _array(value, what):
+    """value if it is a list, [] if it is missing (None); ValueError for anything else."""
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"Compact {what} must be a JSON array, got {value!r}")
+    return value
+
+
+def decode_compact(text):
+    """Decode compact text back into the full house dict.
+
+    Truncated text (e.g. a generation cut off at max length) is closed before
+    parsing and missing trailing fields come back as None, so truncated model
+    output still yields a house. Raises ValueError if the text is not compact
+    JSON, or if a field that holds an array (rooms, a room, its objects, an
+    object, a position, dimensions, extras keys) holds something else.
+    """
+    try:
+        compact = json.loads(close_compact_text(text.strip()))
+    except (json.JSONDecodeError, RecursionError) as e:
+        raise ValueError(f"Not compact house text: {e}")
+    if not isinstance(compact, list):
+        raise ValueError("Compact house text must be a JSON array")
+
+    compact_id = _item(compact, 0)
+    house_id = f"house_{compact_id}" if isinstance(compact_id, int) else compact_id
+    dimensions = _array(_item(compact, 3), "dimensions")
+
+    rooms = []
+    for compact_room in _array(_item(compact, 4), "rooms"):
+        compact_room = _array(compact_room, "room")
+        objects = []
+        for compact_obj in _array(_item(compact_room, 2), "room objects"):
+            compact_obj = _array(compact_obj, "object")
+            object_type = _item(compact_obj, 0)
+            position = _array(_item(compact_obj, 1), "object position")
+            objects.append({
+                "objectType": object_type,
+                "assetId": _item(compact_obj, 2, object_type),
+                "position": {axis: _item(position, i) for i, axis in enumerate(POSITION_KEYS)},
+            })
+        room_type = _item(compact_room, 0)
+        rooms.append({
+            "roomType": room_type,
+            "name": _item(compact_room, 3, room_type),
+            "floorLevel": _item(compact_room, 1),
+            "objects": objects,
+        })
+
+    house = {
+        "id": house_id,
+        "numRooms": _item(compact, 1),
+        "floors": _item(compact, 2),
+        "dimensions": {axis: _item(dimensions, i) for i, axis in enumerate(DIMENSION_KEYS)},
+        "rooms": rooms,
+    }
+
+    extras = _item(compact, 5)
+    if isinstance(extras, list) and extras[:1] == [DICT_MARKER]:
+        for i in range(1, len(extras) - 1, 2):
+            key, value = extras[i], extras[i + 1]
+            if not isinstance(key, str) or key in HOUSE_KEYS:
+                continue
+            try:
+                house[key] = _room_objects(rooms) if value == [DERIVED_OBJECTS] else _decode_value(value)
+            except RecursionError:
+                raise ValueError(f"Compact extra {key!r} is nested too deeply")
+    return house
+
+
+def measure_token_reduction(template_file, tokenizer, max_houses=None):
+    """Average target tokens for json.dumps targets versus compact targets over a JSONL corpus."""
+    from house_grammar import house_to_target_text
+
+    json_tokens = 0
+    compact_tokens = 0
+    measured = 0
+    skipped = 0
+    with open(template_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                house = json.loads(line).get("house_json", {})
+            except json.JSONDecodeError:
+                continue
+
+            target = house_to_target_text(house)
+            try:
+                compact = encode_compact(json.loads(target))
+            except ValueError:
+                skipped += 1
+                continue
+            if decode_compact(compact) != json.loads(target):
+                raise AssertionError(f"Compact round trip changed house {house.get('id')}")
+
+            json_tokens += len(tokenizer(target, verbose=False)["input_ids"])
+            compact_tokens += len(tokenizer(compact, verbose=False)["input_ids"])
+            measured += 1
+            if max_houses and measured >= max_houses:
+                break
+
+    if not measured:
+        return {"houses": 0, "skipped": skipped}
+    return {
+        "houses": measured,
+        "skipped": skipped,
+        "avg_json_tokens": json_tokens / measured,
+        "avg_compact_tokens": compact_tokens / measured,
+        "token_reduction": 1 - compact_tokens / json_tokens,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure target-token savings of the compact house format")
+    parser.add_argument("--template_file", type=str, default="procthor_10k.jsonl",
+                        help="JSONL corpus with house_json records (default: procthor_10k.jsonl)")
+    parser.add_argument("--tokenizer", type=str, default="my-flan-model",
+                        help="Tokenizer directory (default: my-flan-model)")
+    parser.add_argument("--max_houses", type=int, help="Stop after this many houses")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.template_file):
+        print(f"Template file {args.template_file} not found!")
+        return 1
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    stats = measure_token_reduction(args.template_file, tokenizer, args.max_houses)
+    if not stats["houses"]:
+        print(f"No compactable houses found ({stats['skipped']} skipped)")
+        return 1
+
+    print(f"Houses measured:        {stats['houses']} ({stats['skipped']} not compactable)")
+    print(f"Avg JSON target tokens: {stats['avg_json_tokens']:.1f}")
+    print(f"Avg compact tokens:     {stats['avg_compact_tokens']:.1f}")
+    print(f"Token reduction:        {stats['token_reduction']:.1%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
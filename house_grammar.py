@@ -0,0 +1,455 @@
+#house_grammar
+import json
+import re
+
+# The T5 sentencepiece vocabulary has no '{' or '}' tokens, so the model can
+# never emit object braces. The grammar below therefore describes the
+# brace-less surface form the model actually produces, e.g.
+#   "dimensions": "x": 17, "y": 17, "rooms": ["roomType": "kitchen", ...]
+# and the schema is used to put the braces back deterministically.
+
+# Value types: "string", "int", "number", a nested schema dict (object) or
+# ("array", element_schema) for arrays of objects.
+POSITION_SCHEMA = {"x": "number", "y": "number", "z": "number"}
+
+OBJECT_SCHEMA = {
+    "objectType": "string",
+    "assetId": "string",
+    "position": POSITION_SCHEMA,
+}
+
+ROOM_SCHEMA = {
+    "roomType": "string",
+    "name": "string",
+    "floorLevel": "int",
+    "objects": ("array", OBJECT_SCHEMA),
+}
+
+HOUSE_SCHEMA = {
+    "id": "string",
+    "numRooms": "int",
+    "floors": "int",
+    "dimensions": {"x": "number", "y": "number"},
+    "rooms": ("array", ROOM_SCHEMA),
+}
+
+
+
+def house_to_target_text(house):
+    """Serialize a house the way Train_Main.ipynb builds training targets.
+
+    Object positions are rounded to two decimals and the dict is dumped with
+    json.dumps; tokenizing the result gives the token sequence the model was
+    trained to produce (braces become <unk>).
+    """
+    house = json.loads(json.dumps(house))
+    for room in house.get("rooms", []):
+        for obj in room.get("objects", []):
+            if "position" in obj:
+                pos = obj["position"]
+                for axis in ("x", "y", "z"):
+                    if axis in pos:
+                        pos[axis] = round(pos[axis], 2)
+    return json.dumps(house)
+
+
+# What the grammar expects next outside of a string/number lexeme
+KEY, COLON, VALUE, ARRAY_START, AFTER_VALUE = range(5)
+
+PARTIAL_NUMBER = {
+    "int": re.compile(r'-?\d*'),
+    "number": re.compile(r'-?\d*(\.\d*)?'),
+}
+COMPLETE_NUMBER = {
+    "int": re.compile(r'-?\d+'),
+    "number": re.compile(r'-?\d+(\.\d+)?'),
+}
+
+
+class HouseGrammarState:
+    """Incremental recogniser for brace-less house JSON.
+
+    feed() consumes text and returns False as soon as the text can no longer
+    be completed into a house matching the schema. With emit=True the state
+    also writes out the equivalent JSON with object braces restored.
+
+    Frames on the stack are tuples so copy() is cheap:
+        ("object", schema, seen_keys, in_array, implicit)
+        ("array", element_schema)
+    An implicit object is a nested object value such as "position"; it is
+    closed as soon as a key that does not belong to it appears. Array
+    elements start a new sibling when one of their keys repeats.
+    """
+
+    def __init__(self, schema=HOUSE_SCHEMA, emit=False):
+        self.stack = (("object", schema, frozenset(), False, False),)
+        self.expect = KEY
+        self.lexeme = None
+        self.lexeme_kind = None
+        self.escaped = False
+        self.key_candidates = ()
+        self.value_type = None
+        self.pending_comma = False
+        self.after_space = False
+        self.out = ["{"] if emit else None
+
+    def copy(self):
+        state = HouseGrammarState.__new__(HouseGrammarState)
+        state.__dict__.update(self.__dict__)
+        if self.out is not None:
+            state.out = list(self.out)
+        return state
+
+    def feed(self, text):
+        """Consume text; return False if it cannot lead to a valid house."""
+        for char in text:
+            if not self._feed_char(char):
+                return False
+        return True
+
+    def can_end(self):
+        """True if the text so far is a complete house (all arrays closed)."""
+        if self.lexeme_kind == "number":
+            if not COMPLETE_NUMBER[self.value_type].fullmatch(self.lexeme):
+                return False
+        elif self.lexeme_kind is not None or self.expect != AFTER_VALUE:
+            return False
+        return all(frame[0] != "array" for frame in self.stack)
+
+    def is_complete(self):
+        """True once every top-level key has a value and nothing is left open."""
+        top = self.stack[0] if self.stack else None
+        return (len(self.stack) == 1 and top[2] >= set(top[1]) and self.can_end())
+
+    def finish(self):
+        """Close any open lexeme and structure and return the emitted JSON text."""
+        if self.lexeme_kind == "string":
+            lexeme = self.lexeme[:-1] if self.escaped else self.lexeme
+            self._emit('"' + lexeme + '"')
+        elif self.lexeme_kind == "number":
+            lexeme = self.lexeme.rstrip(".")
+            self._emit(lexeme if COMPLETE_NUMBER[self.value_type].fullmatch(lexeme) else "0")
+        elif self.expect in (COLON, VALUE):
+            # Key was written but its value never arrived
+            self._emit("null")
+        self.lexeme_kind = self.lexeme = None
+
+        for frame in reversed(self.stack):
+            self._emit("}" if frame[0] == "object" else "]")
+        self.stack = ()
+        return "".join(self.out) if self.out is not None else None
+
+    def _emit(self, text):
+        if self.out is not None:
+            self.out.append(text)
+
+    def _feed_char(self, char):
+        if self.lexeme_kind in ("key", "string"):
+            if self.escaped:
+                self.escaped = False
+            elif char == "\\":
+                self.escaped = True
+            elif char == '"':
+                return self._end_key() if self.lexeme_kind == "key" else self._end_string()
+            self.lexeme += char
+            if self.lexeme_kind == "key":
+                self.key_candidates = tuple(k for k in self.key_candidates if k.startswith(self.lexeme))
+                return bool(self.key_candidates)
+            return True
+
+        if self.lexeme_kind == "number":
+            if char in "-.0123456789":
+                candidate = self.lexeme + char
+                if not PARTIAL_NUMBER[self.value_type].fullmatch(candidate):
+                    return False
+                self.lexeme = candidate
+                return True
+            if not COMPLETE_NUMBER[self.value_type].fullmatch(self.lexeme):
+                return False
+            self._emit(self.lexeme)
+            self.lexeme_kind = self.lexeme = None
+            self.expect = AFTER_VALUE
+            # Fall through: the terminator itself still has to be consumed
+
+        if char.isspace():
+            # Single spaces only between tokens, so decoding can't stall on whitespace
+            if self.after_space:
+                return False
+            self.after_space = True
+            return True
+        self.after_space = False
+
+        if self.expect == KEY:
+            return char == '"' and self._start_key()
+        if self.expect == COLON:
+            if char != ":":
+                return False
+            self.expect = VALUE
+            return True
+        if self.expect == VALUE:
+            return self._start_value(char)
+        if self.expect == ARRAY_START:
+            if char == "]":
+                return self._close_array()
+            return char == '"' and self._start_key()
+        if self.expect == AFTER_VALUE:
+            if char == ",":
+                self.pending_comma = True
+                self.expect = KEY
+                return True
+            if char == "]":
+                return self._close_array()
+        return False
+
+    def _allowed_keys(self):
+        keys = set()
+        for frame in reversed(self.stack):
+            if frame[0] == "array":
+                keys.update(frame[1])
+                break
+            _, schema, seen, in_array, implicit = frame
+            if in_array:
+                # A repeated key starts the next element of the array
+                keys.update(schema)
+                break
+            keys.update(k for k in schema if k not in seen)
+            if not implicit or not self.pending_comma:
+                # Leaving a nested object always goes through a comma
+                break
+        return keys
+
+    def _start_key(self):
+        self.key_candidates = tuple(self._allowed_keys())
+        if not self.key_candidates:
+            return False
+        self.lexeme_kind = "key"
+        self.lexeme = ""
+        return True
+
+    def _end_key(self):
+        key = self.lexeme
+        if key not in self.key_candidates:
+            return False
+
+        stack = list(self.stack)
+        closings = 0
+        open_brace = False
+        while True:
+            frame = stack[-1]
+            if frame[0] == "array":
+                stack.append(("object", frame[1], frozenset([key]), True, False))
+                open_brace = True
+                break
+            kind, schema, seen, in_array, implicit = frame
+            if key in schema and key not in seen:
+                stack[-1] = (kind, schema, seen | {key}, in_array, implicit)
+                break
+            if key in schema and in_array:
+                stack.pop()
+                closings += 1
+                stack.append(("object", schema, frozenset([key]), True, False))
+                open_brace = True
+                break
+            if not implicit or not self.pending_comma:
+                return False
+            stack.pop()
+            closings += 1
+
+        self._emit("}" * closings)
+        if self.pending_comma:
+            self._emit(", ")
+        if open_brace:
+            self._emit("{")
+        self._emit(json.dumps(key) + ": ")
+
+        self.stack = tuple(stack)
+        self.value_type = stack[-1][1][key]
+        self.pending_comma = False
+        self.lexeme_kind = self.lexeme = None
+        self.expect = COLON
+        return True
+
+    def _start_value(self, char):
+        value_type = self.value_type
+        if value_type == "string":
+            if char != '"':
+                return False
+            self.lexeme_kind = "string"
+            self.lexeme = ""
+            return True
+        if value_type in ("int", "number"):
+            if char not in "-0123456789":
+                return False
+            self.lexeme_kind = "number"
+            self.lexeme = char
+            return True
+        if isinstance(value_type, dict):
+            # Nested object: its braces are implied, the next thing is its first key
+            self.stack = self.stack + (("object", value_type, frozenset(), False, True),)
+            self._emit("{")
+            self.expect = KEY
+            return self._feed_char(char)
+        if char != "[":
+            return False
+        self.stack = self.stack + (("array", value_type[1]),)
+        self._emit("[")
+        self.expect = ARRAY_START
+        return True
+
+    def _end_string(self):
+        self._emit('"' + self.lexeme + '"')
+        self.lexeme_kind = self.lexeme = None
+        self.expect = AFTER_VALUE
+        return True
+
+    def _close_array(self):
+        stack = list(self.stack)
+        while stack[-1][0] == "object":
+            _, _, _, in_array, implicit = stack[-1]
+            if not (in_array or implicit):
+                return False
+            stack.pop()
+            self._emit("}")
+        stack.pop()
+        self._emit("]")
+        self.stack = tuple(stack)
+        self.expect = AFTER_VALUE
+        return True
+
+
+def restore_house_json(raw_text, schema=HOUSE_SCHEMA):
+    """Rebuild JSON text with object braces from brace-less model output.
+
+    Text is consumed until the first character that breaks the grammar;
+    everything before it is kept and any open structure is closed, so the
+    result always parses.
+    """
+    state = HouseGrammarState(schema, emit=True)
+    for char in raw_text:
+        if not state._feed_char(char):
+            break
+    return state.finish()
+
+
+def token_surface_texts(tokenizer):
+    """Surface text of every token id, as the grammar sees it.
+
+    <unk> (where the model puts braces) is zero-width and other special
+    tokens are None.
+    """
+    texts = []
+    special_ids = set(tokenizer.all_special_ids)
+    for token_id, piece in enumerate(tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))):
+        if token_id == tokenizer.unk_token_id:
+            texts.append("")
+        elif token_id in special_ids:
+            texts.append(None)
+        else:
+            texts.append(piece.replace("▁", " "))
+    return texts
+
+
+class HouseGrammarLogitsProcessor:
+    """Mask tokens that would take the generated text outside the house grammar.
+
+    For each hypothesis the highest-scoring candidates are checked against
+    the grammar state of its prefix, and only the first `max_allowed` valid
+    ones are left unmasked. If none of the top `max_candidates` is valid, the
+    rest of the vocabulary is searched in score order; if nothing at all can
+    continue the house, only EOS is left, so a row is never unconstrained.
+    Grammar states are cached per prefix between
+    decoding steps so each step only feeds the newest token. Create a new
+    processor for every generate() call.
+
+    LogitsProcessorList only calls its processors, so this does not subclass
+    transformers' LogitsProcessor and importing this module loads neither
+    transformers nor torch.
+    """
+
+    # The model emits <unk> where a brace belongs; never more than this many in a row ("}}]")
+    max_unk_run = 3
+
+    def __init__(self, tokenizer, schema=HOUSE_SCHEMA, max_candidates=64, max_allowed=8, token_texts=None):
+        self.schema = schema
+        self.max_candidates = max_candidates
+        self.max_allowed = max_allowed
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id
+        self.unk_token_id = tokenizer.unk_token_id
+
+        self.token_texts = token_texts if token_texts is not None else token_surface_texts(tokenizer)
+
+        self._states = {}
+
+    def _advance(self, state, token_id):
+        if state is None:
+            return None
+        if token_id in (self.eos_token_id, self.pad_token_id):
+            return state
+        text = self.token_texts[token_id] if token_id < len(self.token_texts) else None
+        if text is None:
+            return None
+        if not text:
+            return state
+        state = state.copy()
+        return state if state.feed(text) else None
+
+    def _state_for(self, prefix):
+        if prefix in self._states:
+            return self._states[prefix]
+        parent = prefix[:-1]
+        if parent in self._states:
+            return self._advance(self._states[parent], prefix[-1])
+        # Cache miss (first step or reordered beams): replay the prefix, skipping the decoder start token
+        state = HouseGrammarState(self.schema)
+        for token_id in prefix[1:]:
+            state = self._advance(state, token_id)
+        return state
+
+    def _accepts(self, state, token_id, unk_run):
+        if token_id == self.eos_token_id:
+            return state.can_end()
+        if token_id == self.unk_token_id:
+            # Braces only sit between lexemes, and a run of them must end
+            return state.lexeme_kind is None and unk_run < self.max_unk_run
+        if token_id >= len(self.token_texts) or self.token_texts[token_id] is None:
+            return False
+        return self._advance(state, token_id) is not None
+
+    def _first_accepted(self, state, token_ids, unk_run):
+        allowed = []
+        for token_id in token_ids:
+            if self._accepts(state, token_id, unk_run):
+                allowed.append(token_id)
+                if len(allowed) >= self.max_allowed:
+                    break
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        states = {}
+        mask = scores.new_full(scores.shape, float("-inf"))
+        num_candidates = min(self.max_candidates, scores.shape[-1])
+
+        for row, ids in enumerate(input_ids.tolist()):
+            prefix = tuple(ids)
+            state = self._state_for(prefix)
+            states[prefix] = state
+
+            allowed = []
+            if state is not None:
+                unk_run = 0
+                while unk_run < len(ids) and ids[-1 - unk_run] == self.unk_token_id:
+                    unk_run += 1
+                allowed = self._first_accepted(state, scores[row].topk(num_candidates).indices.tolist(), unk_run)
+                if not allowed and num_candidates < scores.shape[-1]:
+                    # None of the likeliest tokens fits: search the rest of the vocabulary in score order
+                    ranked = scores[row].sort(descending=True).indices[num_candidates:].tolist()
+                    allowed = self._first_accepted(state, ranked, unk_run)
+            if not allowed:
+                # Nothing continues the house (or the prefix is already off-grammar): end the
+                # sequence rather than unmask it; restore_house_json() closes what is open
+                allowed = [self.eos_token_id]
+            mask[row, allowed] = 0
+
+        self._states = states
+        return scores + mask
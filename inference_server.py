@@ -0,0 +1,413 @@
+#inference_server
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from decoding_profiles import load_benchmark
+from generation_cache import GenerationCache, DEFAULT_CACHE_PATH
+from json_stream import HouseStreamTracker
+from model_service import get_model_service
+from quantization import SUPPORTED_MODES
+
+# Local HTTP front end for one warm HouseModelInference.
+#
+#   POST /generate  {"description": "..."}                  -> one JSON result
+#   POST /generate  {"descriptions": ["...", ...]}          -> NDJSON, one line per
+#                                                              result as it finishes
+#   POST /generate  {"description": "...", "stream": true}  -> NDJSON token chunks
+#   GET  /metrics                                           -> queue and batch metrics
+#   GET  /health
+#
+# Requests may also set "max_length", and "latency_budget" (seconds) when the
+# server was started with --profile_benchmark; the budget picks the decoding
+# profile for that request.
+#
+# Non-streaming prompts from all connections share one queue and are run as
+# micro-batches through generate_batch(). Every model call happens on a single
+# worker thread, so a token stream holds the model until it finishes.
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class ServerMetrics:
+    """Counters for queue depth, batch sizes and request latency."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.failed = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.peak_queue_depth = 0
+        self.queue_wait_total = 0.0
+        self.latency_total = 0.0
+        self.streams = 0
+        self.active_streams = 0
+
+    def record_batch(self, size, queue_waits):
+        self.batches += 1
+        self.batch_sizes[size] += 1
+        self.queue_wait_total += sum(queue_waits)
+
+    def record_result(self, latency, ok):
+        self.requests += 1
+        self.latency_total += latency
+        if not ok:
+            self.failed += 1
+
+    def snapshot(self, queue_depth):
+        self.peak_queue_depth = max(self.peak_queue_depth, queue_depth)
+        batched = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "uptime": time.time() - self.started,
+            "queue_depth": queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "requests": self.requests,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": batched / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "mean_queue_wait_ms": 1000 * self.queue_wait_total / batched if batched else 0.0,
+            "mean_latency_ms": 1000 * self.latency_total / self.requests if self.requests else 0.0,
+            "streams": self.streams,
+            "active_streams": self.active_streams,
+        }
+
+
+class MicroBatcher:
+    """Coalesces concurrent prompts into generate_batch() calls.
+
+    The first queued prompt opens a batch; the batch is run once it holds
+    max_batch_size prompts or max_wait_ms has passed since it opened,
+    whichever comes first. Prompts with different max_length or
+    latency_budget run as separate batches.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = ServerMetrics()
+        self.queue = asyncio.Queue()
+        # The model is not thread-safe: every call into it goes through this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def run_on_model_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def submit(self, description, max_length=None, latency_budget=None):
+        """Queue one prompt and wait for its result dict."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((description, (max_length, latency_budget), time.perf_counter(), future))
+        self.metrics.peak_queue_depth = max(self.metrics.peak_queue_depth, self.queue.qsize())
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+            for (max_length, latency_budget), items in groups.items():
+                await self._run_batch(items, max_length, latency_budget)
+
+    async def _run_batch(self, items, max_length, latency_budget=None):
+        started = time.perf_counter()
+        descriptions = [item[0] for item in items]
+        try:
+            raw_texts = await self.run_on_model_thread(
+                partial(self.model.generate_batch, latency_budget=latency_budget),
+                descriptions, len(descriptions), max_length
+            )
+        except Exception as e:
+            print(f"Server: batch of {len(items)} failed: {e}")
+            raw_texts = [None] * len(items)
+        finished = time.perf_counter()
+
+        self.metrics.record_batch(len(items), [started - item[2] for item in items])
+        for (description, _, enqueued, future), raw_text in zip(items, raw_texts):
+            self.metrics.record_result(finished - enqueued, raw_text is not None)
+            if future.done():
+                continue  # client went away
+            result = {
+                "description": description,
+                "raw_text": raw_text,
+                "batch_size": len(items),
+                "queue_ms": round(1000 * (started - enqueued), 2),
+                "latency_ms": round(1000 * (finished - enqueued), 2),
+            }
+            if raw_text is None:
+                result["error"] = "generation failed"
+            future.set_result(result)
+
+    async def stream(self, description, max_length=None):
+        """Yield token chunks for one prompt, then a final summary dict."""
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        tracker = HouseStreamTracker()
+        done = object()
+
+        def _produce():
+            try:
+                for chunk in self.model.stream_house_text(description, tracker=tracker, max_length=max_length):
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+        self.metrics.streams += 1
+        self.metrics.active_streams += 1
+        started = time.perf_counter()
+        producer = loop.run_in_executor(self.executor, _produce)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                if chunk:
+                    yield {"chunk": chunk}
+            await producer
+        finally:
+            self.metrics.active_streams -= 1
+        latency = time.perf_counter() - started
+        self.metrics.record_result(latency, bool(tracker.text) and not tracker.aborted)
+        yield {
+            "done": True,
+            "raw_text": self.model.decode_output(tracker.text),
+            "aborted": tracker.aborted,
+            "abort_reason": tracker.abort_reason,
+            "latency_ms": round(1000 * latency, 2),
+        }
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+async def _read_request(reader):
+    """Parse one HTTP/1.1 request into (method, path, body bytes), or None on EOF."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def _write_head(writer, status, content_type, chunked=False, length=None):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Type: {content_type}",
+             "Connection: close"]
+    lines.append("Transfer-Encoding: chunked" if chunked else f"Content-Length: {length}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+
+async def _send_json(writer, status, payload):
+    body = json.dumps(payload).encode()
+    _write_head(writer, status, "application/json", length=len(body))
+    writer.write(body)
+    await writer.drain()
+
+
+async def _send_ndjson(writer, records):
+    """Send an async iterable of dicts as chunked NDJSON, flushing each line."""
+    _write_head(writer, 200, "application/x-ndjson", chunked=True)
+    async for record in records:
+        line = (json.dumps(record) + "\n").encode()
+        writer.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+class InferenceServer:
+    def __init__(self, batcher, host="127.0.0.1", port=8765):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+
+    async def serve_forever(self):
+        self.batcher.start()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"Inference server listening on http://{self.host}:{self.port} "
+              f"(max batch {self.batcher.max_batch_size}, wait {self.batcher.max_wait * 1000:.0f} ms)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await _read_request(reader)
+            if request is not None:
+                await self._dispatch(writer, *request)
+        except HttpError as e:
+            await _send_json(writer, e.status, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Server: error handling request: {e}")
+            try:
+                await _send_json(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer, method, path, body):
+        if path == "/health":
+            await _send_json(writer, 200, {"status": "ok"})
+        elif path == "/metrics":
+            await _send_json(writer, 200, self.batcher.metrics.snapshot(self.batcher.queue.qsize()))
+        elif path == "/generate":
+            if method != "POST":
+                raise HttpError(405, "Use POST for /generate")
+            await self._generate(writer, self._parse_generate(body))
+        else:
+            raise HttpError(404, f"Unknown path {path}")
+
+    @staticmethod
+    def _parse_generate(body):
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise HttpError(400, f"Body is not JSON: {e}")
+        if not isinstance(payload, dict):
+            raise HttpError(400, "Body must be a JSON object")
+
+        many = "descriptions" in payload
+        descriptions = payload["descriptions"] if many else [payload.get("description")]
+        if (not isinstance(descriptions, list) or not descriptions
+                or not all(isinstance(d, str) and d.strip() for d in descriptions)):
+            raise HttpError(400, "Provide a non-empty 'description' string or 'descriptions' list")
+
+        max_length = payload.get("max_length")
+        if max_length is not None and (not isinstance(max_length, int) or max_length < 2):
+            raise HttpError(400, "'max_length' must be an integer >= 2")
+        latency_budget = payload.get("latency_budget")
+        if latency_budget is not None and (isinstance(latency_budget, bool)
+                                           or not isinstance(latency_budget, (int, float)) or latency_budget <= 0):
+            raise HttpError(400, "'latency_budget' must be a positive number of seconds")
+        stream = bool(payload.get("stream"))
+        if stream and many:
+            raise HttpError(400, "Token streaming takes a single 'description'")
+        return {"descriptions": descriptions, "max_length": max_length, "latency_budget": latency_budget,
+                "stream": stream, "many": many}
+
+    async def _generate(self, writer, request):
+        if request["stream"]:
+            if self.batcher.model.backend != "torch":
+                raise HttpError(400, "Token streaming needs the torch backend")
+            await _send_ndjson(writer, self.batcher.stream(request["descriptions"][0], request["max_length"]))
+            return
+        if request["latency_budget"] is not None and self.batcher.model.profile_benchmark is None:
+            raise HttpError(400, "'latency_budget' needs a server started with --profile_benchmark")
+
+        if not request["many"]:
+            result = await self.batcher.submit(request["descriptions"][0], request["max_length"],
+                                               request["latency_budget"])
+            await _send_json(writer, 200 if result["raw_text"] is not None else 500, result)
+            return
+
+        async def _submit(index, description):
+            result = await self.batcher.submit(description, request["max_length"], request["latency_budget"])
+            return {"index": index, **result}
+
+        tasks = [
+            asyncio.ensure_future(_submit(index, description))
+            for index, description in enumerate(request["descriptions"])
+        ]
+
+        async def _as_completed():
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+
+        try:
+            await _send_ndjson(writer, _as_completed())
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve house generation over local HTTP with micro-batching")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the trained model directory")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--max_batch_size", type=int, default=8,
+                        help="Most prompts coalesced into one generate call (default: 8)")
+    parser.add_argument("--max_wait_ms", type=float, default=20,
+                        help="How long a batch waits for more prompts once opened (default: 20)")
+    parser.add_argument("--quantize", type=str, choices=SUPPORTED_MODES,
+                        help="Serve a dynamically quantized CPU model")
+    parser.add_argument("--backend", type=str, choices=("torch", "onnx"), default="torch",
+                        help="Inference backend; onnx expects --model_path to be an export_onnx directory")
+    parser.add_argument("--output_format", type=str, choices=("json", "compact"), default="json",
+                        help="Target format the checkpoint was trained on (see house_format.py)")
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH,
+                        help=f"Generation cache database (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no_cache", action="store_true", help="Disable the generation cache")
+    parser.add_argument("--profile_benchmark", type=str,
+                        help="Results written by decoding_profiles.py; lets requests set a latency_budget")
+    args = parser.parse_args()
+
+    profile_benchmark = load_benchmark(args.profile_benchmark) if args.profile_benchmark else None
+    service = get_model_service(args.model_path, quantize=args.quantize, backend=args.backend,
+                                output_format=args.output_format, profile_benchmark=profile_benchmark,
+                                cache=None if args.no_cache else GenerationCache(args.cache_path))
+    batcher = MicroBatcher(service.get(), args.max_batch_size, args.max_wait_ms)
+    try:
+        asyncio.run(InferenceServer(batcher, args.host, args.port).serve_forever())
+    except KeyboardInterrupt:
+        print("Inference server stopped")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
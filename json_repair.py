@@ -0,0 +1,301 @@
+#json_repair
+import json
+import re
+
+from house_grammar import HOUSE_SCHEMA
+
+# Tolerant, single-pass parser for house JSON as the model writes it.
+#
+# The text is tokenized once and parsed once, top-down, with HOUSE_SCHEMA
+# saying what each key holds. Where the schema expects an object and no '{'
+# is there (the T5 vocabulary cannot produce braces), the object is opened
+# implicitly and closed again as soon as a key that does not belong to it
+# appears; inside an array of objects, a repeated key starts the next
+# element. Bare keys are quoted, missing commas and colons are inserted,
+# stray tokens are skipped, and truncated input has its open string and
+# structures closed, so any text yields a best-effort house dict.
+
+# One alternative per token kind: string (with its closing quote optional, for
+# truncated output), punctuation, number, bare word, anything else
+TOKEN_PATTERN = re.compile(r'''\s*(?:
+    "((?:[^"\\]|\\.)*)("?)
+  | ([{}\[\]:,])
+  | (-?\d+(\.\d*)?([eE][-+]?\d+)?)
+  | ([A-Za-z_][A-Za-z0-9_]*)
+  | (\S)
+)''', re.VERBOSE | re.DOTALL)
+LITERALS = {"true": True, "false": False, "null": None}
+
+# Token kinds
+STRING, NUMBER, WORD, PUNCT, EOF = "string", "number", "word", "punct", "eof"
+
+
+class _Missing:
+    """Marker for a value that never arrived (input ended after its key)."""
+
+
+MISSING = _Missing()
+
+
+def _tokenize(text, repairs):
+    """Split text into (kind, value, offset) tokens in one left-to-right scan."""
+    tokens = []
+    match = TOKEN_PATTERN.match
+    pos = 0
+    n = len(text)
+    while pos < n:
+        m = match(text, pos)
+        if m is None:  # only trailing whitespace is left
+            break
+        pos = m.end()
+        string, closed, punct, number, fraction, exponent, word, stray = m.groups()
+        if string is not None:
+            offset = m.start(1) - 1
+            if '\\' in string:
+                try:
+                    string = json.loads('"' + string + '"')
+                except json.JSONDecodeError:
+                    repairs.append(f"kept undecodable escapes in string at {offset}")
+            if not closed:
+                repairs.append(f"closed truncated string at {offset}")
+            tokens.append((STRING, string, offset))
+        elif punct is not None:
+            tokens.append((PUNCT, punct, m.start(3)))
+        elif number is not None:
+            value = float(number) if fraction or exponent else int(number)
+            tokens.append((NUMBER, value, m.start(4)))
+        elif word is not None:
+            tokens.append((WORD, word, m.start(7)))
+        else:
+            repairs.append(f"skipped stray {stray!r} at {m.start(8)}")
+    # Padded so the parser can look one token past the end without bounds checks
+    tokens += [(EOF, None, n)] * 2
+    return tokens
+
+
+class _HouseParser:
+    def __init__(self, text, schema):
+        self.repairs = []
+        self.tokens = _tokenize(text, self.repairs)
+        self.pos = 0
+        self.schema = schema
+
+    def peek(self, ahead=0):
+        return self.tokens[self.pos + ahead]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token[0] != EOF:
+            self.pos += 1
+        return token
+
+    def is_punct(self, char, ahead=0):
+        kind, value, _ = self.peek(ahead)
+        return kind == PUNCT and value == char
+
+    def at_key(self):
+        """A string or bare word followed by ':' (or by nothing, at the end of truncated input)."""
+        kind, value, _ = self.peek()
+        if kind == STRING or (kind == WORD and value not in LITERALS):
+            return self.is_punct(":", 1) or self.peek(1)[0] == EOF
+        return False
+
+    def skip(self, reason):
+        kind, value, offset = self.next()
+        self.repairs.append(f"skipped {reason} {value!r} at {offset}")
+
+    def parse(self):
+        while self.peek()[0] != EOF and not self.is_punct("{") and not self.at_key():
+            self.skip("leading")
+        explicit = self.is_punct("{")
+        if explicit:
+            self.next()
+        else:
+            self.repairs.append("restored outer braces")
+        house = self.parse_object(self.schema, explicit, in_array=False, root=True)
+        if self.peek()[0] != EOF:
+            self.repairs.append(f"ignored trailing text at {self.peek()[2]}")
+        return house
+
+    def parse_object(self, schema, explicit, in_array, root=False):
+        """Parse members until the object closes; implicit objects stop at a key that isn't theirs."""
+        obj = {}
+        need_comma = False
+        while True:
+            kind, value, offset = self.peek()
+            if kind == EOF:
+                if explicit or root:
+                    self.repairs.append(f"closed object truncated at {offset}")
+                return obj
+            if kind == PUNCT:
+                if value == "}":
+                    self.next()
+                    if not explicit and not root:
+                        self.repairs.append(f"restored '{{' for object closed at {offset}")
+                    if root and not explicit:
+                        continue
+                    return obj
+                if value == "]":
+                    if root:
+                        self.skip("unbalanced")
+                        continue
+                    if explicit:
+                        self.repairs.append(f"closed object before ']' at {offset}")
+                    return obj
+                if value == ",":
+                    self.next()
+                    continue
+                if value == "{" and in_array and not explicit and obj:
+                    return obj  # next element opens with a brace
+                self.skip("unexpected")
+                continue
+            if not self.at_key():
+                self.skip("unexpected")
+                continue
+
+            key = value
+            if schema is not None and key not in schema and not (explicit or root):
+                # Belongs to an enclosing object
+                return obj
+            if in_array and not explicit and key in obj:
+                # Repeated key: the next array element starts here
+                return obj
+            # Checked only once the key is known to be ours, so an implicit
+            # object ending here leaves the missing comma to its parent, and
+            # a comma it already consumed counts as present
+            if need_comma and self.tokens[self.pos - 1][:2] != (PUNCT, ","):
+                self.repairs.append(f"inserted ',' at {offset}")
+
+            self.next()
+            if kind == WORD:
+                self.repairs.append(f"quoted bare key {key!r} at {offset}")
+            if self.is_punct(":"):
+                self.next()
+            elif self.peek()[0] == EOF:
+                self.repairs.append(f"dropped key {key!r} truncated before its value")
+                return obj
+            else:
+                self.repairs.append(f"inserted ':' after {key!r} at {offset}")
+
+            value_schema = schema.get(key) if schema is not None else None
+            if key in obj:
+                self.repairs.append(f"overwrote duplicate key {key!r} at {offset}")
+            member = self.parse_value(value_schema, key)
+            if member is MISSING:
+                self.repairs.append(f"dropped key {key!r} truncated before its value")
+                return obj
+            obj[key] = member
+            need_comma = True
+
+    def parse_value(self, schema, key=None):
+        kind, value, offset = self.peek()
+        if kind == EOF:
+            return MISSING
+
+        if isinstance(schema, dict):
+            if self.is_punct("{"):
+                self.next()
+                return self.parse_object(schema, explicit=True, in_array=False)
+            if self.at_key():
+                self.repairs.append(f"restored braces around {key!r} at {offset}")
+                return self.parse_object(schema, explicit=False, in_array=False)
+        elif isinstance(schema, tuple):
+            if self.is_punct("["):
+                self.next()
+            elif self.at_key() or self.is_punct("{"):
+                self.repairs.append(f"inserted '[' for {key!r} at {offset}")
+            else:
+                return self.parse_scalar()
+            return self.parse_array(schema[1])
+        elif schema is None:
+            if self.is_punct("{"):
+                self.next()
+                return self.parse_object(None, explicit=True, in_array=False)
+            if self.is_punct("["):
+                self.next()
+                return self.parse_array(None)
+
+        if self.at_key() and self.is_punct(":", 1):
+            # The value was skipped and the next key follows directly
+            self.repairs.append(f"filled missing value of {key!r} with null at {offset}")
+            return None
+        return self.parse_scalar()
+
+    def parse_scalar(self):
+        kind, value, offset = self.next()
+        if kind in (STRING, NUMBER):
+            return value
+        if kind == WORD:
+            if value in LITERALS:
+                return LITERALS[value]
+            self.repairs.append(f"quoted bare value {value!r} at {offset}")
+            return value
+        if kind == EOF:
+            return MISSING
+        self.repairs.append(f"replaced unexpected {value!r} with null at {offset}")
+        return None
+
+    def parse_array(self, element_schema):
+        items = []
+        while True:
+            kind, value, offset = self.peek()
+            if kind == EOF:
+                self.repairs.append(f"closed array truncated at {offset}")
+                return items
+            if kind == PUNCT and value == "]":
+                self.next()
+                return items
+            if kind == PUNCT and value == ",":
+                self.next()
+                continue
+            if kind == PUNCT and value == "}":
+                # Closing brace of the enclosing object: the ']' was dropped
+                self.repairs.append(f"closed array before '}}' at {offset}")
+                return items
+
+            if isinstance(element_schema, dict) or (element_schema is None and self.at_key()):
+                if self.is_punct("{"):
+                    self.next()
+                    items.append(self.parse_object(element_schema, explicit=True, in_array=True))
+                    continue
+                if self.at_key():
+                    # Outside the schema a repeated key is the only sign of the next element
+                    start = self.pos
+                    element = self.parse_object(element_schema, explicit=False, in_array=True)
+                    if self.pos == start:
+                        # A key that no element can hold: the array ended without its ']'
+                        self.repairs.append(f"closed array before {value!r} at {offset}")
+                        return items
+                    items.append(element)
+                    continue
+                self.skip("unexpected")
+                continue
+
+            item = self.parse_value(element_schema)
+            if item is MISSING:
+                return items
+            items.append(item)
+
+
+def repair_house_json(raw_text, schema=HOUSE_SCHEMA):
+    """Parse model output into a best-effort house dict in one pass.
+
+    Returns (house, repairs) where repairs lists every fix that was needed,
+    e.g. restored braces, inserted commas or closed truncated structures.
+    Valid JSON comes back unchanged with no repairs.
+    """
+    text = raw_text.strip()
+    if text.startswith("{"):
+        try:
+            house = json.loads(text)
+            if isinstance(house, dict):
+                return house, []
+        except json.JSONDecodeError:
+            pass
+    parser = _HouseParser(text, schema)
+    return parser.parse(), parser.repairs
+
+
+def strip_braces(text):
+    """Model-style output for a serialized house: object braces are dropped, nothing else changes."""
+    return text.replace("{", "").replace("}", "")
@@ -0,0 +1,184 @@
+#json_stream
+import re
+
+from house_grammar import HouseGrammarState
+
+# Keys that start a repeatable block in the house output. Text between two
+# consecutive occurrences of the same key is one block (a room or an object).
+BLOCK_KEYS = ('"roomType"', '"objectType"')
+
+NUM_ROOMS_PATTERN = re.compile(r'"numRooms"\s*:\s*(\d+)')
+
+
+class HouseStreamTracker:
+    """Incrementally track the structure of streamed house JSON and flag degenerate output.
+
+    Feed decoded text chunks with feed(). The tracker keeps bracket depth and
+    string state, counts rooms, and watches for identical consecutive room or
+    object blocks. As soon as the output looks degenerate it sets `aborted`
+    and `abort_reason`, which the generation loop polls to stop decoding.
+    """
+
+    def __init__(self, max_depth=8, max_repeated_blocks=3, extra_rooms_allowed=2):
+        self.max_depth = max_depth
+        self.max_repeated_blocks = max_repeated_blocks
+        self.extra_rooms_allowed = extra_rooms_allowed
+
+        self.text = ""
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.num_rooms = None
+        self.room_count = 0
+        self.aborted = False
+        self.abort_reason = None
+
+        self._search_from = {key: 0 for key in BLOCK_KEYS}
+        self._block_starts = {key: None for key in BLOCK_KEYS}
+        self._last_blocks = {key: None for key in BLOCK_KEYS}
+        self._repeats = {key: 0 for key in BLOCK_KEYS}
+
+    def feed(self, chunk):
+        """Consume the next chunk of decoded text. Returns False once aborted."""
+        if self.aborted:
+            return False
+
+        start = len(self.text)
+        self.text += chunk
+        for char in chunk:
+            self._feed_char(char)
+            if self.aborted:
+                return False
+
+        if self.num_rooms is None:
+            match = NUM_ROOMS_PATTERN.search(self.text)
+            if match:
+                self.num_rooms = int(match.group(1))
+
+        self._scan_blocks(start)
+        return not self.aborted
+
+    def _feed_char(self, char):
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+            return
+
+        if char == '"':
+            self.in_string = True
+        elif char in '[{':
+            self.depth += 1
+            if self.depth > self.max_depth:
+                self._abort(f"nesting deeper than {self.max_depth}")
+        elif char in ']}':
+            self.depth -= 1
+            if self.depth < 0:
+                self._abort(f"unbalanced closing '{char}'")
+
+    def _scan_blocks(self, start):
+        hits = []
+        for key in BLOCK_KEYS:
+            # Back up far enough to catch a key split across two chunks
+            pos = self.text.find(key, max(self._search_from[key], start - len(key) + 1))
+            while pos != -1:
+                hits.append((pos, key))
+                self._search_from[key] = pos + len(key)
+                pos = self.text.find(key, pos + len(key))
+
+        for pos, key in sorted(hits):
+            self._on_block_start(key, pos)
+            if self.aborted:
+                return
+
+    def _on_block_start(self, key, pos):
+        previous_start = self._block_starts[key]
+        self._block_starts[key] = pos
+
+        if key == '"roomType"':
+            self.room_count += 1
+            if self.num_rooms is not None and self.room_count > self.num_rooms + self.extra_rooms_allowed:
+                self._abort(f"{self.room_count} rooms generated for numRooms={self.num_rooms}")
+                return
+
+        if previous_start is None:
+            return
+
+        block = self.text[previous_start:pos]
+        if block == self._last_blocks[key]:
+            self._repeats[key] += 1
+            if self._repeats[key] >= self.max_repeated_blocks:
+                self._abort(f"{key} block repeated {self._repeats[key] + 1} times")
+        else:
+            self._repeats[key] = 0
+        self._last_blocks[key] = block
+
+    def _abort(self, reason):
+        self.aborted = True
+        self.abort_reason = reason
+
+
+class HouseCloseDetector:
+    """Tell when generated house text has closed its top-level value.
+
+    Compact output (house_format.py) is closed when its outer array is.
+    JSON output with braces is closed when the outer object is; the model's
+    usual brace-less JSON is closed once every key of the house grammar has
+    a value and no array is left open. Text that leaves the grammar is never
+    reported closed, so decoding then runs to EOS or the length limit.
+    """
+
+    def __init__(self, output_format="json"):
+        self.output_format = output_format
+        self.depth = 0
+        self.opened = False
+        self.in_string = False
+        self.escaped = False
+        self.closed = False
+        self.grammar = HouseGrammarState() if output_format == "json" else None
+        self.grammar_failed = False
+
+    def copy(self):
+        detector = HouseCloseDetector.__new__(HouseCloseDetector)
+        detector.__dict__.update(self.__dict__)
+        if self.grammar is not None:
+            detector.grammar = self.grammar.copy()
+        return detector
+
+    def feed(self, text):
+        """Consume text; returns True once the top-level value is closed."""
+        for char in text:
+            if self.closed:
+                break
+            self._feed_char(char)
+        return self.closed
+
+    def _feed_char(self, char):
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+        elif char == '"':
+            self.in_string = True
+        elif char == '[' or (char == '{' and self.output_format == "json"):
+            if char == '{' and not self.opened:
+                # The output carries its own braces, bracket depth says when it ends
+                self.grammar = None
+            self.depth += 1
+            self.opened = True
+        elif char == ']' or (char == '}' and self.output_format == "json"):
+            self.depth -= 1
+            if self.grammar is None and self.opened and self.depth == 0:
+                self.closed = True
+
+        if self.grammar is not None and not self.grammar_failed:
+            if not self.grammar._feed_char(char):
+                self.grammar_failed = True
+            elif self.grammar.is_complete():
+                self.closed = True
@@ -0,0 +1,151 @@
+#keyword_extractor
+import re
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Keyword and count extraction for validator inputs, compiled once.
+#
+# Every count pattern is compiled up front, and each one is only searched
+# when its trigger stem (the word it cannot match without) occurs in the
+# text: one lookahead scan over the text reports all the stems present.
+# Keyword mentions come from one \w+ scan, so "\bkeyword\b" becomes a set
+# lookup; only keywords with non-word characters (e.g. "home office") keep
+# a compiled regex. Results, key order included, are the same as searching
+# every pattern in turn.
+
+# First matching pattern of each list wins, its leftmost match is used
+ROOM_COUNT_PATTERNS = [
+    r'(\d+)\s*rooms?',
+    r'rooms?[\s:]+(\d+)',
+    r'numrooms?[\s:]+(\d+)',
+    r'number\s+of\s+rooms?[\s:]+(\d+)'
+]
+FLOOR_PATTERNS = [
+    r'(\d+)\s*floors?',
+    r'floors?[\s:]+(\d+)',
+    r'numfloors?[\s:]+(\d+)',
+    r'number\s+of\s+floors?[\s:]+(\d+)',
+    r'stories?[\s:]+(\d+)',
+    r'(\d+)\s*stor(?:ies|ys?)'
+]
+# Patterns with two groups give width and length, the others a single dimension
+DIMENSION_PATTERNS = [
+    r'dimensions?[\s:]+(\d+)[^\d]*(\d+)',
+    r'size[\s:]+(\d+)[^\d]*(\d+)',
+    r'(\d+)\s*[xX]\s*(\d+)',
+    r'width[\s:]+(\d+)',
+    r'length[\s:]+(\d+)'
+]
+ROOM_TYPE_PATTERNS = {
+    "kitchen": [r'(\d+)\s*kitchens?', r'kitchens?[\s:]+(\d+)'],
+    "bedroom": [r'(\d+)\s*bedrooms?', r'bedrooms?[\s:]+(\d+)'],
+    "bathroom": [r'(\d+)\s*bathrooms?', r'bathrooms?[\s:]+(\d+)'],
+    "living": [r'(\d+)\s*living\s*rooms?', r'living\s*rooms?[\s:]+(\d+)']
+}
+OBJECT_TYPE_PATTERNS = {
+    "table": [r'(\d+)\s*tables?', r'tables?[\s:]+(\d+)'],
+    "chair": [r'(\d+)\s*chairs?', r'chairs?[\s:]+(\d+)'],
+    "sofa": [r'(\d+)\s*sofas?', r'sofas?[\s:]+(\d+)'],
+    "bed": [r'(\d+)\s*beds?', r'beds?[\s:]+(\d+)'],
+    "sink": [r'(\d+)\s*sinks?', r'sinks?[\s:]+(\d+)'],
+    "toilet": [r'(\d+)\s*toilets?', r'toilets?[\s:]+(\d+)']
+}
+
+# Words the count patterns are triggered by. None is a prefix of another, so
+# the lookahead scan reports every occurrence; a pattern without a stem
+# (e.g. "3 x 4") is always searched.
+TRIGGER_STEMS = ("room", "num", "floor", "stor", "dimension", "size", "width", "length",
+                 "kitchen", "bed", "bathroom", "living", "table", "chair", "sofa", "sink", "toilet")
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def _trigger(pattern):
+    return next((stem for stem in TRIGGER_STEMS if stem in pattern), None)
+
+
+def _compile(patterns: List[str]) -> List[Tuple[re.Pattern, str]]:
+    return [(re.compile(pattern), _trigger(pattern)) for pattern in patterns]
+
+
+class KeywordExtractor:
+    """Room counts, object counts and numeric values mentioned in a text
+
+    room_keywords / object_keywords map a room type / object category to the
+    keywords that count as a mention of it.
+    """
+
+    def __init__(self, room_keywords: Dict[str, List[str]], object_keywords: Dict[str, List[str]]):
+        self.room_keywords = room_keywords
+        self.object_keywords = object_keywords
+        self.numeric_patterns = [("total_rooms", _compile(ROOM_COUNT_PATTERNS)),
+                                 ("floors", _compile(FLOOR_PATTERNS))]
+        self.dimension_patterns = _compile(DIMENSION_PATTERNS)
+        self.room_type_patterns = {name: _compile(patterns) for name, patterns in ROOM_TYPE_PATTERNS.items()}
+        self.object_type_patterns = {name: _compile(patterns) for name, patterns in OBJECT_TYPE_PATTERNS.items()}
+        self.trigger_pattern = re.compile("(?=(" + "|".join(TRIGGER_STEMS) + "))")
+        # Keywords that are not a single word are still matched with \b...\b
+        self.phrase_patterns = {
+            keyword: re.compile(r'\b' + re.escape(keyword) + r'\b')
+            for keywords in list(room_keywords.values()) + list(object_keywords.values())
+            for keyword in keywords if not WORD_PATTERN.fullmatch(keyword)
+        }
+
+    @staticmethod
+    def _first_match(patterns, text, stems):
+        for pattern, stem in patterns:
+            if stem is None or stem in stems:
+                match = pattern.search(text)
+                if match:
+                    return match
+        return None
+
+    def _mentions(self, keyword, text, words):
+        pattern = self.phrase_patterns.get(keyword)
+        if pattern is None:
+            return keyword in words
+        return pattern.search(text) is not None
+
+    def extract(self, input_text: str) -> Tuple[Dict[str, int], Dict[str, int], Dict[str, int]]:
+        """(room_counts, object_counts, numeric_values) for input_text, see ProcTHORValidator._extract_keywords_and_counts"""
+        text = input_text.lower()
+        words = set(WORD_PATTERN.findall(text))
+        stems = set(self.trigger_pattern.findall(text))
+
+        numeric_values = {}
+        for name, patterns in self.numeric_patterns:
+            match = self._first_match(patterns, text, stems)
+            if match:
+                numeric_values[name] = int(match.group(1))
+
+        match = self._first_match(self.dimension_patterns, text, stems)
+        if match:
+            if len(match.groups()) >= 2:
+                numeric_values['width'] = int(match.group(1))
+                numeric_values['length'] = int(match.group(2))
+            else:
+                numeric_values['dimension'] = int(match.group(1))
+
+        # Explicit counts first, then mentions of types not counted yet
+        room_counts = defaultdict(int)
+        for room_type, patterns in self.room_type_patterns.items():
+            match = self._first_match(patterns, text, stems)
+            if match:
+                room_counts[room_type] = int(match.group(1))
+        for room_type, keywords in self.room_keywords.items():
+            if room_type not in room_counts:
+                for keyword in keywords:
+                    if self._mentions(keyword, text, words):
+                        room_counts[room_type] = 1
+                        break
+
+        object_counts = defaultdict(int)
+        for obj_type, patterns in self.object_type_patterns.items():
+            match = self._first_match(patterns, text, stems)
+            if match:
+                object_counts[obj_type] = int(match.group(1))
+        for keywords in self.object_keywords.values():
+            for keyword in keywords:
+                if keyword not in object_counts and self._mentions(keyword, text, words):
+                    object_counts[keyword] = 1
+
+        return room_counts, object_counts, numeric_values
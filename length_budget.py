@@ -0,0 +1,146 @@
+#length_budget
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+from house_format import encode_compact
+from house_grammar import house_to_target_text
+
+DEFAULT_PREDICTOR_FILE = "length_predictor.json"
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "single": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+COUNT = r'(\d+|' + '|'.join(NUMBER_WORDS) + r')'
+
+ROOM_WORDS = r'(?:bed|bath|living|dining|family|guest|laundry|storage)?\s?(?:room|kitchen|hallway|hall|office|closet|study)s?'
+TOTAL_ROOMS_PATTERN = re.compile(COUNT + r'[\s-]+(?:total\s+)?rooms?\b', re.IGNORECASE)
+ROOM_COUNT_PATTERN = re.compile(COUNT + r'[\s-]+' + ROOM_WORDS + r'\b', re.IGNORECASE)
+TOTAL_OBJECTS_PATTERN = re.compile(COUNT + r'[\s-]+(?:objects?|items?|pieces|furnishings)\b', re.IGNORECASE)
+COUNTED_NOUN_PATTERN = re.compile(r'\b' + COUNT + r'[\s-]+([a-z]+)', re.IGNORECASE)
+# Counted nouns that describe the house itself rather than objects in it
+NON_OBJECT_NOUNS = {"house", "home", "apartment", "floor", "floors", "story", "stories", "level", "levels"}
+
+
+def _count_value(token):
+    token = token.lower()
+    return int(token) if token.isdigit() else NUMBER_WORDS.get(token, 0)
+
+
+def parse_requested_counts(description):
+    """Room and object counts asked for in a description (0 when not stated).
+
+    An explicit "N rooms" wins over per-room counts ("2 bedrooms, 1 kitchen"),
+    and "N objects/items" over counted nouns that are not rooms.
+    """
+    match = TOTAL_ROOMS_PATTERN.search(description)
+    if match:
+        rooms = _count_value(match.group(1))
+    else:
+        rooms = sum(_count_value(m.group(1)) for m in ROOM_COUNT_PATTERN.finditer(description))
+
+    match = TOTAL_OBJECTS_PATTERN.search(description)
+    if match:
+        objects = _count_value(match.group(1))
+    else:
+        room_spans = [m.span() for m in ROOM_COUNT_PATTERN.finditer(description)]
+        room_spans += [m.span() for m in TOTAL_ROOMS_PATTERN.finditer(description)]
+        objects = sum(
+            _count_value(m.group(1)) for m in COUNTED_NOUN_PATTERN.finditer(description)
+            if m.group(2).lower() not in NON_OBJECT_NOUNS
+            and not any(start <= m.start(1) < end for start, end in room_spans)
+        )
+    return rooms, objects
+
+
+def length_features(description):
+    """Feature row used by LengthPredictor: bias, rooms, objects, description words."""
+    rooms, objects = parse_requested_counts(description)
+    return [1.0, float(rooms), float(objects), float(len(description.split()))]
+
+
+class LengthPredictor:
+    """Predicts how many target tokens a description's house output needs.
+
+    A least-squares fit of target token count on length_features(), plus a
+    multiplicative margin taken from a high quantile of actual/predicted
+    ratios on the training targets, so the budget covers almost every real
+    output while staying far below a fixed worst-case limit.
+    """
+
+    def __init__(self, coefficients, margin=1.0, min_tokens=32, max_tokens=512):
+        self.coefficients = list(coefficients)
+        self.margin = margin
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def fit(cls, descriptions, token_counts, quantile=0.98, **kwargs):
+        """Fit on descriptions and the token counts of their training targets."""
+        features = np.array([length_features(d) for d in descriptions])
+        counts = np.array(token_counts, dtype=float)
+        coefficients, *_ = np.linalg.lstsq(features, counts, rcond=None)
+        predicted = np.maximum(features @ coefficients, 1.0)
+        margin = max(1.0, float(np.quantile(counts / predicted, quantile)))
+        return cls(coefficients.tolist(), margin, **kwargs)
+
+    @classmethod
+    def fit_from_jsonl(cls, dataset_file, tokenizer, output_format="json", max_examples=None, **kwargs):
+        """Fit on a training JSONL of nl_description/house_json records, serialized like the notebook does."""
+        descriptions = []
+        targets = []
+        with open(dataset_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    example = json.loads(line)
+                    target = house_to_target_text(example["house_json"])
+                    if output_format == "compact":
+                        target = encode_compact(json.loads(target))
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    continue
+                descriptions.append(example["nl_description"])
+                targets.append(target)
+                if max_examples and len(descriptions) >= max_examples:
+                    break
+        if not descriptions:
+            raise ValueError(f"No training examples found in {dataset_file}")
+
+        # Counted with EOS, like the labels the model was trained on
+        token_counts = [len(ids) for ids in tokenizer(targets, verbose=False)["input_ids"]]
+        predictor = cls.fit(descriptions, token_counts, **kwargs)
+        print(f"Fitted length predictor on {len(descriptions)} targets "
+              f"(mean {np.mean(token_counts):.0f} tokens, margin x{predictor.margin:.2f})")
+        return predictor
+
+    def predict(self, description):
+        """Token budget for one description, clamped to [min_tokens, max_tokens]."""
+        expected = float(np.dot(self.coefficients, length_features(description)))
+        budget = math.ceil(max(expected, 1.0) * self.margin)
+        return int(min(self.max_tokens, max(self.min_tokens, budget)))
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "coefficients": self.coefficients,
+                "margin": self.margin,
+                "min_tokens": self.min_tokens,
+                "max_tokens": self.max_tokens,
+            }, f, indent=2)
+        print(f"Length predictor saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data["coefficients"], data["margin"], data["min_tokens"], data["max_tokens"])
+
+
+def default_predictor_path(model_path):
+    return os.path.join(model_path, DEFAULT_PREDICTOR_FILE)
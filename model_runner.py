@@ -1,65 +1,566 @@
 #model_runner
-import torch
+import gc
 import json
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 import argparse
 import sys
 import os
 import time
 import re
+import threading
+from json_stream import HouseStreamTracker, HouseCloseDetector
+from house_grammar import HouseGrammarLogitsProcessor, restore_house_json, token_surface_texts
+from quantization import SUPPORTED_MODES, checkpoint_fingerprint, load_quantized_model, model_size_mb
+from onnx_backend import OnnxSeq2SeqGenerator, OnnxTokenizer, export_onnx
+from generation_cache import GenerationCache, DEFAULT_CACHE_PATH
+from speculative import TemplateDraftIndex, speculative_greedy_generate
+from house_format import decode_compact
+from json_repair import repair_house_json
+from length_budget import LengthPredictor, DEFAULT_PREDICTOR_FILE, default_predictor_path
+from generation_stats import (GenerationStats, MetricsLog, RssPeakSampler, StageTimer, current_rss_mb,
+                              peak_memory_mb, reset_peak_memory)
+from decoding_profiles import (
+    DECODING_PROFILES,
+    DEFAULT_PROFILE,
+    GREEDY_PROFILE,
+    check_profile,
+    choose_profile,
+    is_sampling,
+    load_benchmark
+)
+
+# torch and transformers (which imports torch itself) are only imported on the
+# torch backend's code paths, so an onnx backend process never loads them. The
+# stopping criteria below are plain callables for the same reason:
+# StoppingCriteriaList only calls them.
+
+class TrackerStoppingCriteria:
+    """Stop generation as soon as the stream tracker flags the output as degenerate."""
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.tracker.aborted
+
+class HouseClosedStoppingCriteria:
+    """Stop each sequence as soon as its top-level house value is closed.
+
+    Close detectors are cached per token prefix, like the grammar states of
+    HouseGrammarLogitsProcessor, so every step only feeds the newest token.
+    Create a new instance for every generate() call.
+    """
+    def __init__(self, token_texts, output_format="json"):
+        self.token_texts = token_texts
+        self.output_format = output_format
+        self._detectors = {}
+
+    def _detector_for(self, prefix):
+        if prefix in self._detectors:
+            return self._detectors[prefix]
+        parent = prefix[:-1]
+        if parent in self._detectors:
+            detector = self._detectors[parent].copy()
+            tokens = prefix[-1:]
+        else:
+            # First step or reordered beams: replay the prefix, skipping the decoder start token
+            detector = HouseCloseDetector(self.output_format)
+            tokens = prefix[1:]
+        for token_id in tokens:
+            text = self.token_texts[token_id] if token_id < len(self.token_texts) else None
+            if text:
+                detector.feed(text)
+        return detector
+
+    def __call__(self, input_ids, scores, **kwargs):
+        detectors = {}
+        closed = []
+        for ids in input_ids.tolist():
+            prefix = tuple(ids)
+            detector = self._detector_for(prefix)
+            detectors[prefix] = detector
+            closed.append(detector.closed)
+        self._detectors = detectors
+        return input_ids.new_tensor(closed).bool()
 
 class HouseModelInference:
-    def __init__(self, model_path, device=None):
-        """Initialize the model for house layout generation from text description."""
+    def __init__(self, model_path, device=None, constrained=False, quantize=None, backend="torch", cache=None,
+                 draft_index=None, output_format="json", length_predictor=None, stop_on_close=False,
+                 profile=DEFAULT_PROFILE, metrics_log=None, profile_benchmark=None):
+        """Initialize the model for house layout generation from text description.
+
+        With constrained=True, decoding is restricted to the house grammar in
+        house_grammar.py and returned text has its object braces restored,
+        so it parses as JSON without repair. quantize="int8" loads a
+        dynamically quantized CPU model, cached next to the checkpoint.
+        backend="onnx" runs greedy decoding on onnxruntime instead of torch;
+        model_path must then be a directory written by export_onnx().
+        Pass a GenerationCache as `cache` to reuse outputs for repeated prompts.
+        With a TemplateDraftIndex as `draft_index`, decoding is greedy and
+        speculative: drafted template tokens are verified in one decoder pass.
+        output_format="compact" is for checkpoints trained on house_format.py
+        compact targets; their output is decoded back to house JSON text.
+        A LengthPredictor as `length_predictor` sets the decode budget from the
+        room/object counts in each description instead of max_target_length,
+        and stop_on_close=True ends torch decoding as soon as the top-level
+        house value is closed. `profile` names the default entry of
+        DECODING_PROFILES used by generate_house_text() and generate_batch();
+        with `profile_benchmark` results from decoding_profiles.py, a call
+        can pass latency_budget instead to get the best profile that fits it.
+        Every generate call leaves a GenerationStats in `last_stats`; with a
+        file path as `metrics_log`, load and generate stats are also appended
+        to it as JSON lines.
+        """
         self.model_path = model_path
         self.max_length = 256  # From training script (adjust if needed)
         self.max_target_length = 512  # From training script (adjust if needed)
+        self.backend = backend
+        self.constrained = constrained
+        self.quantize = quantize
+        self.cache = cache
+        self.draft_index = draft_index
+        self.output_format = output_format
+        self.length_predictor = length_predictor
+        self.stop_on_close = stop_on_close
+        self.profile = check_profile(profile)
+        self.profile_benchmark = profile_benchmark
+        self._token_texts = None
+        self.checkpoint_hash = checkpoint_fingerprint(model_path) if cache is not None else None
+        self.metrics_log = MetricsLog(metrics_log) if metrics_log else None
+        self.last_stats = None
+        self.load_time = None
+        load_start = time.perf_counter()
+
+        if draft_index is not None and (constrained or backend != "torch"):
+            raise ValueError("Speculative decoding needs the torch backend without constrained decoding")
+        if output_format not in ("json", "compact"):
+            raise ValueError(f"Unknown output format: {output_format} (expected 'json' or 'compact')")
+        if output_format == "compact" and constrained:
+            raise ValueError("Constrained decoding follows the JSON grammar and can't produce compact output")
+
+        if backend == "onnx":
+            if constrained or quantize:
+                raise ValueError("The onnx backend supports neither constrained decoding nor quantization")
+            self.device = "cpu"
+            print(f"Loading ONNX model from {model_path}...")
+            try:
+                self.tokenizer = OnnxTokenizer(model_path)
+                self.model = None
+                self.onnx_generator = OnnxSeq2SeqGenerator(model_path)
+                print("ONNX model loaded successfully on CPUExecutionProvider")
+            except Exception as e:
+                print(f"Error loading ONNX model: {e}")
+                sys.exit(1)
+            self._record_load(load_start)
+            return
+        if backend != "torch":
+            raise ValueError(f"Unknown backend: {backend} (expected 'torch' or 'onnx')")
+
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if quantize and self.device != "cpu":
+            print(f"Quantized {quantize} inference only runs on CPU, ignoring device {self.device}")
+            self.device = "cpu"
 
         # Load tokenizer and model
         print(f"Loading model from {model_path}...")
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
+            if quantize:
+                self.model = load_quantized_model(model_path, quantize)
+            else:
+                self.model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
             self.model.to(self.device)
             print(f"Model loaded successfully on {self.device}")
         except Exception as e:
             print(f"Error loading model: {e}")
             sys.exit(1)
+        self._record_load(load_start)
+
+    def _record_load(self, load_start):
+        self.load_time = time.perf_counter() - load_start
+        if self.metrics_log is not None:
+            self.metrics_log.write(
+                "load", model_path=self.model_path, backend=self.backend, device=str(self.device),
+                quantize=self.quantize, load_time=self.load_time,
+                peak_memory_mb=peak_memory_mb(self.device)
+            )
+
+    def generate_house_text(self, text_description, max_length=None, profile=None, return_stats=False,
+                            latency_budget=None):
+        """Generate raw house text from natural language description.
 
-    def generate_house_text(self, text_description):
-        """Generate raw house text from natural language description."""
+        latency_budget (seconds) overrides profile with the best benchmarked
+        profile that fits it. With return_stats=True, returns (raw_text, GenerationStats).
+        """
         print(f"Generating house layout for: '{text_description[:100]}...'")
+        profile = self._resolve_profile(profile, latency_budget)
+        stats = GenerationStats(1, self.backend, self._effective_profile(profile))
+        start = time.perf_counter()
+        raw_text = None
 
-        # Prepare input
-        inputs = self.tokenizer(
+        max_length = self._length_limit([text_description], max_length)
+        cache_key = self._cache_key(text_description, max_length, profile)
+        if cache_key is not None:
+            raw_text = self.cache.get(cache_key)
+            if raw_text is not None:
+                print("Using cached generation")
+                stats.cached = 1
+
+        if raw_text is None:
+            # Prepare input
+            inputs = self._tokenize([text_description], stats)
+
+            # Generate output text
+            reset_peak_memory(self.device)
+            try:
+                # Get the raw text output
+                raw_text = self._generate(inputs, max_length, profile, stats)[0]
+                if cache_key is not None:
+                    self.cache.put(cache_key, raw_text)
+            except Exception as e:
+                print(f"Error during generation: {e}")
+
+        self._record_stats(stats, start, "generate")
+        return (raw_text, stats) if return_stats else raw_text
+
+    def warmup(self, text_description, max_length):
+        """Run one short, uncached generation to initialise kernels and allocators."""
+        self._generate(self._tokenize([text_description]), max_length)
+
+    def generate_batch(self, descriptions, batch_size=8, max_length=None, profile=None, return_stats=False,
+                       latency_budget=None):
+        """Generate raw house text for many descriptions, returned in input order.
+
+        Prompts are sorted by token length and grouped into batches of similar
+        length, and each batch is padded only to its own longest prompt. With
+        a length predictor, a batch only holds prompts with the same decode
+        budget, so every output is cached under the limit it was generated with.
+        Failed batches leave None in the corresponding result slots.
+        latency_budget works as in generate_house_text(). With
+        return_stats=True, returns (results, GenerationStats for the whole call).
+        """
+        descriptions = list(descriptions)
+        profile = self._resolve_profile(profile, latency_budget)
+        results = [None] * len(descriptions)
+        stats = GenerationStats(len(descriptions), self.backend, self._effective_profile(profile))
+        start_time = time.perf_counter()
+        limits = [self._length_limit([description], max_length) for description in descriptions]
+        cache_keys = [
+            self._cache_key(description, limit, profile) for description, limit in zip(descriptions, limits)
+        ]
+
+        # Only prompts that miss the cache go to the model
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            if cache_key is not None:
+                results[i] = self.cache.get(cache_key)
+            if results[i] is None:
+                pending.append(i)
+        stats.cached = len(descriptions) - len(pending)
+        if not pending:
+            self._record_stats(stats, start_time, "generate_batch")
+            return (results, stats) if return_stats else results
+
+        # Bucket prompts by token length so each batch needs as little padding as possible
+        lengths = [
+            len(ids) for ids in self.tokenizer(
+                [descriptions[i] for i in pending], max_length=self.max_length, truncation=True
+            )["input_ids"]
+        ]
+        order = [pending[j] for j in sorted(range(len(pending)), key=lambda j: (limits[pending[j]], lengths[j]))]
+        batches = []
+        for i in order:
+            if batches and len(batches[-1]) < batch_size and limits[batches[-1][0]] == limits[i]:
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+
+        print(f"Generating {len(order)} house layouts in batches of {batch_size} "
+              f"({len(descriptions) - len(order)} cached)...")
+        # One measurement for the whole call, so the peak covers every batch
+        reset_peak_memory(self.device)
+        start = 0
+        for batch_indices in batches:
+            batch_descriptions = [descriptions[i] for i in batch_indices]
+            inputs = self._tokenize(batch_descriptions, stats)
+            try:
+                raw_texts = self._generate(inputs, limits[batch_indices[0]], profile, stats)
+            except Exception as e:
+                print(f"Error during batch generation at prompts {start}-{start + len(batch_indices) - 1}: {e}")
+            else:
+                for i, raw_text in zip(batch_indices, raw_texts):
+                    results[i] = raw_text
+                    if cache_keys[i] is not None:
+                        self.cache.put(cache_keys[i], raw_text)
+            start += len(batch_indices)
+
+        self._record_stats(stats, start_time, "generate_batch")
+        return (results, stats) if return_stats else results
+
+    def stream_house_text(self, text_description, tracker=None, max_length=None):
+        """Yield decoded text chunks as tokens are generated.
+
+        Streaming uses greedy decoding. Every chunk is fed to `tracker` (a
+        HouseStreamTracker by default); once it flags the output as
+        degenerate, decoding stops and the generator ends early. Check
+        `tracker.aborted` afterwards to tell an early abort from a normal end.
+        Chunks are the model's raw text (brace-less in constrained mode,
+        compact with output_format="compact"); pass the joined text through
+        decode_output() to get house JSON text. `last_stats` is set once the
+        generator is exhausted.
+        """
+        if self.backend != "torch":
+            raise ValueError("Streaming generation needs the torch backend")
+        tracker = tracker if tracker is not None else HouseStreamTracker()
+        print(f"Streaming house layout for: '{text_description[:100]}...'")
+        stats = GenerationStats(1, self.backend, GREEDY_PROFILE)
+        start = time.perf_counter()
+        max_length = self._length_limit([text_description], max_length)
+
+        # Streams are greedy and brace-less, so they get their own cache entries
+        cache_key = self._cache_key(text_description, max_length, GREEDY_PROFILE, stream=True)
+        if cache_key is not None:
+            raw_text = self.cache.get(cache_key)
+            if raw_text is not None:
+                print("Using cached generation")
+                tracker.feed(raw_text)
+                stats.cached = 1
+                self._record_stats(stats, start, "stream")
+                yield raw_text
+                return
+
+        import torch
+        from transformers import TextIteratorStreamer
+
+        inputs = self._tokenize([text_description], stats)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_kwargs = dict(
+            **inputs,
+            max_length=max_length or self.max_target_length,
+            num_beams=1,
+            do_sample=False,
+            streamer=streamer,
+            stopping_criteria=self._stopping_criteria(TrackerStoppingCriteria(tracker)),
+            logits_processor=self._logits_processors()
+        )
+
+        errors = []
+
+        def _run():
+            try:
+                with torch.no_grad(), StageTimer(self.model, stats, self.device):
+                    self.model.generate(**generation_kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        reset_peak_memory(self.device)
+        generate_start = time.perf_counter()
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        for chunk in streamer:
+            tracker.feed(chunk)
+            yield chunk
+        thread.join()
+        stats.generate_time = time.perf_counter() - generate_start
+        # Greedy decoding produces one token per decoder step
+        stats.tokens_generated = len(stats.decoder_step_times)
+        self._record_stats(stats, start, "stream")
+
+        if errors:
+            print(f"Error during streaming generation: {errors[0]}")
+        elif tracker.aborted:
+            print(f"Generation aborted after {len(tracker.text)} characters: {tracker.abort_reason}")
+        elif cache_key is not None:
+            self.cache.put(cache_key, tracker.text)
+
+    def _cache_key(self, text_description, max_length, profile=None, stream=False):
+        """Cache key for a prompt under this model and decoding setup.
+
+        None without a cache, and for sampling profiles, whose outputs are
+        meant to differ between calls.
+        """
+        profile = self._effective_profile(profile)
+        if self.cache is None or is_sampling(profile):
+            return None
+        return self.cache.make_key(
             text_description,
-            return_tensors="pt",
-            padding="max_length",
+            self.checkpoint_hash,
+            profile=profile,
+            max_length=max_length or self.max_target_length,
+            constrained=self.constrained,
+            output_format=self.output_format,
+            stop_on_close=self.stop_on_close,
+            quantize=self.quantize,
+            backend=self.backend,
+            stream=stream
+        )
+
+    def _tokenize(self, texts, stats=None):
+        """Tokenize prompts, padding only to the longest prompt in the list."""
+        start = time.perf_counter()
+        inputs = self.tokenizer(
+            texts,
+            return_tensors="pt" if self.backend == "torch" else "np",
+            padding="longest",
             max_length=self.max_length,
             truncation=True
         )
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        if self.backend != "torch":
+            inputs = dict(inputs)
+        else:
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        if stats is not None:
+            stats.tokenize_time += time.perf_counter() - start
+        return inputs
 
-        # Generate output text
-        try:
-            with torch.no_grad():
+    def _record_stats(self, stats, start, event):
+        """Finish a stats object, keep it as last_stats and log it."""
+        stats.total_time = time.perf_counter() - start
+        if stats.generate_time:
+            stats.peak_memory_mb = peak_memory_mb(self.device)
+        self.last_stats = stats
+        if self.metrics_log is not None:
+            self.metrics_log.write(event, **stats.to_dict())
+
+    def _resolve_profile(self, profile=None, latency_budget=None):
+        """Profile requested for one call: the best benchmarked one within latency_budget seconds, if given."""
+        if latency_budget is None:
+            return profile
+        if self.profile_benchmark is None:
+            raise ValueError("A latency budget needs profile_benchmark results from decoding_profiles.py")
+        profile = choose_profile(self.profile_benchmark, latency_budget)
+        print(f"Using decoding profile {profile} for a {latency_budget:.3f}s latency budget")
+        return profile
+
+    def _effective_profile(self, profile=None):
+        """The profile a call actually decodes with; the onnx backend and speculative decoding are greedy-only."""
+        if self.backend == "onnx" or self.draft_index is not None:
+            return GREEDY_PROFILE
+        return check_profile(profile or self.profile)
+
+    def _length_limit(self, descriptions, max_length=None):
+        """Decoder length limit for a group of prompts: explicit, predicted or the training maximum."""
+        if max_length:
+            return max_length
+        if self.length_predictor is not None:
+            # +1 for the decoder start token, which max_length counts
+            return max(self.length_predictor.predict(description) for description in descriptions) + 1
+        return self.max_target_length
+
+    @property
+    def token_texts(self):
+        """Surface text of every token id, built once per model."""
+        if self._token_texts is None:
+            self._token_texts = token_surface_texts(self.tokenizer)
+        return self._token_texts
+
+    def _logits_processors(self):
+        """Fresh logits processors for one generate() call."""
+        from transformers import LogitsProcessorList
+
+        processors = LogitsProcessorList()
+        if self.constrained:
+            processors.append(HouseGrammarLogitsProcessor(self.tokenizer, token_texts=self.token_texts))
+        return processors
+
+    def _stopping_criteria(self, *extra):
+        """Fresh stopping criteria for one generate() call."""
+        from transformers import StoppingCriteriaList
+
+        criteria = StoppingCriteriaList(extra)
+        if self.stop_on_close:
+            criteria.append(HouseClosedStoppingCriteria(self.token_texts, self.output_format))
+        return criteria
+
+    def _generate(self, inputs, max_length=None, profile=None, stats=None):
+        """Run generation on tokenized inputs and decode every sequence.
+
+        The onnx backend and speculative decoding always decode greedily.
+        Encoder/decoder timings and generated token counts go into `stats`;
+        callers reset the peak memory measurement themselves.
+        """
+        stats = stats if stats is not None else GenerationStats()
+        start = time.perf_counter()
+        if self.draft_index is not None:
+            raw_texts = self._generate_speculative(inputs, max_length, stats)
+        elif self.backend == "onnx":
+            outputs = self.onnx_generator.generate(
+                inputs["input_ids"],
+                inputs["attention_mask"],
+                max_length or self.max_target_length,
+                stats=stats
+            )
+            # Everything after the decoder start token that isn't padding
+            stats.tokens_generated += int((outputs[:, 1:] != self.onnx_generator.pad_token_id).sum())
+            raw_texts = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        else:
+            import torch
+
+            with torch.no_grad(), StageTimer(self.model, stats, self.device):
                 outputs = self.model.generate(
                     **inputs,
-                    max_length=self.max_target_length,
-                    num_beams=2,
-                    early_stopping=True
+                    max_length=max_length or self.max_target_length,
+                    **DECODING_PROFILES[self._effective_profile(profile)],
+                    logits_processor=self._logits_processors(),
+                    stopping_criteria=self._stopping_criteria()
                 )
+            stats.tokens_generated += int((outputs[:, 1:] != self.tokenizer.pad_token_id).sum())
+            raw_texts = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        stats.generate_time += time.perf_counter() - start
+        return [self.decode_output(raw_text) for raw_text in raw_texts]
 
-            # Get the raw text output
-            raw_text = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)[0]
-            return raw_text
-        except Exception as e:
-            print(f"Error during generation: {e}")
-            return None
+    def decode_output(self, raw_text):
+        """Turn raw model text into house JSON text for the configured decoding mode."""
+        if self.constrained:
+            return restore_house_json(raw_text)
+        if self.output_format == "compact":
+            try:
+                return json.dumps(decode_compact(raw_text))
+            except ValueError as e:
+                # Leave it to fix_json_string() and the template fallback
+                print(f"Could not decode compact output: {e}")
+        return raw_text
+
+    def _generate_speculative(self, inputs, max_length=None, stats=None):
+        """Greedy generation with template drafts, one prompt at a time."""
+        import torch
+
+        stats = stats if stats is not None else GenerationStats()
+        raw_texts = []
+        with torch.no_grad(), StageTimer(self.model, stats, self.device):
+            for row in range(inputs["input_ids"].shape[0]):
+                sequence, passes = speculative_greedy_generate(
+                    self.model,
+                    inputs["input_ids"][row:row + 1],
+                    inputs["attention_mask"][row:row + 1],
+                    self.draft_index,
+                    max_length or self.max_target_length
+                )
+                print(f"Speculative decoding: {len(sequence) - 1} tokens in {passes} decoder passes")
+                stats.tokens_generated += len(sequence) - 1
+                raw_texts.append(self.tokenizer.decode(sequence, skip_special_tokens=True))
+        return raw_texts
 
 def fix_json_string(raw_text):
-    """Attempt to fix common JSON formatting issues in the model output."""
+    """Attempt to fix common JSON formatting issues in the model output.
+
+    Valid JSON is returned untouched; anything else goes through the
+    schema-aware single-pass parser in json_repair and comes back as JSON.
+    """
+    text = raw_text.strip()
+    if text.startswith('{') and text.endswith('}'):
+        try:
+            json.loads(text)
+            return raw_text
+        except json.JSONDecodeError:
+            pass
+    house, _ = repair_house_json(raw_text)
+    return json.dumps(house)
+
+def fix_json_string_regex(raw_text):
+    """The regex-chain repair fix_json_string() used before json_repair, kept for comparison."""
     # Check if the string already has proper JSON formatting
     if raw_text.strip().startswith('{') and raw_text.strip().endswith('}'):
         return raw_text
@@ -121,25 +622,259 @@ def attempt_json_parse(text):
         print(f"JSON parsing error: {e}")
         return None
 
+def is_house(house):
+    """True for a parsed house with at least one room.
+
+    fix_json_string() always returns parseable JSON ("{}" for unusable
+    text), so parsing alone says nothing about whether repair succeeded.
+    """
+    return isinstance(house, dict) and bool(house.get("rooms"))
+
+def validate_with_templates(text, template_file, output_path):
+    """Skip JSON repair and pick the closest ProcTHOR template for text."""
+    # Imported lazily: the validator pulls in nltk/sklearn and loads the template corpus
+    from validator import ProcTHORValidator
+
+    validator = ProcTHORValidator(template_file=template_file)
+    house = validator.validate(text)
+    if not save_text_file(json.dumps(house, indent=2), output_path):
+        return 1
+    print(f"Template fallback JSON saved to {output_path}")
+    return 0
+
+def compare_quantization(model_path, descriptions, mode="int8"):
+    """Print fp32 vs quantized load time, latency, model size, memory and JSON parse rate.
+
+    Memory is the process RSS: how much loading the mode added, and the
+    peak sampled while it loaded and generated. RSS the previous mode's
+    allocator kept is part of the second mode's baseline, so compare the
+    load increase rather than absolute values.
+    """
+    results = {}
+    for label, quantize in (("fp32", None), (mode, mode)):
+        gc.collect()
+        rss_before = current_rss_mb()
+        # A sampler of its own: generate calls reset the shared per-generation one
+        sampler = RssPeakSampler()
+        sampler.reset()
+        start = time.perf_counter()
+        model = HouseModelInference(model_path, device="cpu", quantize=quantize)
+        load_time = time.perf_counter() - start
+        rss_after_load = current_rss_mb()
+
+        latencies = []
+        parsed = 0
+        for description in descriptions:
+            start = time.perf_counter()
+            raw_text = model.generate_house_text(description)
+            latencies.append(time.perf_counter() - start)
+            if raw_text and is_house(attempt_json_parse(fix_json_string(raw_text))):
+                parsed += 1
+
+        latencies.sort()
+        results[label] = {
+            "load time (s)": load_time,
+            "mean latency (s)": sum(latencies) / len(latencies),
+            "p95 latency (s)": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            "model size (MB)": model_size_mb(model.model),
+            "load RSS (MB)": rss_after_load - rss_before if rss_before is not None else float("nan"),
+            "peak RSS (MB)": sampler.read() or float("nan"),
+            "JSON parse rate": parsed / len(descriptions),
+        }
+        sampler.stop()
+        del model
+
+    print(f"\n{'metric':<20}{'fp32':>12}{mode:>12}")
+    for metric in results["fp32"]:
+        print(f"{metric:<20}{results['fp32'][metric]:>12.3f}{results[mode][metric]:>12.3f}")
+    return results
+
+def check_onnx_parity(model_path, onnx_dir, descriptions):
+    """Compare greedy PyTorch output with the ONNX backend; returns True if all texts match."""
+    backends = {
+        "torch": HouseModelInference(model_path, device="cpu"),
+        "onnx": HouseModelInference(onnx_dir, backend="onnx"),
+    }
+    timings = {name: 0.0 for name in backends}
+    mismatches = 0
+    for description in descriptions:
+        texts = {}
+        for name, model in backends.items():
+            start = time.perf_counter()
+            texts[name] = model._generate(model._tokenize([description]), profile=GREEDY_PROFILE)[0]
+            timings[name] += time.perf_counter() - start
+        if texts["torch"] != texts["onnx"]:
+            mismatches += 1
+            print(f"Mismatch for '{description[:60]}...':\n  torch: {texts['torch'][:120]}\n  onnx:  {texts['onnx'][:120]}")
+
+    for name, total in timings.items():
+        print(f"{name:<6} mean greedy latency: {total / len(descriptions):.3f}s")
+    print(f"{len(descriptions) - mismatches}/{len(descriptions)} outputs identical")
+    return mismatches == 0
+
+def run_batch(model, descriptions_file, output_path, batch_size, latency_budget=None):
+    """Generate raw outputs for every description in a file and save them as JSON lines."""
+    with open(descriptions_file, 'r') as f:
+        descriptions = [line.strip() for line in f if line.strip()]
+
+    start = time.perf_counter()
+    raw_texts = model.generate_batch(descriptions, batch_size=batch_size, latency_budget=latency_budget)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {len(descriptions)} outputs in {elapsed:.2f}s")
+    if model.last_stats is not None:
+        print(f"Generation stats: {model.last_stats.summary()}")
+    if model.cache is not None:
+        print(f"Generation cache: {model.cache.stats()}")
+
+    lines = [
+        json.dumps({"description": description, "raw_text": raw_text})
+        for description, raw_text in zip(descriptions, raw_texts)
+    ]
+    if not save_text_file("\n".join(lines) + "\n", output_path):
+        return 1
+    failed = sum(1 for raw_text in raw_texts if raw_text is None)
+    if failed:
+        print(f"{failed} descriptions failed to generate.")
+        return 1
+    return 0
+
 def main():
     parser = argparse.ArgumentParser(description="Generate house layout from text description")
     parser.add_argument("--model_path", type=str, required=True, help="Path to the trained model directory")
     parser.add_argument("--description", type=str, help="Text description of house layout")
+    parser.add_argument("--descriptions_file", type=str,
+                        help="Text file with one description per line; runs batched generation and "
+                             "writes JSON lines of raw outputs to --output_raw")
+    parser.add_argument("--batch_size", type=int, default=8,
+                        help="Prompts per batch when using --descriptions_file (default: 8)")
     parser.add_argument("--output_raw", type=str, default="generated_house_raw.txt",
                         help="Output file path for raw text (default: generated_house_raw.txt)")
     parser.add_argument("--output_json", type=str, default="generated_house.json",
                         help="Output file path for JSON (default: generated_house.json)")
+    parser.add_argument("--skip_warmup", action="store_true",
+                        help="Skip the warmup generation when loading the model")
+    parser.add_argument("--quantize", type=str, choices=SUPPORTED_MODES,
+                        help="Run a dynamically quantized CPU model (cached next to the checkpoint)")
+    parser.add_argument("--compare_quantization", action="store_true",
+                        help="Compare fp32 and --quantize (default int8) on --description or "
+                             "--descriptions_file and print latency, size, memory and JSON parse rate")
+    parser.add_argument("--backend", type=str, choices=("torch", "onnx"), default="torch",
+                        help="Inference backend; onnx expects --model_path to be an --export_onnx directory")
+    parser.add_argument("--export_onnx", type=str, metavar="DIR",
+                        help="Export --model_path to ONNX graphs in DIR and exit")
+    parser.add_argument("--check_onnx_parity", type=str, metavar="DIR",
+                        help="Check that greedy output of the ONNX export in DIR matches PyTorch and exit")
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH,
+                        help=f"Generation cache shared with the GUI (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--no_cache", action="store_true",
+                        help="Always run the model instead of reusing cached generations")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Greedy speculative decoding with drafts from --template_file house targets")
+    parser.add_argument("--draft_templates", type=int, default=500,
+                        help="Number of templates indexed for --speculative drafts (default: 500)")
+    parser.add_argument("--constrained", action="store_true",
+                        help="Restrict decoding to the house JSON grammar so output parses without repair")
+    parser.add_argument("--output_format", type=str, choices=("json", "compact"), default="json",
+                        help="Target format the checkpoint was trained on (see house_format.py)")
+    parser.add_argument("--length_predictor", type=str, metavar="PATH",
+                        help="Length predictor JSON used to budget decode length per description")
+    parser.add_argument("--fit_length_predictor", type=str, metavar="TRAIN_JSONL",
+                        help="Fit a length predictor on training data, save it to --length_predictor "
+                             f"(default: <model_path>/{DEFAULT_PREDICTOR_FILE}) and use it")
+    parser.add_argument("--stop_on_close", action="store_true",
+                        help="End decoding as soon as the top-level house value is closed")
+    parser.add_argument("--profile", type=str, choices=list(DECODING_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"Decoding profile (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--latency_budget", type=float, metavar="SECONDS",
+                        help="Pick the best profile whose p95 latency in --profile_benchmark fits this budget")
+    parser.add_argument("--profile_benchmark", type=str, default="profile_benchmark.json",
+                        help="Results written by decoding_profiles.py (default: profile_benchmark.json)")
+    parser.add_argument("--metrics_log", type=str, metavar="PATH",
+                        help="Append load and per-generation stage metrics to this JSON-lines file")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream tokens as they are generated and abort early on degenerate output")
+    parser.add_argument("--template_file", type=str, default="procthor_10k.jsonl",
+                        help="Template corpus used when a streamed generation is aborted and for "
+                             "--speculative drafts (default: procthor_10k.jsonl)")
 
     args = parser.parse_args()
 
-    # Initialize model
-    model = HouseModelInference(args.model_path)
+    if args.export_onnx:
+        export_onnx(args.model_path, args.export_onnx)
+        return 0
+
+    if args.compare_quantization or args.check_onnx_parity:
+        if args.descriptions_file:
+            with open(args.descriptions_file, 'r') as f:
+                descriptions = [line.strip() for line in f if line.strip()]
+        else:
+            descriptions = [args.description or input("Enter house description: ")]
+        if args.check_onnx_parity:
+            return 0 if check_onnx_parity(args.model_path, args.check_onnx_parity, descriptions) else 1
+        compare_quantization(args.model_path, descriptions, args.quantize or "int8")
+        return 0
+
+    # Initialize model through the shared service so other callers in this process reuse it
+    from model_service import get_model_service
+    draft_index = None
+    if args.speculative:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.model_path)
+        draft_index = TemplateDraftIndex.from_template_file(args.template_file, tokenizer, args.draft_templates,
+                                                            output_format=args.output_format)
+
+    length_predictor = None
+    if args.fit_length_predictor:
+        from transformers import AutoTokenizer
+        length_predictor = LengthPredictor.fit_from_jsonl(
+            args.fit_length_predictor, AutoTokenizer.from_pretrained(args.model_path), args.output_format
+        )
+        length_predictor.save(args.length_predictor or default_predictor_path(args.model_path))
+    elif args.length_predictor:
+        length_predictor = LengthPredictor.load(args.length_predictor)
+
+    # The profile itself is picked per generate call from the budget
+    profile_benchmark = None
+    if args.latency_budget is not None:
+        if not os.path.exists(args.profile_benchmark):
+            print(f"{args.profile_benchmark} not found; run decoding_profiles.py first to use --latency_budget")
+            return 1
+        profile_benchmark = load_benchmark(args.profile_benchmark)
+
+    service = get_model_service(args.model_path, warmup=not args.skip_warmup, draft_index=draft_index,
+                                profile=args.profile, profile_benchmark=profile_benchmark,
+                                metrics_log=args.metrics_log, length_predictor=length_predictor,
+                                stop_on_close=args.stop_on_close, constrained=args.constrained, quantize=args.quantize,
+                                backend=args.backend, output_format=args.output_format,
+                                cache=None if args.no_cache else GenerationCache(args.cache_path))
+    model = service.get()
+
+    if args.descriptions_file:
+        return run_batch(model, args.descriptions_file, args.output_raw, args.batch_size, args.latency_budget)
 
     # Get input text
     description = args.description if args.description else input("Enter house description: ")
 
     # Generate house raw text
-    raw_text = model.generate_house_text(description)
+    if args.stream:
+        tracker = HouseStreamTracker()
+        for chunk in model.stream_house_text(description, tracker=tracker):
+            print(chunk, end="", flush=True)
+        print()
+        raw_text = model.decode_output(tracker.text)
+
+        if tracker.aborted:
+            # Degenerate output won't survive repair, go straight to the template fallback
+            save_text_file(raw_text, args.output_raw)
+            print(f"Falling back to template validation: {tracker.abort_reason}")
+            return validate_with_templates(raw_text or description, args.template_file, args.output_json)
+    else:
+        raw_text = model.generate_house_text(description, latency_budget=args.latency_budget)
+
+    if model.cache is not None:
+        print(f"Generation cache: {model.cache.stats()}")
+    if model.last_stats is not None:
+        print(f"Generation stats: {model.last_stats.summary()}")
 
     if not raw_text:
         print("Failed to generate house layout text.")
@@ -159,7 +894,7 @@ def main():
     fixed_json_text = fix_json_string(raw_text)
     json_obj = attempt_json_parse(fixed_json_text)
 
-    if json_obj:
+    if is_house(json_obj):
         print("\nSuccessfully parsed JSON after fixing format!")
         # Save the fixed JSON
         json_saved = save_text_file(json.dumps(json_obj, indent=2), args.output_json)  # Capture the return value
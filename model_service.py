@@ -0,0 +1,114 @@
+#model_service
+import gc
+import threading
+import time
+
+from model_runner import HouseModelInference
+
+# Short prompt used to push one generation through the model at startup so the
+# first real request does not pay for lazy kernel/allocator initialisation.
+WARMUP_DESCRIPTION = "A small house with 2 rooms: a kitchen and a bedroom."
+WARMUP_MAX_LENGTH = 16
+
+
+class ModelService:
+    """Process-wide holder for a single, warmed-up HouseModelInference."""
+
+    def __init__(self, model_path, device=None, warmup=True, **model_kwargs):
+        self.model_path = model_path
+        self.device = device
+        self.warmup = warmup
+        self.model_kwargs = model_kwargs
+        self.model = None
+        self.load_time = None
+        self.warmup_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self.model is not None
+
+    def get(self):
+        """Return the resident model, loading and warming it up on first use."""
+        with self._lock:
+            if self.model is None:
+                self._load()
+            return self.model
+
+    def _load(self):
+        start = time.perf_counter()
+        model = HouseModelInference(self.model_path, device=self.device, **self.model_kwargs)
+        self.load_time = time.perf_counter() - start
+        print(f"Model service: load took {self.load_time:.2f}s")
+
+        if self.warmup:
+            start = time.perf_counter()
+            model.warmup(WARMUP_DESCRIPTION, max_length=WARMUP_MAX_LENGTH)
+            self.warmup_time = time.perf_counter() - start
+            print(f"Model service: warmup took {self.warmup_time:.2f}s")
+
+        self.model = model
+
+    def unload(self):
+        """Drop the resident model and release its memory."""
+        with self._lock:
+            if self.model is None:
+                return
+            device = self.model.device
+            self.model = None
+            gc.collect()
+            if str(device).startswith("cuda"):
+                # Only torch models live on CUDA, so onnx services never import torch
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            print(f"Model service: unloaded {self.model_path}")
+
+    def stats(self):
+        """Return load/warmup timings for reporting."""
+        return {
+            "model_path": self.model_path,
+            "loaded": self.is_loaded,
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+        }
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def _freeze(value):
+    """Hashable stand-in for a keyword argument; objects such as a GenerationCache compare by identity."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def get_model_service(model_path, device=None, warmup=True, **model_kwargs):
+    """Return the shared ModelService for model_path and these settings, creating it if needed.
+
+    Extra keyword arguments are passed to HouseModelInference. Services are
+    keyed by model_path, device and those arguments, so asking for the same
+    checkpoint with different settings gets a separate model rather than
+    silently reusing the first one.
+    """
+    key = (model_path, device, _freeze(model_kwargs))
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = ModelService(model_path, device=device, warmup=warmup, **model_kwargs)
+            _services[key] = service
+        return service
+
+
+def unload_all():
+    """Unload every model held by this process."""
+    with _services_lock:
+        services = list(_services.values())
+    for service in services:
+        service.unload()
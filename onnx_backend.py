@@ -0,0 +1,196 @@
+#onnx_backend
+import json
+import os
+import time
+
+import numpy as np
+try:
+    import onnxruntime as ort
+except ImportError:  # Only needed for the onnx backend
+    ort = None
+
+# File names written by the optimum exporter for a seq2seq model with past key values
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+
+
+def export_onnx(model_path, output_dir):
+    """Export the checkpoint to encoder, decoder and decoder-with-past ONNX graphs.
+
+    Exporting needs torch and optimum; running the exported graphs with
+    OnnxSeq2SeqGenerator needs neither. The tokenizer is copied alongside so
+    output_dir can be used on its own as the ONNX model directory.
+    """
+    from optimum.exporters.onnx import main_export
+    from transformers import AutoTokenizer
+
+    print(f"Exporting {model_path} to ONNX in {output_dir}...")
+    main_export(
+        model_path,
+        output=output_dir,
+        task="text2text-generation-with-past",
+        no_post_process=True
+    )
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+    print(f"ONNX export saved to {output_dir}")
+
+
+def clean_up_tokenization(text):
+    """transformers' clean_up_tokenization: drop the space before punctuation and contractions."""
+    for old, new in ((" .", "."), (" ?", "?"), (" !", "!"), (" ,", ","), (" ' ", "'"), (" n't", "n't"),
+                     (" 'm", "'m"), (" 's", "'s"), (" 've", "'ve"), (" 're", "'re")):
+        text = text.replace(old, new)
+    return text
+
+
+class OnnxTokenizer:
+    """The tokenizer.json saved by export_onnx(), loaded with `tokenizers` instead of transformers.
+
+    transformers imports torch, which an ONNX-only process should not pay
+    for. Only what the onnx backend uses is covered: encoding with
+    truncation and padding to the longest text, and (batch_)decode with the
+    checkpoint's clean_up_tokenization_spaces setting.
+    """
+
+    def __init__(self, onnx_dir):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(onnx_dir, "tokenizer.json"))
+        config_path = os.path.join(onnx_dir, "tokenizer_config.json")
+        config = {}
+        if os.path.exists(config_path):
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+        self.clean_up_tokenization_spaces = config.get("clean_up_tokenization_spaces", False)
+        with open(os.path.join(onnx_dir, "config.json"), 'r') as f:
+            self.pad_token_id = json.load(f).get("pad_token_id", 0)
+
+    def __call__(self, texts, max_length=None, truncation=False, padding=False, return_tensors=None, **kwargs):
+        """Encode a text or list of texts into input_ids and attention_mask.
+
+        With return_tensors="np", sequences are right-padded with the pad
+        token to the longest one and returned as int64 arrays; otherwise as
+        lists of ids, like a transformers tokenizer.
+        """
+        single = isinstance(texts, str)
+        if truncation and max_length:
+            self.tokenizer.enable_truncation(max_length)
+        else:
+            self.tokenizer.no_truncation()
+        encodings = self.tokenizer.encode_batch([texts] if single else list(texts))
+        input_ids = [encoding.ids for encoding in encodings]
+        attention_mask = [encoding.attention_mask for encoding in encodings]
+
+        if return_tensors == "np" or padding:
+            longest = max(len(ids) for ids in input_ids)
+            input_ids = [ids + [self.pad_token_id] * (longest - len(ids)) for ids in input_ids]
+            attention_mask = [mask + [0] * (longest - len(mask)) for mask in attention_mask]
+        if return_tensors == "np":
+            input_ids = np.array(input_ids, dtype=np.int64)
+            attention_mask = np.array(attention_mask, dtype=np.int64)
+        elif single:
+            input_ids, attention_mask = input_ids[0], attention_mask[0]
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        ids = [int(token_id) for token_id in token_ids]
+        text = self.tokenizer.decode(ids, skip_special_tokens=skip_special_tokens)
+        return clean_up_tokenization(text) if self.clean_up_tokenization_spaces else text
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [self.decode(token_ids, skip_special_tokens) for token_ids in sequences]
+
+
+class OnnxSeq2SeqGenerator:
+    """Greedy encoder-decoder generation on onnxruntime's CPU execution provider."""
+
+    def __init__(self, onnx_dir, num_threads=None):
+        if ort is None:
+            raise ImportError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+        self.onnx_dir = onnx_dir
+
+        with open(os.path.join(onnx_dir, "config.json"), 'r') as f:
+            config = json.load(f)
+        self.decoder_start_token_id = config.get("decoder_start_token_id", 0)
+        self.eos_token_id = config.get("eos_token_id", 1)
+        self.pad_token_id = config.get("pad_token_id", 0)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(os.path.join(onnx_dir, ENCODER_FILE), options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(onnx_dir, DECODER_FILE), options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(
+            os.path.join(onnx_dir, DECODER_WITH_PAST_FILE), options, providers=providers
+        )
+
+        self.decoder_outputs = [o.name for o in self.decoder.get_outputs()]
+        self.decoder_with_past_outputs = [o.name for o in self.decoder_with_past.get_outputs()]
+        self.decoder_with_past_inputs = {i.name for i in self.decoder_with_past.get_inputs()}
+
+    @staticmethod
+    def _as_past(names, values, kind):
+        """Turn present.N.<kind>.key/value outputs into past_key_values.N.<kind>.* inputs."""
+        return {
+            name.replace("present", "past_key_values"): value
+            for name, value in zip(names, values)
+            if f".{kind}." in name
+        }
+
+    def generate(self, input_ids, attention_mask, max_length, stats=None):
+        """Greedy-decode a batch; returns int64 ids starting with the decoder start token.
+
+        Encoder and per-step decoder times are added to `stats` (a GenerationStats) if given.
+        """
+        input_ids = input_ids.astype(np.int64)
+        attention_mask = attention_mask.astype(np.int64)
+        start = time.perf_counter()
+        encoder_hidden_states = self.encoder.run(
+            None, {"input_ids": input_ids, "attention_mask": attention_mask}
+        )[0]
+        if stats is not None:
+            stats.encoder_time += time.perf_counter() - start
+
+        batch_size = input_ids.shape[0]
+        sequences = np.full((batch_size, 1), self.decoder_start_token_id, dtype=np.int64)
+        finished = np.zeros(batch_size, dtype=bool)
+
+        # First step runs the full decoder, which also returns the cross-attention cache
+        start = time.perf_counter()
+        outputs = self.decoder.run(None, {
+            "input_ids": sequences,
+            "encoder_attention_mask": attention_mask,
+            "encoder_hidden_states": encoder_hidden_states,
+        })
+        if stats is not None:
+            stats.decoder_step_times.append(time.perf_counter() - start)
+        logits = outputs[0]
+        encoder_past = self._as_past(self.decoder_outputs[1:], outputs[1:], "encoder")
+        decoder_past = self._as_past(self.decoder_outputs[1:], outputs[1:], "decoder")
+
+        while sequences.shape[1] < max_length:
+            next_tokens = logits[:, -1, :].argmax(axis=-1).astype(np.int64)
+            next_tokens = np.where(finished, self.pad_token_id, next_tokens)
+            sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all() or sequences.shape[1] >= max_length:
+                break
+
+            feed = {
+                "input_ids": next_tokens[:, None],
+                "encoder_attention_mask": attention_mask,
+                "encoder_hidden_states": encoder_hidden_states,
+                **encoder_past,
+                **decoder_past,
+            }
+            feed = {name: value for name, value in feed.items() if name in self.decoder_with_past_inputs}
+            start = time.perf_counter()
+            outputs = self.decoder_with_past.run(None, feed)
+            if stats is not None:
+                stats.decoder_step_times.append(time.perf_counter() - start)
+            logits = outputs[0]
+            decoder_past = self._as_past(self.decoder_with_past_outputs[1:], outputs[1:], "decoder")
+
+        return sequences
@@ -0,0 +1,75 @@
+#quantization
+import hashlib
+import io
+import os
+
+# torch and transformers are imported by the functions that need them, so
+# checkpoint_fingerprint() stays usable in ONNX-only processes.
+
+SUPPORTED_MODES = ("int8",)
+
+# Files whose change means anything derived from the checkpoint is stale
+CHECKPOINT_FILES = ("config.json", "model.safetensors", "pytorch_model.bin")
+CHECKPOINT_SUFFIXES = (".safetensors", ".bin", ".onnx")
+
+
+def checkpoint_fingerprint(model_path, salt=""):
+    """Hash the checkpoint file names, sizes and mtimes, plus an optional salt."""
+    digest = hashlib.sha256(salt.encode())
+    for name in sorted(os.listdir(model_path)):
+        if name in CHECKPOINT_FILES or name.endswith(CHECKPOINT_SUFFIXES):
+            stat = os.stat(os.path.join(model_path, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def quantize_model(model, mode="int8"):
+    """Dynamically quantize every nn.Linear (encoder, decoder and lm_head) of a CPU model."""
+    if mode not in SUPPORTED_MODES:
+        raise ValueError(f"Unsupported quantization mode: {mode} (expected one of {SUPPORTED_MODES})")
+    import torch
+
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized_model(model_path, mode="int8", cache_dir=None):
+    """Load a quantized model from the on-disk cache, quantizing and caching it on a miss."""
+    import torch
+    from transformers import AutoModelForSeq2SeqLM
+
+    cache_dir = cache_dir or model_path
+    cache_path = os.path.join(cache_dir, f"quantized_{mode}.pt")
+    # Quantized modules are pickled, so a torch upgrade also invalidates the cache
+    fingerprint = checkpoint_fingerprint(model_path, salt=torch.__version__)
+
+    if os.path.exists(cache_path):
+        try:
+            cached = torch.load(cache_path, weights_only=False)
+            if cached.get("fingerprint") == fingerprint:
+                print(f"Loaded cached {mode} model from {cache_path}")
+                return cached["model"]
+            print(f"Cached {mode} model at {cache_path} is stale, re-quantizing")
+        except Exception as e:
+            print(f"Could not read cached {mode} model at {cache_path}: {e}")
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
+    quantized = quantize_model(model, mode)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        torch.save({"fingerprint": fingerprint, "model": quantized}, cache_path)
+        print(f"Cached {mode} model at {cache_path}")
+    except Exception as e:
+        print(f"Could not cache {mode} model to {cache_path}: {e}")
+
+    return quantized
+
+
+def model_size_mb(model):
+    """Serialized size of the model's state dict in megabytes."""
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
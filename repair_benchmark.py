@@ -0,0 +1,182 @@
+#repair_benchmark
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+from house_grammar import house_to_target_text
+from json_repair import strip_braces
+
+# Corpus of malformed house strings built from real templates, and the
+# throughput / fidelity suite run over it. Every corruption imitates
+# something the model actually does: the T5 vocabulary drops object braces,
+# generation stops at the token limit mid-house, and commas go missing.
+# The corpus only depends on the template file and the seed, so numbers
+# from different runs are comparable.
+
+DEFAULT_SEED = 0
+
+
+def drop_commas(text, rng, rate=0.3):
+    """Remove each comma with probability rate."""
+    return "".join(char for char in text if char != "," or rng.random() >= rate)
+
+
+def truncate(text, rng, low=0.3, high=0.95):
+    """Cut the text at a random point between low and high of its length."""
+    return text[:int(len(text) * rng.uniform(low, high))]
+
+
+CORRUPTIONS = {
+    "braces": lambda text, rng: strip_braces(text),
+    "truncated": truncate,
+    "missing_commas": drop_commas,
+    "braces+truncated": lambda text, rng: truncate(strip_braces(text), rng),
+    "braces+missing_commas": lambda text, rng: drop_commas(strip_braces(text), rng),
+}
+
+
+def build_corpus(template_file, max_houses=1000, corruptions=None, seed=DEFAULT_SEED):
+    """Malformed samples {corruption, raw_text, original} from the first max_houses templates."""
+    rng = random.Random(seed)
+    corruptions = corruptions or list(CORRUPTIONS)
+    corpus = []
+    houses = 0
+    with open(template_file, 'r') as f:
+        for line in f:
+            if houses >= max_houses:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                target = house_to_target_text(json.loads(line).get("house_json", {}))
+            except (json.JSONDecodeError, AttributeError):
+                continue
+            houses += 1
+            original = json.loads(target)
+            for name in corruptions:
+                corpus.append({"corruption": name, "raw_text": CORRUPTIONS[name](target, rng), "original": original})
+    print(f"Built {len(corpus)} malformed samples from {houses} houses in {template_file}")
+    return corpus
+
+
+def _leaves(value, path=()):
+    """(path, value) pairs for every scalar in a JSON value, list positions included."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _leaves(item, path + (key,))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _leaves(item, path + (index,))
+    else:
+        yield path, json.dumps(value)
+
+
+def structural_fidelity(repaired, original):
+    """Share of the original's scalar values found at the same path in the repaired house (0..1)."""
+    expected = set(_leaves(original))
+    if not expected:
+        return 1.0
+    if not isinstance(repaired, dict):
+        return 0.0
+    return len(expected & set(_leaves(repaired))) / len(expected)
+
+
+def default_repairers():
+    """The model_runner pipeline (fix_json_string + attempt_json_parse) and the old regex chain it replaced."""
+    from model_runner import attempt_json_parse, fix_json_string, fix_json_string_regex
+    return {
+        "fix_json_string": lambda raw_text: attempt_json_parse(fix_json_string(raw_text)),
+        "regex chain": lambda raw_text: attempt_json_parse(fix_json_string_regex(raw_text)),
+    }
+
+
+def run_benchmark(corpus, repairers=None):
+    """Time every repairer over the corpus and score its output per corruption.
+
+    Returns {repairer: {corruption: metrics}}, with an "all" entry per
+    repairer. success_rate counts results that are a dict with rooms;
+    fidelity is structural_fidelity() averaged over every sample, failures
+    counting as 0.
+    """
+    repairers = repairers or default_repairers()
+    results = {}
+    for name, repair in repairers.items():
+        per_corruption = {}
+        # attempt_json_parse prints every parse error; keep that out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            for sample in corpus:
+                start = time.perf_counter()
+                repaired = repair(sample["raw_text"])
+                elapsed = time.perf_counter() - start
+                totals = per_corruption.setdefault(sample["corruption"], [0, 0.0, 0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+                if isinstance(repaired, dict) and repaired.get("rooms"):
+                    totals[2] += 1
+                    totals[3] += structural_fidelity(repaired, sample["original"])
+
+        per_corruption["all"] = [sum(totals[i] for totals in per_corruption.values()) for i in range(4)]
+        results[name] = {
+            corruption: {
+                "samples": count,
+                "repairs_per_sec": count / elapsed if elapsed else 0.0,
+                "success_rate": succeeded / count,
+                "fidelity": fidelity / count,
+            }
+            for corruption, (count, elapsed, succeeded, fidelity) in per_corruption.items()
+        }
+    return results
+
+
+def print_results(results):
+    print(f"\n{'repairer':<18}{'corruption':<24}{'repairs/s':>11}{'success':>9}{'fidelity':>10}")
+    for name, per_corruption in results.items():
+        for corruption, metrics in per_corruption.items():
+            print(f"{name:<18}{corruption:<24}{metrics['repairs_per_sec']:>11.0f}"
+                  f"{metrics['success_rate']:>9.1%}{metrics['fidelity']:>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON repair on corrupted ProcTHOR houses")
+    parser.add_argument("--template_file", type=str, default="procthor_10k.jsonl",
+                        help="Houses the corpus is built from (default: procthor_10k.jsonl)")
+    parser.add_argument("--max_houses", type=int, default=1000, help="Houses to corrupt (default: 1000)")
+    parser.add_argument("--corruptions", type=str, nargs="+", choices=list(CORRUPTIONS),
+                        help="Corruptions to apply (default: all)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help=f"Corpus seed (default: {DEFAULT_SEED})")
+    parser.add_argument("--save_corpus", type=str, help="Also write the corpus as JSON lines")
+    parser.add_argument("--output", type=str, default="repair_benchmark.json",
+                        help="Where to save the results (default: repair_benchmark.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.template_file):
+        print(f"Template file {args.template_file} not found!")
+        return 1
+
+    corpus = build_corpus(args.template_file, args.max_houses, args.corruptions, args.seed)
+    if not corpus:
+        print(f"No houses found in {args.template_file}")
+        return 1
+    if args.save_corpus:
+        with open(args.save_corpus, 'w', encoding='utf-8') as f:
+            for sample in corpus:
+                f.write(json.dumps(sample) + "\n")
+        print(f"Corpus saved to {args.save_corpus}")
+
+    results = run_benchmark(corpus)
+    print_results(results)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"template_file": args.template_file, "max_houses": args.max_houses,
+                   "seed": args.seed, "results": results}, f, indent=2)
+    print(f"\nResults saved to {os.path.abspath(args.output)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#speculative
+import json
+import os
+
+from house_grammar import house_to_target_text
+from house_format import encode_compact
+
+
+class TemplateDraftIndex:
+    """N-gram lookup over tokenized house targets used to draft decoder tokens.
+
+    Every n-gram (for each size in ngram_sizes) of every indexed token
+    sequence maps to where it first occurs; the tokens that follow that
+    occurrence are the draft. Lookups try the longest n-gram first, and fall
+    back to matching against the sequence generated so far (prompt lookup),
+    which catches the repeated object/position boilerplate within a house.
+    """
+
+    def __init__(self, token_sequences, ngram_sizes=(4, 3, 2)):
+        self.ngram_sizes = tuple(sorted(ngram_sizes, reverse=True))
+        self.sequences = [list(tokens) for tokens in token_sequences]
+        self.index = {n: {} for n in self.ngram_sizes}
+        for seq_idx, tokens in enumerate(self.sequences):
+            for n in self.ngram_sizes:
+                table = self.index[n]
+                for end in range(n, len(tokens)):
+                    table.setdefault(tuple(tokens[end - n:end]), (seq_idx, end))
+
+    @classmethod
+    def from_houses(cls, houses, tokenizer, output_format="json", **kwargs):
+        """Index houses serialized exactly like the training targets."""
+        texts = [house_to_target_text(house) for house in houses]
+        if output_format == "compact":
+            compact_texts = []
+            for text in texts:
+                try:
+                    compact_texts.append(encode_compact(json.loads(text)))
+                except ValueError:
+                    continue
+            texts = compact_texts
+        token_sequences = tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]
+        return cls(token_sequences, **kwargs)
+
+    @classmethod
+    def from_template_file(cls, template_file, tokenizer, max_templates=500, **kwargs):
+        """Index the house_json of the first max_templates ProcTHOR templates."""
+        houses = []
+        if os.path.exists(template_file):
+            with open(template_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        houses.append(json.loads(line).get("house_json", {}))
+                    except json.JSONDecodeError:
+                        continue
+                    if len(houses) >= max_templates:
+                        break
+        print(f"Indexed {len(houses)} templates from {template_file} for draft lookup")
+        return cls.from_houses(houses, tokenizer, **kwargs)
+
+    def propose(self, generated, num_tokens):
+        """Return up to num_tokens draft tokens continuing the generated ids."""
+        for n in self.ngram_sizes:
+            if len(generated) < n:
+                continue
+            key = tuple(generated[-n:])
+
+            hit = self.index[n].get(key)
+            if hit is not None:
+                seq_idx, end = hit
+                draft = self.sequences[seq_idx][end:end + num_tokens]
+                if draft:
+                    return draft
+
+            # Most recent earlier occurrence within the output itself
+            for start in range(len(generated) - n - 1, -1, -1):
+                if tuple(generated[start:start + n]) == key:
+                    draft = generated[start + n:start + n + num_tokens]
+                    if draft:
+                        return draft
+                    break
+        return []
+
+
+def speculative_greedy_generate(model, input_ids, attention_mask, draft_index, max_length, num_draft_tokens=10):
+    """Greedy decoding for one prompt that verifies drafted tokens in a single decoder pass.
+
+    Each step feeds the last accepted token plus a draft from draft_index,
+    keeps the longest draft prefix that matches the model's own argmax
+    predictions plus the model's next token, and crops the self-attention
+    cache back to the accepted length. The output is the plain greedy output.
+    Returns (token ids including the decoder start token, number of decoder passes).
+    """
+    import torch
+    from transformers import DynamicCache, EncoderDecoderCache
+
+    config = model.config
+    encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)
+    past_key_values = EncoderDecoderCache(DynamicCache(), DynamicCache())
+
+    sequence = [config.decoder_start_token_id]
+    next_input = [config.decoder_start_token_id]
+    passes = 0
+
+    while len(sequence) < max_length:
+        # Leave room for the model's own token after the draft
+        draft = draft_index.propose(sequence[1:], num_draft_tokens)[:max_length - len(sequence) - 1]
+
+        outputs = model(
+            encoder_outputs=encoder_outputs,
+            attention_mask=attention_mask,
+            decoder_input_ids=torch.tensor([next_input + draft], device=input_ids.device),
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        passes += 1
+        past_key_values = outputs.past_key_values
+        predicted = outputs.logits[0].argmax(dim=-1).tolist()
+
+        accepted = 0
+        while accepted < len(draft) and predicted[accepted] == draft[accepted]:
+            accepted += 1
+        new_tokens = draft[:accepted] + [predicted[accepted]]
+
+        if config.eos_token_id in new_tokens:
+            sequence.extend(new_tokens[:new_tokens.index(config.eos_token_id) + 1])
+            break
+        sequence.extend(new_tokens)
+
+        # The cache must hold every token except the one fed next
+        past_key_values.crop(len(sequence) - 1)
+        next_input = new_tokens[-1:]
+
+    return sequence[:max_length], passes
@@ -0,0 +1,169 @@
+#template_benchmark
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from template_index import (ARRAY_NAMES, SHARD_SIZE, TEXT_DIR, TemplateIndex, TemplateShard,
+                            TemplateTextIndex, _source_meta)
+
+# Validation latency as the template corpus grows. Larger corpora are made by
+# tiling the feature rows of a real template file until the requested size;
+# every tiled row keeps pointing at its source line, so validate() runs end
+# to end, including reading the selected house.
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_QUERIES = (
+    "A house with 3 rooms: 1 kitchen, 1 bedroom, 1 bathroom.",
+    "A two bedroom apartment with a living room, a sofa, a tv and 4 chairs.",
+    '"numRooms": 5, "rooms": ["roomType": "Kitchen", "objects": ["objectType": "Fridge"',
+    "A studio with a bed, a desk and a lamp.",
+    "6 rooms 2 floors with 2 bathrooms, 3 bedrooms and a kitchen with a table.",
+)
+
+
+def _source_rows(index):
+    """All feature rows of an index as in-memory arrays, count matrices padded to the full type lists"""
+    arrays = {}
+    for name in ARRAY_NAMES:
+        columns = [getattr(shard, name) for shard in index.shards]
+        if name == "room_count_matrix":
+            columns = [np.pad(c, ((0, 0), (0, len(index.room_types) - c.shape[1]))) for c in columns]
+        elif name == "object_count_matrix":
+            columns = [np.pad(c, ((0, 0), (0, len(index.object_types) - c.shape[1]))) for c in columns]
+        arrays[name] = np.concatenate(columns)
+    return arrays
+
+
+def tile_index(index, size, index_dir, shard_size=SHARD_SIZE, text_index=None):
+    """Save an index of size templates made by repeating index's rows, valid for the same template file
+
+    A text_index fitted on index is tiled the same way.
+    """
+    source = _source_rows(index)
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    shards = []
+    for number, start in enumerate(range(0, size, shard_size)):
+        rows = np.arange(start, min(start + shard_size, size)) % len(index)
+        shard = TemplateShard(start, {name: source[name][rows] for name in ARRAY_NAMES})
+        shard_dir = os.path.join(index_dir, f"shard_{number:05d}")
+        shard.save(shard_dir)
+        shards.append(TemplateShard.load(start, shard_dir))
+    tiled = TemplateIndex(index.template_file, shards, index.room_types, index.object_types)
+    source_meta = _source_meta(index.template_file, None)
+    tiled.save_meta(index_dir, source_meta)
+    if text_index is not None:
+        rows = np.arange(size) % len(index)
+        embeddings = text_index.svd_embeddings[rows] if text_index.svd_embeddings is not None else None
+        tiled_text = TemplateTextIndex(text_index.vectorizer, text_index.matrix[rows],
+                                       text_index.svd_components, embeddings)
+        tiled_text.save(os.path.join(index_dir, TEXT_DIR), source_meta["sha256"], size)
+    return tiled
+
+
+def time_validation(validator, queries, repeats=3):
+    """Per-call validate() latencies in seconds over queries, after one warm-up call"""
+    validator.validate(queries[0])
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            validator.validate(query)
+            latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+def run_benchmark(template_file, sizes=DEFAULT_SIZES, workers=(1,), queries=DEFAULT_QUERIES,
+                  work_dir=None, repeats=3, prune=True, text_search="exact"):
+    """Validation latency for every corpus size and worker count. Returns a list of result dicts."""
+    from validator import ProcTHORValidator
+
+    source = ProcTHORValidator(template_file, workers=1, text_search=text_search)
+    index = source.templates
+    if not len(index):
+        raise ValueError(f"No templates in {template_file}")
+    own_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="template_benchmark_")
+    results = []
+    # validate() logs every step at INFO
+    logging.getLogger("ProcTHORValidator").setLevel(logging.WARNING)
+    try:
+        for size in sizes:
+            index_dir = os.path.join(work_dir, f"tiled_{size}")
+            start = time.perf_counter()
+            tile_index(index, size, index_dir, text_index=source.text_index)
+            build_time = time.perf_counter() - start
+            for worker_count in workers:
+                start = time.perf_counter()
+                validator = ProcTHORValidator(template_file, index_dir=index_dir, workers=worker_count,
+                                              prune=prune, text_search=text_search)
+                startup_time = time.perf_counter() - start
+                latencies = time_validation(validator, list(queries), repeats)
+                results.append({
+                    "templates": size,
+                    "shards": len(validator.shards),
+                    "workers": worker_count,
+                    "build_time": build_time,
+                    "startup_time": startup_time,
+                    "p50_latency": latencies[len(latencies) // 2],
+                    "p95_latency": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                    "mean_latency": sum(latencies) / len(latencies),
+                })
+                print_result(results[-1])
+            shutil.rmtree(index_dir, ignore_errors=True)
+    finally:
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_result(result):
+    print(f"{result['templates']:>10} {result['shards']:>6} {result['workers']:>7} "
+          f"{result['startup_time'] * 1000:>11.1f} {result['p50_latency'] * 1000:>9.2f} "
+          f"{result['p95_latency'] * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ProcTHORValidator latency as the template corpus grows")
+    parser.add_argument("--template_file", type=str, default="procthor_10k.jsonl",
+                        help="Template JSONL whose rows are tiled up to each size (default: procthor_10k.jsonl)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Corpus sizes to test (default: 10000 100000 1000000)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1],
+                        help="Shard scoring thread counts to test (default: 1 and the CPU count)")
+    parser.add_argument("--queries_file", type=str, help="Inputs to validate, one per line (default: built-in set)")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the queries per setting (default: 3)")
+    parser.add_argument("--no_prune", action="store_true", help="Score every template instead of bitset candidates")
+    parser.add_argument("--text_search", type=str, choices=("exact", "svd"), default="exact",
+                        help="Description similarity search (default: exact)")
+    parser.add_argument("--work_dir", type=str, help="Where tiled indexes are written (default: a temp dir)")
+    parser.add_argument("--output", type=str, default="template_benchmark.json",
+                        help="Where to save the results (default: template_benchmark.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.template_file):
+        print(f"Template file {args.template_file} not found!")
+        return 1
+    queries = DEFAULT_QUERIES
+    if args.queries_file:
+        with open(args.queries_file, 'r') as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    print(f"{'templates':>10} {'shards':>6} {'workers':>7} {'startup ms':>11} {'p50 ms':>9} {'p95 ms':>9}")
+    results = run_benchmark(args.template_file, args.sizes, sorted(set(args.workers)), queries,
+                            args.work_dir, args.repeats, prune=not args.no_prune, text_search=args.text_search)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {os.path.abspath(args.output)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,533 @@
+#template_index
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("TemplateIndex")
+
+# Precomputed scoring features for a template JSONL, saved next to it so a
+# ProcTHORValidator can start by memory-mapping a few .npy files instead of
+# parsing every house. Each row holds one template's counts; offsets[i] is
+# the byte position of its line, so a house is only read and parsed when it
+# is actually returned.
+#
+# Templates are split into shards of SHARD_SIZE rows, each in its own
+# directory of .npy columns, so corpora of millions of templates are built
+# with bounded memory and scored shard by shard. Type columns are numbered
+# in the order types are first seen; a shard's count matrices only have the
+# columns known when it was written, later ones are implicitly zero.
+#
+# Every shard also keeps packed bitsets (np.packbits, one bit per template)
+# of which templates contain each room type and object type and which have
+# each room count, so the validator can narrow a query down to plausible
+# candidates with a few bitwise ANDs before scoring.
+#
+# The text/ subdirectory holds the TF-IDF matrix of the template
+# descriptions (CSR arrays, memory-mapped like the shards) and the fitted
+# vocabulary, plus optional truncated-SVD embeddings for approximate search.
+# It is fitted the first time a validator asks for it.
+#
+# meta.json is written last and records the source file's size, mtime and
+# SHA-256. A changed mtime or size triggers a re-hash, and the index is only
+# rebuilt if the content really changed.
+
+INDEX_VERSION = 3
+INDEX_SUFFIX = ".index"
+META_FILE = "meta.json"
+SHARD_SIZE = 100000
+TEXT_DIR = "text"
+TEXT_META_FILE = "text_meta.json"
+TEXT_ARRAY_NAMES = ("tfidf_data", "tfidf_indices", "tfidf_indptr")
+SVD_ARRAY_NAMES = ("svd_components", "svd_embeddings")
+ARRAY_NAMES = ("offsets", "total_rooms", "total_objects", "total_doors", "total_windows",
+               "room_count_matrix", "object_count_matrix")
+BITSET_NAMES = ("room_type_bits", "object_type_bits", "room_count_bits")
+COUNT_DTYPE = np.int16
+# Room counts get one bucket each up to this; the last bucket holds everything larger
+MAX_ROOM_BUCKET = 16
+
+
+def default_index_dir(template_file: str) -> str:
+    return template_file + INDEX_SUFFIX
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def house_features(house: Dict):
+    """Room/object/door/window totals and lower-cased room and object type Counters of one house"""
+    rooms = house.get('rooms', [])
+    objects = house.get('objects', [])
+    totals = (len(rooms), len(objects), len(house.get('doors', [])), len(house.get('windows', [])))
+    room_counts = Counter(room.get('roomType', '').lower() for room in rooms)
+    object_counts = Counter(obj.get('objectType', '').lower() for obj in objects)
+    return totals, room_counts, object_counts
+
+
+def count_matrix(counters: List[Counter], type_index: Dict[str, int]) -> np.ndarray:
+    """Stack per-template Counters into a (templates x types) matrix"""
+    matrix = np.zeros((len(counters), len(type_index)), dtype=COUNT_DTYPE)
+    for row, counts in enumerate(counters):
+        for type_name, count in counts.items():
+            matrix[row, type_index[type_name]] = count
+    return matrix
+
+
+class TemplateShard:
+    """Feature columns of templates start .. start + len(shard) - 1
+
+    Bitsets missing from arrays are derived from the count columns.
+    """
+
+    def __init__(self, start: int, arrays: Dict[str, np.ndarray]):
+        self.start = start
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        if all(name in arrays for name in BITSET_NAMES):
+            for name in BITSET_NAMES:
+                setattr(self, name, arrays[name])
+        else:
+            self.room_type_bits = np.packbits(self.room_count_matrix.T > 0, axis=1)
+            self.object_type_bits = np.packbits(self.object_count_matrix.T > 0, axis=1)
+            buckets = np.minimum(self.total_rooms, MAX_ROOM_BUCKET)
+            self.room_count_bits = np.packbits(buckets[None, :] == np.arange(MAX_ROOM_BUCKET + 1)[:, None], axis=1)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def column(matrix: np.ndarray, col: Optional[int]) -> np.ndarray:
+        """One type's counts per template (zeros for a type this shard has no column for)"""
+        if col is None or col >= matrix.shape[1]:
+            return np.zeros(matrix.shape[0], dtype=COUNT_DTYPE)
+        return matrix[:, col]
+
+    def type_bits(self, bits: np.ndarray, col: int) -> np.ndarray:
+        """Packed bitset of the templates containing one type (empty for a type newer than the shard)"""
+        if col >= bits.shape[0]:
+            return np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+        return bits[col]
+
+    def room_count_range_bits(self, low: int, high: int) -> np.ndarray:
+        """Packed bitset of the templates with between low and high rooms (the last bucket counts as any larger count)"""
+        low = min(max(low, 0), MAX_ROOM_BUCKET)
+        high = min(high, MAX_ROOM_BUCKET)
+        if high < low:
+            return np.zeros((len(self) + 7) // 8, dtype=np.uint8)
+        return np.bitwise_or.reduce(self.room_count_bits[low:high + 1], axis=0)
+
+    def rows(self, bits: np.ndarray) -> np.ndarray:
+        """Row numbers set in a packed bitset"""
+        return np.flatnonzero(np.unpackbits(bits, count=len(self)))
+
+    def save(self, shard_dir: str):
+        os.makedirs(shard_dir, exist_ok=True)
+        for name in ARRAY_NAMES + BITSET_NAMES:
+            np.save(os.path.join(shard_dir, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, start: int, shard_dir: str) -> "TemplateShard":
+        """Memory-map a saved shard"""
+        return cls(start, {name: np.load(os.path.join(shard_dir, name + ".npy"), mmap_mode='r')
+                           for name in ARRAY_NAMES + BITSET_NAMES})
+
+
+def _shard_dir(index_dir: str, number: int) -> str:
+    return os.path.join(index_dir, f"shard_{number:05d}")
+
+
+class TemplateIndex:
+    """Scoring features and line offsets of a template JSONL, in shards.
+
+    Indexing or iterating yields the full template dicts, read from the
+    source file one line at a time.
+    """
+
+    def __init__(self, template_file: str, shards: List[TemplateShard],
+                 room_types: List[str], object_types: List[str]):
+        self.template_file = template_file
+        self.shards = shards
+        self.room_types = list(room_types)
+        self.object_types = list(object_types)
+        self.room_type_index = {name: col for col, name in enumerate(self.room_types)}
+        self.object_type_index = {name: col for col, name in enumerate(self.object_types)}
+        self._shard_starts = np.array([shard.start for shard in shards], dtype=np.int64)
+        self._count = sum(len(shard) for shard in shards)
+
+    @classmethod
+    def build(cls, template_file: str, max_templates: Optional[int] = None, shard_size: int = SHARD_SIZE,
+              index_dir: Optional[str] = None) -> "TemplateIndex":
+        """Parse the JSONL once, recording each template's features and byte offset.
+
+        With index_dir, every shard is saved as soon as it is full and then
+        memory-mapped, so memory stays bounded by one shard; call save_meta()
+        afterwards to mark the index complete.
+        """
+        shards = []
+        room_type_index = {}
+        object_type_index = {}
+        rows = {"offsets": [], "totals": [], "rooms": [], "objects": []}
+        count = 0
+
+        def flush():
+            totals = np.array(rows["totals"], dtype=np.int32).reshape(-1, 4)
+            shard = TemplateShard(count - len(rows["offsets"]), {
+                "offsets": np.array(rows["offsets"], dtype=np.int64),
+                "total_rooms": totals[:, 0].copy(),
+                "total_objects": totals[:, 1].copy(),
+                "total_doors": totals[:, 2].copy(),
+                "total_windows": totals[:, 3].copy(),
+                "room_count_matrix": count_matrix(rows["rooms"], room_type_index),
+                "object_count_matrix": count_matrix(rows["objects"], object_type_index),
+            })
+            if index_dir:
+                shard.save(_shard_dir(index_dir, len(shards)))
+                shard = TemplateShard.load(shard.start, _shard_dir(index_dir, len(shards)))
+            shards.append(shard)
+            for values in rows.values():
+                values.clear()
+
+        with open(template_file, 'rb') as f:
+            line_number = 0
+            while max_templates is None or count < max_templates:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                line_number += 1
+                line = line.strip()
+                if not line:
+                    continue  # Skip empty lines
+
+                try:
+                    template = json.loads(line)
+                    house_totals, room_counts, object_counts = house_features(template.get('house_json', {}))
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Error parsing line {line_number}: {str(e)}")
+                    continue
+                except Exception as e:
+                    logger.warning(f"Error processing line {line_number}: {str(e)}")
+                    continue
+
+                for room_type in room_counts:
+                    room_type_index.setdefault(room_type, len(room_type_index))
+                for obj_type in object_counts:
+                    object_type_index.setdefault(obj_type, len(object_type_index))
+                rows["offsets"].append(offset)
+                rows["totals"].append(house_totals)
+                rows["rooms"].append(room_counts)
+                rows["objects"].append(object_counts)
+                count += 1
+                if len(rows["offsets"]) >= shard_size:
+                    flush()
+                    logger.info(f"Indexed {count} templates")
+
+        if rows["offsets"] or not shards:
+            flush()
+        return cls(template_file, shards, list(room_type_index), list(object_type_index))
+
+    @classmethod
+    def empty(cls, template_file: str) -> "TemplateIndex":
+        return cls(template_file, [], [], [])
+
+    def save(self, index_dir: str, source_meta: Dict):
+        """Write every shard, then meta.json, which marks the index complete"""
+        _clear_index_dir(index_dir)
+        for number, shard in enumerate(self.shards):
+            shard.save(_shard_dir(index_dir, number))
+        self.save_meta(index_dir, source_meta)
+
+    def save_meta(self, index_dir: str, source_meta: Dict):
+        meta = dict(source_meta, version=INDEX_VERSION, count=len(self),
+                    shards=[{"start": shard.start, "count": len(shard)} for shard in self.shards],
+                    room_types=self.room_types, object_types=self.object_types)
+        _write_meta(index_dir, meta)
+
+    @classmethod
+    def load(cls, template_file: str, index_dir: str, meta: Dict) -> "TemplateIndex":
+        """Memory-map a saved index"""
+        shards = [TemplateShard.load(shard["start"], _shard_dir(index_dir, number))
+                  for number, shard in enumerate(meta["shards"])]
+        return cls(template_file, shards, meta["room_types"], meta["object_types"])
+
+    def __len__(self):
+        return self._count
+
+    def offset(self, idx: int) -> int:
+        shard = self.shards[int(np.searchsorted(self._shard_starts, idx, side='right')) - 1]
+        return int(shard.offsets[idx - shard.start])
+
+    def __getitem__(self, idx: int) -> Dict:
+        """Read and parse template idx from the source file"""
+        if not 0 <= idx < self._count:
+            raise IndexError(f"Template index {idx} out of range")
+        with open(self.template_file, 'rb') as f:
+            f.seek(self.offset(idx))
+            return json.loads(f.readline())
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.template_file, 'rb') as f:
+            for shard in self.shards:
+                for offset in shard.offsets:
+                    f.seek(int(offset))
+                    yield json.loads(f.readline())
+
+
+class TemplateTextIndex:
+    """TF-IDF rows of every template description, L2-normalized so a dot product is the cosine similarity.
+
+    With SVD arrays, similarity() can instead compare dense truncated-SVD
+    embeddings: approximate, but a small dense product however large the
+    vocabulary grows.
+    """
+
+    def __init__(self, vectorizer, matrix: sparse.csr_matrix,
+                 svd_components: Optional[np.ndarray] = None, svd_embeddings: Optional[np.ndarray] = None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.svd_components = svd_components
+        self.svd_embeddings = svd_embeddings
+
+    @classmethod
+    def fit(cls, index: TemplateIndex, vectorizer, svd_components: int = 0) -> "TemplateTextIndex":
+        """Fit vectorizer on the descriptions of every template in index"""
+        matrix = vectorizer.fit_transform(template.get('nl_description', '') for template in index).tocsr()
+        components = embeddings = None
+        if svd_components and matrix.shape[1] < 2:
+            # TruncatedSVD needs at least two terms; similarity falls back to exact search
+            logger.warning(f"Only {matrix.shape[1]} TF-IDF terms, not fitting SVD embeddings")
+        elif svd_components:
+            from sklearn.decomposition import TruncatedSVD
+            svd = TruncatedSVD(n_components=max(1, min(svd_components, matrix.shape[1] - 1)))
+            embeddings = _normalize_rows(svd.fit_transform(matrix)).astype(np.float32)
+            components = svd.components_.astype(np.float32)
+        return cls(vectorizer, matrix, components, embeddings)
+
+    def save(self, text_dir: str, source_sha256: str, count: int):
+        os.makedirs(text_dir, exist_ok=True)
+        meta_path = os.path.join(text_dir, TEXT_META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name, array in zip(TEXT_ARRAY_NAMES, (self.matrix.data, self.matrix.indices, self.matrix.indptr)):
+            np.save(os.path.join(text_dir, name + ".npy"), array)
+        if self.svd_components is not None:
+            np.save(os.path.join(text_dir, "svd_components.npy"), self.svd_components)
+            np.save(os.path.join(text_dir, "svd_embeddings.npy"), self.svd_embeddings)
+        vocabulary = {term: int(col) for term, col in self.vectorizer.vocabulary_.items()}
+        _write_meta(text_dir, {
+            "sha256": source_sha256,
+            "count": count,
+            "shape": list(self.matrix.shape),
+            "svd_components": 0 if self.svd_components is None else len(self.svd_components),
+            "vocabulary": vocabulary,
+            "idf": self.vectorizer.idf_.tolist(),
+        }, TEXT_META_FILE)
+
+    @classmethod
+    def load(cls, text_dir: str, meta: Dict, vectorizer) -> "TemplateTextIndex":
+        """Memory-map a saved text index, restoring the fitted vocabulary into vectorizer"""
+        data, indices, indptr = (np.load(os.path.join(text_dir, name + ".npy"), mmap_mode='r')
+                                 for name in TEXT_ARRAY_NAMES)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+        vectorizer.vocabulary_ = meta["vocabulary"]
+        vectorizer.idf_ = np.array(meta["idf"])
+        components = embeddings = None
+        if meta["svd_components"]:
+            components, embeddings = (np.load(os.path.join(text_dir, name + ".npy"), mmap_mode='r')
+                                      for name in SVD_ARRAY_NAMES)
+        return cls(vectorizer, matrix, components, embeddings)
+
+    def uses_svd(self, approximate: bool) -> bool:
+        """Whether approximate search runs on SVD embeddings; without them it is exact"""
+        return approximate and self.svd_embeddings is not None
+
+    def similarity(self, text: str, approximate: bool = False) -> np.ndarray:
+        """Cosine similarity of text to every template description"""
+        query = self.vectorizer.transform([text])
+        if self.uses_svd(approximate):
+            reduced = _normalize_rows(np.asarray(query @ self.svd_components.T))[0]
+            return np.clip(self.svd_embeddings @ reduced.astype(np.float32), 0, 1)
+        return np.asarray((self.matrix @ query.T).todense()).ravel()
+
+    def queries(self, texts: List[str], approximate: bool = False) -> np.ndarray:
+        """Dense query columns for similarity_block(): TF-IDF (vocabulary x texts), or SVD embeddings (components x texts)"""
+        queries = self.vectorizer.transform(texts)
+        if self.uses_svd(approximate):
+            return _normalize_rows(np.asarray(queries @ self.svd_components.T)).astype(np.float32).T
+        return queries.T.toarray()
+
+    def similarity_block(self, queries: np.ndarray, templates, approximate: bool = False) -> np.ndarray:
+        """Cosine similarity of every query to the descriptions of templates, a slice or index array (queries x templates)
+
+        approximate must be the value queries() was called with.
+        """
+        if self.uses_svd(approximate):
+            return np.clip(self.svd_embeddings[templates] @ queries, 0, 1).T
+        return np.asarray(self.matrix[templates] @ queries).T
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _source_meta(template_file: str, max_templates: Optional[int], content_hash: Optional[str] = None) -> Dict:
+    stat = os.stat(template_file)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": content_hash or file_sha256(template_file),
+        "max_templates": max_templates,
+    }
+
+
+def _read_meta(index_dir: str, name: str = META_FILE) -> Optional[Dict]:
+    try:
+        with open(os.path.join(index_dir, name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_meta(index_dir: str, meta: Dict, name: str = META_FILE):
+    meta_path = os.path.join(index_dir, name)
+    with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + ".tmp", meta_path)
+
+
+def _clear_index_dir(index_dir: str):
+    """Drop meta.json first (the index is incomplete from here on), then any old shards and text index"""
+    os.makedirs(index_dir, exist_ok=True)
+    meta_path = os.path.join(index_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in os.listdir(index_dir):
+        if name.startswith("shard_") or name == TEXT_DIR:
+            shutil.rmtree(os.path.join(index_dir, name))
+
+
+def _index_is_current(template_file: str, index_dir: str, meta: Optional[Dict],
+                      max_templates: Optional[int]) -> bool:
+    """Check a saved index against its source: mtime and size first, the content hash only if they moved"""
+    if not meta or meta.get("version") != INDEX_VERSION or meta.get("max_templates") != max_templates:
+        return False
+    stat = os.stat(template_file)
+    if stat.st_size == meta.get("size") and stat.st_mtime_ns == meta.get("mtime_ns"):
+        return True
+    content_hash = file_sha256(template_file)
+    if content_hash != meta.get("sha256"):
+        return False
+    # Touched but unchanged: remember the new mtime so the next start skips the hash
+    try:
+        _write_meta(index_dir, dict(meta, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+    except OSError:
+        pass
+    return True
+
+
+def load_template_index(template_file: str, index_dir: Optional[str] = None,
+                        max_templates: Optional[int] = None, rebuild: bool = False,
+                        shard_size: int = SHARD_SIZE) -> TemplateIndex:
+    """Map the saved index of template_file, building and saving it first if it is missing or stale.
+
+    Every template is indexed unless max_templates is given. When the index
+    directory cannot be written the index is built in memory instead.
+    """
+    if not os.path.exists(template_file):
+        logger.error(f"Template file {template_file} not found!")
+        return TemplateIndex.empty(template_file)
+
+    index_dir = index_dir or default_index_dir(template_file)
+    meta = _read_meta(index_dir)
+    if not rebuild and _index_is_current(template_file, index_dir, meta, max_templates):
+        try:
+            index = TemplateIndex.load(template_file, index_dir, meta)
+            logger.info(f"Mapped index of {len(index)} templates in {len(index.shards)} shards from {index_dir}")
+            return index
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to map template index {index_dir}, rebuilding: {str(e)}")
+
+    try:
+        _clear_index_dir(index_dir)
+        index = TemplateIndex.build(template_file, max_templates, shard_size, index_dir=index_dir)
+        index.save_meta(index_dir, _source_meta(template_file, max_templates))
+        logger.info(f"Saved index of {len(index)} templates in {len(index.shards)} shards to {index_dir}")
+    except OSError as e:
+        logger.warning(f"Could not save template index to {index_dir}, indexing in memory: {str(e)}")
+        index = TemplateIndex.build(template_file, max_templates, shard_size)
+    return index
+
+
+def load_text_index(index: TemplateIndex, vectorizer, index_dir: Optional[str] = None,
+                    svd_components: int = 0) -> Optional[TemplateTextIndex]:
+    """Map the saved TF-IDF index of index's descriptions, fitting and saving it first if needed.
+
+    The text index is tied to the content hash of the template index it was
+    fitted on. Returns None when there is no description text to fit.
+    """
+    index_dir = index_dir or default_index_dir(index.template_file)
+    text_dir = os.path.join(index_dir, TEXT_DIR)
+    index_meta = _read_meta(index_dir)
+    text_meta = _read_meta(text_dir, TEXT_META_FILE)
+    if (index_meta and text_meta and text_meta.get("sha256") == index_meta.get("sha256")
+            and text_meta.get("count") == len(index) and text_meta.get("svd_components", 0) >= min(svd_components, 1)):
+        try:
+            text_index = TemplateTextIndex.load(text_dir, text_meta, vectorizer)
+            logger.info(f"Mapped TF-IDF index of {text_index.matrix.shape[0]} descriptions from {text_dir}")
+            return text_index
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to map TF-IDF index {text_dir}, refitting: {str(e)}")
+
+    try:
+        text_index = TemplateTextIndex.fit(index, vectorizer, svd_components)
+    except ValueError as e:  # Empty vocabulary
+        logger.warning(f"Could not fit TF-IDF on template descriptions: {str(e)}")
+        return None
+    logger.info(f"Fitted TF-IDF on {text_index.matrix.shape[0]} descriptions "
+                f"({text_index.matrix.shape[1]} terms)")
+    if index_meta and index_meta.get("count") == len(index):
+        try:
+            text_index.save(text_dir, index_meta["sha256"], len(index))
+            logger.info(f"Saved TF-IDF index to {text_dir}")
+        except OSError as e:
+            logger.warning(f"Could not save TF-IDF index to {text_dir}: {str(e)}")
+    return text_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precomputed template index used by ProcTHORValidator")
+    parser.add_argument("--template_file", type=str, default="procthor_10k.jsonl",
+                        help="Template JSONL to index (default: procthor_10k.jsonl)")
+    parser.add_argument("--index_dir", type=str,
+                        help=f"Where to write the index (default: <template_file>{INDEX_SUFFIX})")
+    parser.add_argument("--shard_size", type=int, default=SHARD_SIZE,
+                        help=f"Templates per shard (default: {SHARD_SIZE})")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the saved index is current")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.exists(args.template_file):
+        logger.error(f"Template file {args.template_file} not found!")
+        return 1
+    index = load_template_index(args.template_file, args.index_dir, rebuild=args.rebuild, shard_size=args.shard_size)
+    print(f"{len(index)} templates in {len(index.shards)} shards, "
+          f"{len(index.room_types)} room types, {len(index.object_types)} object types")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
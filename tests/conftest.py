@@ -0,0 +1,48 @@
+#conftest
+import os
+import sys
+
+# The modules under test live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_house(house_id="house_12", extras=True):
+    """A small ProcTHOR-style house that fits the compact layout."""
+    rooms = [
+        {"roomType": "Kitchen", "name": "Kitchen", "floorLevel": 0, "objects": [
+            {"objectType": "Fridge", "assetId": "Fridge", "position": {"x": 1.25, "y": 0.0, "z": 2.5}},
+            {"objectType": "Chair", "assetId": "Chair_3", "position": {"x": 2.0, "y": 0.0, "z": 1.0}},
+        ]},
+        {"roomType": "Bedroom", "name": "Master bedroom", "floorLevel": 1, "objects": [
+            {"objectType": "Bed", "assetId": "Bed", "position": {"x": 4.5, "y": 0.0, "z": 4.0}},
+        ]},
+    ]
+    house = {"id": house_id, "numRooms": 2, "floors": 2, "dimensions": {"x": 16, "y": 12}, "rooms": rooms}
+    if extras:
+        house["objects"] = [{"objectType": obj["objectType"], "id": obj["assetId"]}
+                            for room in rooms for obj in room["objects"]]
+        house["doors"] = [{"between": ["Kitchen", "Bedroom"], "size": 0.9}]
+    return house
+
+
+ROOM_TYPES = ("Kitchen", "Bathroom", "Bedroom", "LivingRoom")
+OBJECT_TYPES = ("Fridge", "Toilet", "Bed", "Sofa", "Chair", "Table")
+
+
+def write_templates(path, count, seed=0, fixed=()):
+    """A JSON Lines template corpus of random small houses; `fixed` room type lists come first."""
+    import json
+    import random
+
+    rng = random.Random(seed)
+    layouts = list(fixed) + [rng.choices(ROOM_TYPES, k=rng.randint(1, 5)) for _ in range(count - len(fixed))]
+    with open(path, "w") as f:
+        for number, room_types in enumerate(layouts):
+            objects = [{"objectType": rng.choice(OBJECT_TYPES)} for _ in range(rng.randint(0, 6))]
+            house = {"id": f"house_{number}", "rooms": [{"roomType": room_type} for room_type in room_types],
+                     "objects": objects}
+            description = (f"A house with {len(room_types)} rooms: "
+                           + ", ".join(room_type.lower() for room_type in room_types)
+                           + " and " + ", ".join(obj["objectType"].lower() for obj in objects))
+            f.write(json.dumps({"nl_description": description, "house_json": house}) + "\n")
+    return str(path)
@@ -0,0 +1,21 @@
+#test_generation_cache
+from generation_cache import GenerationCache, normalize_description
+
+
+def test_normalize_only_touches_case_and_whitespace():
+    assert normalize_description("  A 2.5 Bath\tHouse,\n with  a Garden ") == "a 2.5 bath house, with a garden"
+
+
+def test_punctuation_changes_the_key():
+    assert GenerationCache.make_key("2.5 baths", "hash") != GenerationCache.make_key("2. 5 baths", "hash")
+    assert GenerationCache.make_key("Two  Rooms", "hash") == GenerationCache.make_key("two rooms", "hash")
+
+
+def test_round_trip_through_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = GenerationCache.make_key("two rooms", "hash", max_length=64)
+    GenerationCache(path).put(key, "raw")
+    cache = GenerationCache(path)
+    assert cache.get(key) == "raw"
+    assert cache.get(GenerationCache.make_key("two rooms", "hash", max_length=32)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,65 @@
+#test_house_format
+import json
+import random
+
+import pytest
+
+from conftest import make_house
+from house_format import close_compact_text, decode_compact, encode_compact
+
+
+@pytest.mark.parametrize("house", [make_house(), make_house("custom-id", extras=False)])
+def test_round_trip(house):
+    assert decode_compact(encode_compact(house)) == house
+
+
+def test_compact_text_has_no_braces():
+    assert not set("{}") & set(encode_compact(make_house()))
+
+
+def test_encode_rejects_unknown_room_keys():
+    house = make_house()
+    house["rooms"][0]["color"] = "red"
+    with pytest.raises(ValueError):
+        encode_compact(house)
+
+
+def test_truncated_text_is_closed():
+    assert close_compact_text('[1, [2, "ab') == '[1, [2, "ab"]]'
+    house = decode_compact('[7, 2, 1, [16, 16], [["Kitchen", 0, [["Chair", [1, 2')
+    assert house["id"] == "house_7"
+    assert house["rooms"][0]["objects"][0]["position"] == {"x": 1, "y": 2, "z": None}
+
+
+@pytest.mark.parametrize("text", [
+    '[2448, 2, 1, [16, 16], [["kitchen", 0, 5',
+    '[2448, 2, 1, [16, 16], 7]',
+    '[2448, 2, 1, 16, []]',
+    '[2448, 2, 1, [16, 16], [5]]',
+    '[2448, 2, 1, [16, 16], [["kitchen", 0, [3]]]]',
+    '[2448, 2, 1, [16, 16], [["kitchen", 0, [["Chair", 4]]]]]',
+    '[2448, 2, 1, [16, 16], [], [":", "doors", [":", [1], 2]]]',
+    '{"id": 1}',
+    pytest.param('[' * 5000, id="deep-nesting"),
+])
+def test_malformed_text_raises_value_error(text):
+    with pytest.raises(ValueError):
+        decode_compact(text)
+
+
+def test_truncated_and_mutated_text_only_raises_value_error():
+    """Model output can stop or go wrong anywhere; decoding must either yield a house or raise ValueError."""
+    text = encode_compact(make_house())
+    rng = random.Random(0)
+    candidates = [text[:end] for end in range(len(text))]
+    tokens = ['[', ']', '5', '"x"', '[":", [1], 2]', 'null', ', ']
+    for _ in range(2000):
+        position = rng.randrange(len(text))
+        candidates.append(text[:position] + rng.choice(tokens) + text[position + rng.randrange(4):])
+    for candidate in candidates:
+        try:
+            house = decode_compact(candidate)
+        except ValueError:
+            continue
+        assert isinstance(house, dict)
+        json.dumps(house)
@@ -0,0 +1,66 @@
+#test_house_grammar
+import json
+
+import pytest
+
+from conftest import make_house
+from house_grammar import HouseGrammarLogitsProcessor, HouseGrammarState, house_to_target_text, restore_house_json
+
+
+def braceless(house):
+    return house_to_target_text(house).replace("{", "").replace("}", "")
+
+
+def test_state_accepts_a_whole_house():
+    state = HouseGrammarState()
+    assert state.feed(braceless(make_house(extras=False)))
+    assert state.is_complete()
+
+
+def test_state_rejects_unknown_keys_and_open_structure():
+    text = braceless(make_house(extras=False))
+    state = HouseGrammarState()
+    assert state.feed(text[:50])
+    assert not state.can_end()
+    assert not state.copy().feed('"bogus"')
+    # copy() leaves the original state untouched
+    assert state.feed(text[50:])
+
+
+def test_restore_round_trip():
+    house = make_house(extras=False)
+    assert json.loads(restore_house_json(braceless(house))) == json.loads(house_to_target_text(house))
+
+
+@pytest.mark.parametrize("end", range(0, 200, 7))
+def test_restore_truncated_text_parses(end):
+    json.loads(restore_house_json(braceless(make_house(extras=False))[:end]))
+
+
+class FakeTokenizer:
+    pad_token_id = 0
+    eos_token_id = 1
+    unk_token_id = 2
+
+
+# Surface text per token id, as token_surface_texts() builds it
+TOKEN_TEXTS = [None, None, "", '"id"', "xyz", "]", '"', ": "]
+VALID_AT_START = {2, 3, 6}
+
+
+def allowed_ids(processor, prefix, scores):
+    torch = pytest.importorskip("torch")
+    masked = processor(torch.tensor([prefix]), torch.tensor([scores], dtype=torch.float))
+    return {token_id for token_id, score in enumerate(masked[0].tolist()) if score != float("-inf")}
+
+
+def test_processor_searches_past_the_top_candidates():
+    processor = HouseGrammarLogitsProcessor(FakeTokenizer(), max_candidates=2, token_texts=TOKEN_TEXTS)
+    # The two likeliest tokens are off-grammar, the valid ones rank below them
+    scores = [0.0, 0.0, 3.0, 2.0, 9.0, 8.0, 1.0, 0.5]
+    assert allowed_ids(processor, [0], scores) == VALID_AT_START
+
+
+def test_processor_never_unmasks_an_off_grammar_row():
+    processor = HouseGrammarLogitsProcessor(FakeTokenizer(), max_candidates=2, token_texts=TOKEN_TEXTS)
+    assert allowed_ids(processor, [0, 4], [1.0] * len(TOKEN_TEXTS)) == {FakeTokenizer.eos_token_id}
@@ -0,0 +1,54 @@
+#test_json_repair
+import json
+
+import pytest
+
+from conftest import make_house
+from house_grammar import house_to_target_text
+from json_repair import repair_house_json, strip_braces
+
+
+def test_valid_json_is_untouched():
+    house = make_house()
+    assert repair_house_json(json.dumps(house)) == (house, [])
+
+
+@pytest.mark.parametrize("extras", [True, False])
+def test_brace_less_output_round_trips(extras):
+    house = json.loads(house_to_target_text(make_house(extras=extras)))
+    repaired, repairs = repair_house_json(strip_braces(house_to_target_text(house)))
+    assert repaired == house
+    assert "restored outer braces" in repairs
+    assert not any("inserted ','" in repair for repair in repairs)
+
+
+def test_missing_commas_are_restored():
+    house = json.loads(house_to_target_text(make_house(extras=False)))
+    repaired, repairs = repair_house_json(strip_braces(house_to_target_text(house)).replace(",", ""))
+    assert repaired == house
+    assert any("inserted ','" in repair for repair in repairs)
+
+
+def test_present_comma_after_implicit_object_is_not_reported():
+    house, repairs = repair_house_json('"id": "a", "dimensions": "x": 1, "y": 2, "rooms": []')
+    assert house == {"id": "a", "dimensions": {"x": 1, "y": 2}, "rooms": []}
+    assert not any("inserted ','" in repair for repair in repairs)
+
+
+def test_missing_comma_after_implicit_object_is_reported_once():
+    _, repairs = repair_house_json('"dimensions": "x": 1, "y": 2 "rooms": []')
+    assert [repair for repair in repairs if "inserted ','" in repair] == ["inserted ',' at 29"]
+
+
+def test_truncated_output_is_closed():
+    text = strip_braces(house_to_target_text(make_house(extras=False)))
+    house, repairs = repair_house_json(text[:text.index("Master") + 3])
+    assert house["rooms"][1] == {"roomType": "Bedroom", "name": "Mas"}
+    assert house["dimensions"] == {"x": 16, "y": 12}
+    assert any("truncated" in repair for repair in repairs)
+
+
+@pytest.mark.parametrize("text", ["", "garbage ] } ,", '"rooms": [', '"id"'])
+def test_anything_yields_a_dict(text):
+    house, _ = repair_house_json(text)
+    assert isinstance(house, dict)
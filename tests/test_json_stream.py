@@ -0,0 +1,81 @@
+#test_json_stream
+import json
+import random
+
+import pytest
+
+from conftest import make_house
+from house_format import encode_compact
+from house_grammar import house_to_target_text
+from json_repair import strip_braces
+from json_stream import HouseCloseDetector, HouseStreamTracker
+
+
+def feed_in_chunks(tracker, text, seed=0):
+    rng = random.Random(seed)
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 7)
+        tracker.feed(text[pos:pos + size])
+        pos += size
+    return tracker
+
+
+def rooms_text(room_blocks, num_rooms):
+    return '{"numRooms": %d, "rooms": [%s]}' % (num_rooms, ", ".join(room_blocks))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_well_formed_house_streams_to_the_end(seed):
+    tracker = feed_in_chunks(HouseStreamTracker(), json.dumps(make_house()), seed)
+    assert not tracker.aborted
+    assert (tracker.room_count, tracker.num_rooms, tracker.depth) == (2, 2, 0)
+
+
+def test_repeated_room_blocks_abort():
+    block = '{"roomType": "Bedroom", "objects": []}'
+    tracker = feed_in_chunks(HouseStreamTracker(), rooms_text([block] * 8, num_rooms=20))
+    assert tracker.aborted
+    assert "repeated" in tracker.abort_reason
+    # Decoding stops at the block that tipped it over, not at the end of the text
+    assert tracker.room_count < 8
+
+
+def test_rooms_beyond_num_rooms_abort():
+    blocks = ['{"roomType": "Room%d"}' % number for number in range(6)]
+    tracker = feed_in_chunks(HouseStreamTracker(extra_rooms_allowed=2), rooms_text(blocks, num_rooms=2))
+    assert tracker.aborted
+    assert tracker.abort_reason == "5 rooms generated for numRooms=2"
+
+
+@pytest.mark.parametrize("text, reason", [
+    ('"rooms": []], "id": "house"', "unbalanced closing ']'"),
+    ('[' * 9, "nesting deeper than 8"),
+])
+def test_broken_structure_aborts(text, reason):
+    tracker = HouseStreamTracker()
+    assert not feed_in_chunks(tracker, text).feed("")
+    assert tracker.abort_reason == reason
+
+
+def test_brackets_inside_strings_are_ignored():
+    tracker = feed_in_chunks(HouseStreamTracker(), '{"name": "]]]] \\" [[[[", "rooms": []}')
+    assert not tracker.aborted and tracker.depth == 0
+
+
+def test_block_key_split_across_chunks_counts_once():
+    tracker = HouseStreamTracker()
+    for chunk in ('{"rooms": [{"room', 'Type": "Kitchen"}, {"ro', 'omType": "Bedroom"}]}'):
+        tracker.feed(chunk)
+    assert tracker.room_count == 2
+
+
+@pytest.mark.parametrize("output_format, text", [
+    ("json", json.dumps(make_house())),
+    ("json", strip_braces(house_to_target_text(make_house(extras=False)))),
+    ("compact", encode_compact(make_house())),
+])
+def test_close_detector_closes_at_the_end(output_format, text):
+    detector = HouseCloseDetector(output_format)
+    assert not detector.copy().feed(text[:-1])
+    assert detector.feed(text)
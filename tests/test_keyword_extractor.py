@@ -0,0 +1,126 @@
+#test_keyword_extractor
+import json
+import random
+import re
+from collections import defaultdict
+
+import pytest
+
+from conftest import make_house
+from keyword_extractor import (DIMENSION_PATTERNS, FLOOR_PATTERNS, OBJECT_TYPE_PATTERNS, ROOM_COUNT_PATTERNS,
+                               ROOM_TYPE_PATTERNS, KeywordExtractor)
+
+# The validator's keyword tables
+ROOM_KEYWORDS = {
+    "kitchen": ["kitchen", "dining", "cook", "food", "meal", "eat", "counter", "sink", "stove", "fridge",
+                "refrigerator", "oven", "microwave"],
+    "bathroom": ["bathroom", "bath", "toilet", "shower", "tub", "sink", "washroom", "restroom", "wc"],
+    "bedroom": ["bedroom", "bed", "sleep", "rest", "dresser", "nightstand"],
+    "living": ["living", "family", "sitting", "lounge", "tv", "sofa", "couch", "entertainment"],
+    "hallway": ["hallway", "corridor", "passage", "hall", "entryway", "entry"],
+    "office": ["office", "study", "work", "desk", "computer", "home office"],
+    "closet": ["closet", "storage", "wardrobe"]
+}
+OBJECT_KEYWORDS = {
+    "furniture": ["table", "chair", "sofa", "couch", "bed", "dresser", "cabinet", "shelf", "desk", "bookshelf"],
+    "appliance": ["fridge", "refrigerator", "oven", "stove", "microwave", "dishwasher", "washer", "dryer", "tv",
+                  "television"],
+    "fixture": ["sink", "toilet", "shower", "tub", "bathtub", "faucet", "light", "lamp", "ceiling fan"],
+    "decor": ["rug", "carpet", "painting", "picture", "mirror", "plant", "curtain", "blind", "vase"]
+}
+
+
+def baseline_extract(input_text):
+    """The validator's original extraction: every pattern searched in turn, keywords with \\b...\\b"""
+    text = input_text.lower()
+    numeric_values = {}
+    for name, patterns in (("total_rooms", ROOM_COUNT_PATTERNS), ("floors", FLOOR_PATTERNS)):
+        for pattern in patterns:
+            match = re.search(pattern, text)
+            if match:
+                numeric_values[name] = int(match.group(1))
+                break
+    for pattern in DIMENSION_PATTERNS:
+        match = re.search(pattern, text)
+        if match:
+            if len(match.groups()) >= 2:
+                numeric_values['width'] = int(match.group(1))
+                numeric_values['length'] = int(match.group(2))
+            else:
+                numeric_values['dimension'] = int(match.group(1))
+            break
+
+    room_counts = defaultdict(int)
+    for room_type, patterns in ROOM_TYPE_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, text)
+            if match:
+                room_counts[room_type] = int(match.group(1))
+                break
+    for room_type, keywords in ROOM_KEYWORDS.items():
+        if room_type not in room_counts:
+            for keyword in keywords:
+                if re.search(r'\b' + re.escape(keyword) + r'\b', text):
+                    room_counts[room_type] = 1
+                    break
+
+    object_counts = defaultdict(int)
+    for obj_type, patterns in OBJECT_TYPE_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, text)
+            if match:
+                object_counts[obj_type] = int(match.group(1))
+                break
+    for keywords in OBJECT_KEYWORDS.values():
+        for keyword in keywords:
+            if re.search(r'\b' + re.escape(keyword) + r'\b', text) and keyword not in object_counts:
+                object_counts[keyword] = 1
+    return room_counts, object_counts, numeric_values
+
+
+def random_texts(count, seed=0):
+    """Word salad over the pattern vocabulary, numbers and separators, to hit overlapping matches"""
+    rng = random.Random(seed)
+    vocabulary = ([keyword for keywords in ROOM_KEYWORDS.values() for keyword in keywords]
+                  + [keyword for keywords in OBJECT_KEYWORDS.values() for keyword in keywords]
+                  + ["rooms", "numRooms", "number of rooms", "floors", "stories", "storys", "dimensions", "size",
+                     "width", "length", "x", "X", "bedrooms", "living room", "living  rooms", "home  office",
+                     "tables", "beds", "bedside", "restroom's", "office-desk"])
+    separators = [" ", ": ", ":", "", ", ", "\n", "-", "_"]
+    texts = []
+    for _ in range(count):
+        parts = []
+        for _ in range(rng.randint(1, 14)):
+            parts.append(str(rng.randint(0, 12)) if rng.random() < 0.3 else rng.choice(vocabulary))
+            parts.append(rng.choice(separators))
+        texts.append("".join(parts))
+    return texts
+
+
+FIXED_TEXTS = [
+    "",
+    "A modern two-bedroom house with an open kitchen connected to the living room.",
+    "3 bedrooms, 2 bathrooms and 1 kitchen on 2 floors, 12 x 9 metres, with a home office",
+    "numRooms: 4, floors: 1, dimensions: 10 by 8, 6 chairs, 1 table and a ceiling fan",
+    "A 2 story cottage, width 7, with 3 beds, 2 sinks and a toilet",
+    "roomType Bedroom roomType LivingRoom bedside bathtub televisions",
+    json.dumps(make_house()),
+]
+
+
+@pytest.mark.parametrize("text", FIXED_TEXTS + random_texts(500))
+def test_matches_the_baseline(text):
+    extracted = KeywordExtractor(ROOM_KEYWORDS, OBJECT_KEYWORDS).extract(text)
+    expected = baseline_extract(text)
+    # Key order feeds the scoring, so it has to match too
+    assert [list(part.items()) for part in extracted] == [list(part.items()) for part in expected]
+
+
+def test_counts_from_a_description():
+    room_counts, object_counts, numeric_values = KeywordExtractor(ROOM_KEYWORDS, OBJECT_KEYWORDS).extract(
+        "3 bedrooms, 2 bathrooms and a kitchen on 2 floors, 12 x 9, with a home office and 6 chairs"
+    )
+    assert dict(room_counts) == {"bedroom": 3, "bathroom": 2, "kitchen": 1, "office": 1}
+    # "3 bedrooms" also matches the bed pattern, as it always has
+    assert dict(object_counts) == {"chair": 6, "bed": 3}
+    assert numeric_values == {"floors": 2, "width": 12, "length": 9}
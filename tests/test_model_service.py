@@ -0,0 +1,16 @@
+#test_model_service
+from model_service import get_model_service
+
+
+def test_services_are_shared_per_settings():
+    service = get_model_service("unused-model", constrained=True)
+    assert get_model_service("unused-model", constrained=True) is service
+    assert get_model_service("unused-model", constrained=False) is not service
+    assert get_model_service("unused-model", device="cpu", constrained=True) is not service
+    assert not service.is_loaded
+
+
+def test_unhashable_settings_are_compared_by_value():
+    first = get_model_service("unused-model", profile_budgets={"fast": [1, 2]})
+    assert get_model_service("unused-model", profile_budgets={"fast": [1, 2]}) is first
+    assert get_model_service("unused-model", profile_budgets={"fast": [1, 3]}) is not first
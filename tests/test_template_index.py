@@ -0,0 +1,133 @@
+#test_template_index
+import json
+import os
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+import template_index
+from conftest import write_templates
+from template_index import TemplateIndex, default_index_dir, load_template_index, load_text_index
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """Count index builds, so a test can tell a rebuild from a mapped index"""
+    calls = []
+    build = TemplateIndex.build.__func__
+
+    def counting_build(cls, *args, **kwargs):
+        calls.append(args)
+        return build(cls, *args, **kwargs)
+
+    monkeypatch.setattr(TemplateIndex, "build", classmethod(counting_build))
+    return calls
+
+
+@pytest.fixture
+def templates(tmp_path):
+    return write_templates(tmp_path / "templates.jsonl", 40)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_index_reads_every_template(templates):
+    index = load_template_index(templates, shard_size=16)
+    assert len(index.shards) == 3
+    assert list(index) == read_lines(templates)
+    assert index[17] == read_lines(templates)[17]
+    with pytest.raises(IndexError):
+        index[40]
+
+
+def test_saved_index_is_mapped_again(templates, builds):
+    load_template_index(templates)
+    index = load_template_index(templates)
+    assert len(builds) == 1
+    assert isinstance(index.shards[0].offsets, np.memmap)
+
+
+def test_touched_but_unchanged_file_is_not_rebuilt(templates, builds, monkeypatch):
+    load_template_index(templates)
+    stat = os.stat(templates)
+    os.utime(templates, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    load_template_index(templates)
+    assert len(builds) == 1
+
+    # The new mtime is recorded, so the next start does not hash the file again
+    monkeypatch.setattr(template_index, "file_sha256", lambda path: pytest.fail("file was hashed"))
+    load_template_index(templates)
+
+
+def test_changed_content_of_the_same_size_is_rebuilt(templates, builds):
+    load_template_index(templates)
+    stat = os.stat(templates)
+    with open(templates) as f:
+        text = f.read()
+    with open(templates, "w") as f:
+        f.write(text.replace("house_1\"", "house_X\"", 1))
+    os.utime(templates, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.path.getsize(templates) == stat.st_size
+
+    # Same size and mtime: trusted without hashing
+    assert load_template_index(templates)[1]["house_json"]["id"] == "house_X"
+    assert len(builds) == 1
+    os.utime(templates, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    load_template_index(templates)
+    assert len(builds) == 2
+
+
+def test_appended_templates_are_indexed(templates, builds):
+    assert len(load_template_index(templates)) == 40
+    with open(templates, "a") as f:
+        f.write(json.dumps({"nl_description": "one more", "house_json": {"id": "extra", "rooms": []}}) + "\n")
+    index = load_template_index(templates)
+    assert len(builds) == 2
+    assert len(index) == 41 and index[40]["house_json"]["id"] == "extra"
+
+
+@pytest.mark.parametrize("change", ["max_templates", "version", "rebuild"])
+def test_settings_changes_rebuild(templates, builds, monkeypatch, change):
+    load_template_index(templates)
+    kwargs = {}
+    if change == "max_templates":
+        kwargs["max_templates"] = 10
+    elif change == "version":
+        monkeypatch.setattr(template_index, "INDEX_VERSION", template_index.INDEX_VERSION + 1)
+    else:
+        kwargs["rebuild"] = True
+    index = load_template_index(templates, **kwargs)
+    assert len(builds) == 2
+    assert len(index) == (10 if change == "max_templates" else 40)
+
+
+def test_damaged_index_is_rebuilt(templates, builds):
+    load_template_index(templates)
+    shard_dir = os.path.join(default_index_dir(templates), "shard_00000")
+    for name in os.listdir(shard_dir):
+        os.remove(os.path.join(shard_dir, name))
+    assert len(load_template_index(templates)) == 40
+    assert len(builds) == 2
+
+
+def test_text_index_follows_the_templates(templates, monkeypatch):
+    fits = []
+    fit = template_index.TemplateTextIndex.fit.__func__
+    monkeypatch.setattr(template_index.TemplateTextIndex, "fit",
+                        classmethod(lambda cls, *args: fits.append(args) or fit(cls, *args)))
+    index = load_template_index(templates)
+    fitted = load_text_index(index, TfidfVectorizer())
+    mapped = load_text_index(index, TfidfVectorizer())
+    assert len(fits) == 1
+    assert np.allclose(mapped.similarity("kitchen and bed"), fitted.similarity("kitchen and bed"))
+
+    with open(templates, "a") as f:
+        f.write(json.dumps({"nl_description": "a greenhouse", "house_json": {"id": "extra", "rooms": []}}) + "\n")
+    refitted = load_text_index(load_template_index(templates), TfidfVectorizer())
+    assert len(fits) == 2
+    assert refitted.matrix.shape[0] == 41
+    assert "greenhouse" in refitted.vectorizer.vocabulary_
@@ -0,0 +1,64 @@
+#test_validator
+import numpy as np
+import pytest
+
+from conftest import write_templates
+
+validator = pytest.importorskip("validator")
+
+
+def make_validator(path, **kwargs):
+    try:
+        return validator.ProcTHORValidator(template_file=str(path), **kwargs)
+    except LookupError:
+        pytest.skip("NLTK stopwords are not installed")
+
+
+def features(v, texts):
+    return [v._extract_features(text) for text in texts]
+
+
+def test_batch_ties_go_to_the_lower_template_index(tmp_path):
+    # Every third template is a perfect match, and all of those clip to a score of 1.0
+    rng = np.random.default_rng(0)
+    layouts = [("Kitchen", "Bathroom") if number % 3 == 0 else rng.choice(["Bedroom", "LivingRoom"], rng.integers(1, 6)).tolist()
+               for number in range(300)]
+    path = write_templates(tmp_path / "templates.jsonl", 300, fixed=layouts)
+    v = make_validator(path, text_weight=0, prune=False)
+    for seed in range(5):
+        np.random.seed(seed)
+        batch = v._rank_batch(features(v, ["1 kitchen 1 bathroom", "2 rooms"]))[0]
+        single = v._rank_templates(*features(v, ["1 kitchen 1 bathroom"])[0][1:])
+        assert [idx for idx, _ in batch] == [idx for idx, _ in single] == list(range(0, 60, 3))
+
+
+class NoNoise:
+    """Stands in for the tie-break generator so batched and single scores are comparable."""
+
+    def __init__(self, *args):
+        pass
+
+    def random(self, size, dtype=np.float64):
+        return np.zeros(size, dtype=dtype)
+
+    def uniform(self, low, high, size):
+        return np.full(size, low)
+
+
+TEXTS = ["1 kitchen 1 bathroom", "3 bedrooms and a living room with a sofa", "2 rooms", "a house",
+         "4 rooms: kitchen, bathroom, 2 bedrooms, 3 chairs and a table", "5 rooms with a toilet and 2 beds"]
+
+
+@pytest.mark.parametrize("prune", [True, False])
+def test_rank_batch_matches_rank_templates(tmp_path, monkeypatch, prune):
+    path = write_templates(tmp_path / "templates.jsonl", 400, seed=1)
+    v = make_validator(path, prune=prune, min_candidates=10)
+    monkeypatch.setattr(np.random, "default_rng", NoNoise)
+    batch_features = features(v, TEXTS)
+    for block_size in (7, 32768):
+        batch = v._rank_batch(batch_features, block_size=block_size)
+        for text, (input_text, room_counts, object_counts, numeric_values), ranked in zip(TEXTS, batch_features, batch):
+            text_similarity = v.text_index.similarity(input_text) if v.text_index is not None else None
+            single = v._rank_templates(room_counts, object_counts, numeric_values, text_similarity=text_similarity)
+            assert [idx for idx, _ in ranked] == [idx for idx, _ in single], text
+            assert [score for _, score in ranked] == pytest.approx([score for _, score in single]), text
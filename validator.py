@@ -4,20 +4,19 @@ import os
 import re
 import logging
 import numpy as np
+from scipy import sparse
 import random
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from json.decoder import JSONDecodeError
-from typing import Dict, List, Union, Any, Optional, Tuple
-from collections import defaultdict, Counter
+from typing import Dict, Iterable, Iterator, List, Union, Optional, Tuple
+from collections import Counter, OrderedDict
 import nltk
-from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
-
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+from keyword_extractor import KeywordExtractor
+from template_index import TemplateIndex, TemplateShard, house_features, load_template_index, load_text_index
 
 try:
     nltk.data.find('corpora/stopwords')
@@ -28,11 +27,27 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ProcTHORValidator")
 
 class ProcTHORValidator:
-    def __init__(self, template_file="procthor_10k.jsonl"):
+    def __init__(self, template_file="procthor_10k.jsonl", index_dir=None, template_cache_size=16,
+                 max_templates=None, workers=None, prune=True, min_candidates=20,
+                 text_weight=0.2, text_search="exact", svd_components=128):
         self.template_file = template_file
+        self.index_dir = index_dir
+        self.max_templates = max_templates
+        # Only templates passing the room count / room type / object type bitsets are scored
+        self.prune = prune
+        self.min_candidates = min_candidates
         self.templates = self._load_templates()
+        # Only the scoring features stay resident; returned houses are parsed on demand
+        self.template_cache_size = template_cache_size
+        self._template_cache = OrderedDict()
         self.vectorizer = TfidfVectorizer(stop_words=stopwords.words('english'))
-        self.text_features = self._extract_all_text_features()
+        self._text_features = None
+        # Share of the final score taken by TF-IDF cosine similarity to the template descriptions
+        self.text_weight = text_weight
+        if text_search not in ("exact", "svd"):
+            raise ValueError(f"Unknown text search: {text_search} (expected 'exact' or 'svd')")
+        self.text_search = text_search
+        self.text_index = self._load_text_index(svd_components) if text_weight > 0 else None
         
         # Create dictionary for room keyword mapping
         self.room_keywords = {
@@ -52,80 +67,79 @@ class ProcTHORValidator:
             "fixture": ["sink", "toilet", "shower", "tub", "bathtub", "faucet", "light", "lamp", "ceiling fan"],
             "decor": ["rug", "carpet", "painting", "picture", "mirror", "plant", "curtain", "blind", "vase"]
         }
+        # Count patterns and keyword lookups compiled once for every input
+        self.keyword_extractor = KeywordExtractor(self.room_keywords, self.object_keywords)
         
         # Extract room and object counts per template for faster scoring
         self._analyze_templates()
+
+        # Shards are scored in parallel threads (NumPy releases the GIL in the array operations)
+        self.workers = workers or min(len(self.shards), os.cpu_count() or 1)
+        self._executor = None
         
-    def _load_templates(self) -> List[Dict]:
-        """Load templates from JSON Lines file (one JSON per line)"""
-        templates = []
-        if not os.path.exists(self.template_file):
-            logger.error(f"Template file {self.template_file} not found!")
-            return templates
+    def _load_templates(self) -> TemplateIndex:
+        """Map the precomputed index of the JSON Lines template file (one JSON per line)
 
+        The index is built and saved next to the file on first use and whenever
+        the file changes. Templates are read from the file only when accessed.
+        """
         try:
-            with open(self.template_file, 'r') as f:
-                for line_number, line in enumerate(f, 1):
-                    line = line.strip()
-                    if not line:
-                        continue  # Skip empty lines
-
-                    try:
-                        template = json.loads(line)
-                        templates.append(template)
-                        if len(templates) >= 10000:
-                            break  # Limit to first 10k templates
-                    except JSONDecodeError as e:
-                        logger.warning(f"Error parsing line {line_number}: {str(e)}")
-                    except Exception as e:
-                        logger.warning(f"Error processing line {line_number}: {str(e)}")
-
+            templates = load_template_index(self.template_file, self.index_dir, self.max_templates)
             logger.info(f"Loaded {len(templates)} templates from {self.template_file}")
             return templates
         except Exception as e:
             logger.error(f"Failed to load templates: {str(e)}")
-            return []
+            return TemplateIndex.empty(self.template_file)
     
     def _analyze_templates(self):
-        """Analyze templates to extract room and object counts for faster matching"""
-        self.template_features = []
-        
-        for template in self.templates:
-            features = {}
-            house = template.get('house_json', {})
-            
-            # Count rooms by type
-            room_counts = Counter()
-            for room in house.get('rooms', []):
-                room_type = room.get('roomType', '').lower()
-                room_counts[room_type] += 1
-            
-            # Count objects by type
-            object_counts = Counter()
-            for obj in house.get('objects', []):
-                obj_type = obj.get('objectType', '').lower()
-                object_counts[obj_type] += 1
-            
-            # Basic structure counts
-            features['total_rooms'] = len(house.get('rooms', []))
-            features['total_objects'] = len(house.get('objects', []))
-            features['total_doors'] = len(house.get('doors', []))
-            features['total_windows'] = len(house.get('windows', []))
-            
-            # Room counts by type
-            features['room_counts'] = dict(room_counts)
-            
-            # Object counts by type
-            features['object_counts'] = dict(object_counts)
-            
-            # Add to template features list
-            self.template_features.append(features)
-        
-        logger.info(f"Analyzed {len(self.template_features)} templates")
+        """Take the per-template count arrays used for vectorized matching from the index
+
+        Each shard holds total counts plus room_count_matrix / object_count_matrix
+        with one row per template and one column per lower-cased type, numbered
+        as in room_types / object_types.
+        """
+        self.shards = self.templates.shards
+        self.room_types = self.templates.room_types
+        self.object_types = self.templates.object_types
+
+        logger.info(f"Analyzed {len(self.templates)} templates in {len(self.shards)} shards "
+                    f"({len(self.room_types)} room types, {len(self.object_types)} object types)")
+
+    def _load_text_index(self, svd_components: int):
+        """Map the persisted TF-IDF matrix of the template descriptions, fitting it on first use"""
+        if not len(self.templates):
+            return None
+        try:
+            return load_text_index(self.templates, self.vectorizer, self.index_dir,
+                                   svd_components if self.text_search == "svd" else 0)
+        except Exception as e:
+            logger.error(f"Failed to load text index, scoring without text similarity: {str(e)}")
+            return None
+
+    def _get_template(self, idx: int) -> Dict:
+        """Template idx, parsed from its line in the template file or taken from the LRU of recent results"""
+        idx = int(idx)
+        template = self._template_cache.get(idx)
+        if template is not None:
+            self._template_cache.move_to_end(idx)
+            return template
+
+        template = self.templates[idx]
+        self._template_cache[idx] = template
+        while len(self._template_cache) > self.template_cache_size:
+            self._template_cache.popitem(last=False)
+        return template
+
+    @property
+    def text_features(self) -> List[str]:
+        """Template descriptions for text-based similarity, read from the template file on first use"""
+        if self._text_features is None:
+            self._text_features = self._extract_all_text_features()
+        return self._text_features
 
     def _extract_all_text_features(self) -> List[str]:
         """Extract text descriptions from templates for text-based similarity"""
-        if not self.templates:
+        if not len(self.templates):
             return []
         return [template.get('nl_description', '') for template in self.templates]
 
@@ -137,300 +151,589 @@ class ProcTHORValidator:
             - object_counts: Dictionary of object types and their counts
             - numeric_values: Dictionary of numeric attributes (floors, dimensions, etc.)
         """
-        # Clean and normalize input text
-        text = input_text.lower()
-        
-        # Extract numbers with context
+        return self.keyword_extractor.extract(input_text)
+
+    @staticmethod
+    def _parse_house(input_data: Union[str, Dict]) -> Optional[Dict]:
+        """input_data as a house dict when it is one or is a JSON string of one, otherwise None"""
+        house = input_data
+        if isinstance(input_data, str):
+            if not input_data.lstrip().startswith('{'):
+                return None
+            try:
+                house = json.loads(input_data)
+            except JSONDecodeError:
+                return None
+        if not isinstance(house, dict):
+            return None
+        rooms = house.get('rooms')
+        if not isinstance(rooms, list) or not rooms or not all(isinstance(room, dict) for room in rooms):
+            return None
+        return house
+
+    def _extract_house_features(self, house: Dict) -> Tuple[Dict[str, int], Dict[str, int], Dict[str, int]]:
+        """
+        Read room_counts, object_counts and numeric_values straight from a parsed house
+        Room and object types are lower-cased by house_features, as in the template index,
+        so they line up with the template columns. Model output only nests objects in its
+        rooms, so those are counted when the house has no top-level objects list.
+        """
+        totals, room_counts, object_counts = house_features(house)
+        if 'objects' not in house:
+            object_counts = Counter(obj.get('objectType', '').lower()
+                                    for room in house['rooms'] for obj in room.get('objects', []))
+        room_counts.pop('', None)
+        object_counts.pop('', None)
+
         numeric_values = {}
-        
-        # Look for number of rooms
-        room_count_patterns = [
-            r'(\d+)\s*rooms?',
-            r'rooms?[\s:]+(\d+)',
-            r'numrooms?[\s:]+(\d+)',
-            r'number\s+of\s+rooms?[\s:]+(\d+)'
-        ]
-        
-        for pattern in room_count_patterns:
-            match = re.search(pattern, text)
-            if match:
-                numeric_values['total_rooms'] = int(match.group(1))
-                break
-        
-        # Look for number of floors
-        floor_patterns = [
-            r'(\d+)\s*floors?',
-            r'floors?[\s:]+(\d+)',
-            r'numfloors?[\s:]+(\d+)',
-            r'number\s+of\s+floors?[\s:]+(\d+)',
-            r'stories?[\s:]+(\d+)',
-            r'(\d+)\s*stor(?:ies|ys?)'
-        ]
-        
-        for pattern in floor_patterns:
-            match = re.search(pattern, text)
-            if match:
-                numeric_values['floors'] = int(match.group(1))
-                break
-        
-        # Look for dimensions
-        dimension_patterns = [
-            r'dimensions?[\s:]+(\d+)[^\d]*(\d+)',
-            r'size[\s:]+(\d+)[^\d]*(\d+)',
-            r'(\d+)\s*[xX]\s*(\d+)',
-            r'width[\s:]+(\d+)',
-            r'length[\s:]+(\d+)'
-        ]
-        
-        for pattern in dimension_patterns:
-            match = re.search(pattern, text)
-            if match:
-                try:
-                    if len(match.groups()) >= 2:
-                        numeric_values['width'] = int(match.group(1))
-                        numeric_values['length'] = int(match.group(2))
-                    else:
-                        numeric_values['dimension'] = int(match.group(1))
-                except (ValueError, IndexError):
-                    pass
-                break
-        
-        # Extract room types and counts
-        room_counts = defaultdict(int)
-        
-        # First look for explicit room counts
-        room_type_patterns = {
-            "kitchen": [r'(\d+)\s*kitchens?', r'kitchens?[\s:]+(\d+)'],
-            "bedroom": [r'(\d+)\s*bedrooms?', r'bedrooms?[\s:]+(\d+)'],
-            "bathroom": [r'(\d+)\s*bathrooms?', r'bathrooms?[\s:]+(\d+)'],
-            "living": [r'(\d+)\s*living\s*rooms?', r'living\s*rooms?[\s:]+(\d+)']
-        }
-        
-        for room_type, patterns in room_type_patterns.items():
-            for pattern in patterns:
-                match = re.search(pattern, text)
-                if match:
-                    try:
-                        room_counts[room_type] = int(match.group(1))
-                    except (ValueError, IndexError):
-                        room_counts[room_type] = 1
-                    break
-        
-        # Then check for mentions without explicit counts
-        for room_type, keywords in self.room_keywords.items():
-            if room_type not in room_counts:  # Only if not already found with count
-                for keyword in keywords:
-                    if re.search(r'\b' + re.escape(keyword) + r'\b', text):
-                        room_counts[room_type] = 1
-                        break
-        
-        # Extract object types and counts
-        object_counts = defaultdict(int)
-        
-        # Common objects and their patterns
-        object_type_patterns = {
-            "table": [r'(\d+)\s*tables?', r'tables?[\s:]+(\d+)'],
-            "chair": [r'(\d+)\s*chairs?', r'chairs?[\s:]+(\d+)'],
-            "sofa": [r'(\d+)\s*sofas?', r'sofas?[\s:]+(\d+)'],
-            "bed": [r'(\d+)\s*beds?', r'beds?[\s:]+(\d+)'],
-            "sink": [r'(\d+)\s*sinks?', r'sinks?[\s:]+(\d+)'],
-            "toilet": [r'(\d+)\s*toilets?', r'toilets?[\s:]+(\d+)']
-        }
-        
-        for obj_type, patterns in object_type_patterns.items():
-            for pattern in patterns:
-                match = re.search(pattern, text)
-                if match:
-                    try:
-                        object_counts[obj_type] = int(match.group(1))
-                    except (ValueError, IndexError):
-                        object_counts[obj_type] = 1
-                    break
-        
-        # Then scan for simple mentions
-        for category, keywords in self.object_keywords.items():
-            for keyword in keywords:
-                if re.search(r'\b' + re.escape(keyword) + r'\b', text):
-                    if keyword not in object_counts:
-                        object_counts[keyword] = 1
-        
+        num_rooms = house.get('numRooms')
+        has_count = isinstance(num_rooms, int) and not isinstance(num_rooms, bool)
+        numeric_values['total_rooms'] = num_rooms if has_count else totals[0]
+        floors = house.get('floors')
+        if isinstance(floors, int) and not isinstance(floors, bool):
+            numeric_values['floors'] = floors
+        dimensions = house.get('dimensions')
+        if isinstance(dimensions, dict) and all(isinstance(dimensions.get(axis), (int, float)) for axis in 'xy'):
+            numeric_values['width'] = int(dimensions['x'])
+            numeric_values['length'] = int(dimensions['y'])
         return room_counts, object_counts, numeric_values
 
-    def _score_template(self, 
-                    template_idx: int, 
-                    room_counts: Dict[str, int], 
-                    object_counts: Dict[str, int], 
-                    numeric_values: Dict[str, int]) -> float:
+    def _extract_features(self, input_data: Union[str, Dict]) -> Tuple[str, Dict[str, int], Dict[str, int], Dict[str, int]]:
+        """(text for description similarity, room_counts, object_counts, numeric_values) of an input
+
+        Inputs that parse into a house are read structurally; anything else is
+        scraped for keywords and numbers.
         """
-        Modified scoring function that:
+        house = self._parse_house(input_data)
+        if house is not None:
+            try:
+                room_counts, object_counts, numeric_values = self._extract_house_features(house)
+                input_text = " ".join([f"{numeric_values['total_rooms']} rooms"] + list(room_counts) + list(object_counts))
+                logger.info(f"Read features from parsed house: '{input_text[:100]}...'")
+                return input_text, room_counts, object_counts, numeric_values
+            except (AttributeError, TypeError) as e:
+                logger.warning(f"Could not read parsed house, falling back to text: {str(e)}")
+
+        input_text = self._extract_text_from_input(input_data)
+        logger.info(f"Extracted text for analysis: '{input_text[:100]}...'")
+        room_counts, object_counts, numeric_values = self._extract_keywords_and_counts(input_text)
+        return input_text, room_counts, object_counts, numeric_values
+
+    def _score_templates(self,
+                         shard: TemplateShard,
+                         room_counts: Dict[str, int],
+                         object_counts: Dict[str, int],
+                         numeric_values: Dict[str, int],
+                         rng: np.random.Generator,
+                         rows: Optional[np.ndarray] = None,
+                         text_similarity: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Score every template of a shard (or only the given rows of it) at once with array operations. The scoring:
         1. Heavily prioritizes matching room counts
         2. Penalizes templates with too few rooms/objects compared to input
         3. Uses template index in scoring to break ties
         4. Adds randomization factor to prevent always selecting the same templates
-        
-        Returns a score between 0 (no match) and 1 (perfect match)
+        5. Blends in the shard's description similarity to the input, when given, by text_weight
+
+        Returns an array with one score between 0 (no match) and 1 (perfect match) per scored template
         """
-        template_features = self.template_features[template_idx]
-        score = 0.0
+        if rows is None:
+            rows = slice(None)
+            positions = np.arange(shard.start, shard.start + len(shard))
+        else:
+            positions = shard.start + rows
+        num_templates = len(positions)
+        score = np.zeros(num_templates)
         total_weight = 0.0
-        
+
         # Apply a small random factor (1-5%) to break ties
-        random_factor = 1.0 + (random.random() * 0.04)
-        
+        random_factor = 1.0 + rng.random(num_templates) * 0.04
+
         # === ROOM COUNT MATCHING (HIGHEST PRIORITY) ===
         if 'total_rooms' in numeric_values:
-            weight = 10.0  # Increased from 5.0
+            weight = 10.0
             total_weight += weight
-            template_rooms = template_features['total_rooms']
+            template_rooms = shard.total_rooms[rows]
             target_rooms = numeric_values['total_rooms']
-            
-            # Perfect match gets full score
-            if template_rooms == target_rooms:
-                score += weight
-            # Close match gets partial score
-            elif abs(template_rooms - target_rooms) == 1:
-                score += 0.7 * weight
-            elif abs(template_rooms - target_rooms) == 2:
-                score += 0.4 * weight
-            # Heavily penalize templates with fewer rooms than requested
-            elif template_rooms < target_rooms:
-                score -= 0.5 * weight  # Negative score for missing rooms
-            # Small penalty for having too many rooms
-            else:
-                score += 0.2 * weight
-        
+            score += self._room_count_score(template_rooms, target_rooms, weight)
+
         # === ROOM TYPE MATCHING ===
         for room_type, count in room_counts.items():
-            weight = 5.0  # Increased from 3.0
+            weight = 5.0
             total_weight += weight
-            template_count = template_features['room_counts'].get(room_type, 0)
-            
-            # Perfect match gets full score
-            if template_count == count:
-                score += weight
-            # Partial matches get proportional scores
-            elif template_count > 0 and count > 0:
-                # Calculate proportion of matched rooms
-                match_ratio = min(template_count, count) / max(template_count, count)
-                score += match_ratio * weight
-            # Penalize missing room types that were specifically requested
-            elif template_count == 0 and count > 0:
-                score -= 0.3 * weight  # Negative score for missing room types
-        
+            template_count = shard.column(shard.room_count_matrix, self.templates.room_type_index.get(room_type))[rows]
+            score += self._room_type_score(template_count, count, weight)
+
         # === OBJECT MATCHING ===
-        # Track how many requested objects are present
-        object_match_score = 0
-        object_match_count = 0
-        
         for obj_type, count in object_counts.items():
-            weight = 2.0  # Increased from 1.0
+            weight = 2.0
             total_weight += weight
-            template_count = template_features['object_counts'].get(obj_type, 0)
-            
-            # Perfect or excess object count
-            if template_count >= count:
-                object_match_score += weight
-            # Partial object presence
-            elif template_count > 0:
-                match_ratio = template_count / count
-                object_match_score += match_ratio * weight
-            # Missing objects that were requested
-            else:
-                object_match_score -= 0.2 * weight  # Penalty for missing objects
-            
-            object_match_count += 1
-        
-        # Add object matching score if we checked any objects
-        if object_match_count > 0:
-            score += object_match_score
-        
+            template_count = shard.column(shard.object_count_matrix, self.templates.object_type_index.get(obj_type))[rows]
+            score += self._object_score(template_count, count, weight)
+
         # === OTHER STRUCTURAL FEATURES ===
         # Match on floors if specified
         if 'floors' in numeric_values:
             weight = 4.0
             total_weight += weight
-            
-            # We don't have floors in template_features, so we'll need to add this
-            # For now, assume single floor if not specified
-            template_floors = 1  # This should be extracted from the template in a real implementation
+
+            # Templates carry no floor count, so assume single floor
+            template_floors = 1
             target_floors = numeric_values['floors']
-            
+
             if template_floors == target_floors:
                 score += weight
             elif abs(template_floors - target_floors) == 1:
                 score += 0.5 * weight
-        
-        # === ENSURE DIVERSE SELECTIONS ===
-        # Add a small bias based on template index to prevent always selecting the same templates
-        # This ensures that templates with identical scores don't always resolve to the same one
-        diversity_factor = (template_idx % 100) / 10000  # Small factor based on index
-        
-        # If we have nothing to score on, return a small random value to enable selection
+
+        # If we have nothing to score on, use small random values to enable selection
         if total_weight == 0:
-            return random.uniform(0.01, 0.1) * random_factor
-        
-        # Calculate final score with randomization and diversity factors
-        normalized_score = (score / total_weight) * random_factor + diversity_factor
-        
-        # Ensure score is between 0 and 1
-        return max(0, min(normalized_score, 1.0))
+            normalized_score = rng.uniform(0.01, 0.1, num_templates) * random_factor
+        else:
+            # === ENSURE DIVERSE SELECTIONS ===
+            # Small bias based on template index so identical scores don't always resolve to the same template
+            diversity_factor = (positions % 100) / 10000
+
+            # Final score with randomization and diversity factors
+            normalized_score = (score / total_weight) * random_factor + diversity_factor
+
+        # === TEXT SIMILARITY ===
+        if text_similarity is not None:
+            normalized_score = (1 - self.text_weight) * normalized_score + self.text_weight * text_similarity[rows]
+
+        # Ensure scores are between 0 and 1
+        return np.clip(normalized_score, 0, 1.0)
+
+    @staticmethod
+    def _room_count_score(template_rooms: np.ndarray, target_rooms: int, weight: float = 10.0) -> np.ndarray:
+        """Perfect match gets full score, close matches partial scores, too few rooms a heavy penalty and too many a small score"""
+        difference = np.abs(template_rooms - target_rooms)
+        return np.select(
+            [difference == 0, difference == 1, difference == 2, template_rooms < target_rooms],
+            [weight, 0.7 * weight, 0.4 * weight, -0.5 * weight],
+            default=0.2 * weight
+        )
+
+    @staticmethod
+    def _room_type_score(template_count: np.ndarray, count: int, weight: float = 5.0) -> np.ndarray:
+        """Perfect match gets full score, partial matches proportional scores, and requested room types that are missing a penalty"""
+        if count > 0:
+            match_ratio = np.minimum(template_count, count) / np.maximum(template_count, count)
+            return np.where(template_count > 0, match_ratio * weight, -0.3 * weight)
+        return np.where(template_count == 0, weight, 0.0)
+
+    @staticmethod
+    def _object_score(template_count: np.ndarray, count: int, weight: float = 2.0) -> np.ndarray:
+        """Perfect or excess object count, partial object presence, missing objects"""
+        return np.select(
+            [template_count >= count, template_count > 0],
+            [weight, template_count / max(count, 1) * weight],
+            default=-0.2 * weight
+        )
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first (ties go to the lower index, as with a stable sort)"""
+        k = min(k, len(scores))
+        if k == 0:
+            return np.arange(0)
+        # Everything tied with the k-th best is kept so the index tie-break is exact
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+        return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+    @staticmethod
+    def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        """Column indices of the k highest scores of every row, in column order (ties go to the lower column, as in _top_k)"""
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.zeros((len(scores), 0), dtype=np.int64)
+        kth_score = -np.partition(-scores, k - 1, axis=1)[:, k - 1:k]
+        above = scores > kth_score
+        # Of the scores tied with the k-th best, only the lowest columns that still fit are kept
+        tied = scores == kth_score
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= k - above.sum(axis=1, keepdims=True)))
+        return np.nonzero(keep)[1].reshape(len(scores), k)
+
+    def _candidate_rows(self,
+                        room_counts: Dict[str, int],
+                        object_counts: Dict[str, int],
+                        numeric_values: Dict[str, int]) -> Optional[List[np.ndarray]]:
+        """Per-shard rows worth scoring, found by intersecting the index bitsets
+
+        Starts with templates having exactly the requested room count and
+        every requested room and object type, then widens the room count to
+        +-1 and +-2, then drops the object and room type requirements, until
+        at least min_candidates templates pass. Returns None when nothing
+        narrows the search, or nothing short of all templates is enough.
+        """
+        room_cols = [self.templates.room_type_index[room_type] for room_type, count in room_counts.items()
+                     if count > 0 and room_type in self.templates.room_type_index]
+        object_cols = [self.templates.object_type_index[obj_type] for obj_type, count in object_counts.items()
+                       if count > 0 and obj_type in self.templates.object_type_index]
+        target_rooms = numeric_values.get('total_rooms')
+        tolerances = (0, 1, 2) if target_rooms is not None else (None,)
+        levels = [(tolerance, room_cols, object_cols) for tolerance in tolerances]
+        levels += [(tolerances[-1], room_cols, []), (tolerances[-1], [], [])]
+
+        for tolerance, level_room_cols, level_object_cols in levels:
+            if tolerance is None and not level_room_cols and not level_object_cols:
+                break
+            shard_rows = []
+            for shard in self.shards:
+                bits = np.full((len(shard) + 7) // 8, 0xFF, dtype=np.uint8)
+                if tolerance is not None:
+                    bits &= shard.room_count_range_bits(target_rooms - tolerance, target_rooms + tolerance)
+                for col in level_room_cols:
+                    bits &= shard.type_bits(shard.room_type_bits, col)
+                for col in level_object_cols:
+                    bits &= shard.type_bits(shard.object_type_bits, col)
+                shard_rows.append(shard.rows(bits))
+            candidates = sum(len(rows) for rows in shard_rows)
+            if candidates >= self.min_candidates:
+                logger.info(f"Scoring {candidates} of {len(self.templates)} templates "
+                            f"(room count tolerance {tolerance}, {len(level_room_cols)} room types, "
+                            f"{len(level_object_cols)} object types)")
+                return shard_rows
+        return None
+
+    def _rank_templates(self,
+                        room_counts: Dict[str, int],
+                        object_counts: Dict[str, int],
+                        numeric_values: Dict[str, int],
+                        k: int = 20,
+                        text_similarity: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """The k best (template index, score) pairs over all shards, highest score first
+
+        text_similarity, if given, holds every template's description similarity to the input.
+
+        Every shard keeps only its own top k, and those are merged with a
+        bounded heap, so memory does not grow with the number of templates.
+        Each shard draws its tie-break noise from a generator seeded from
+        np.random, which keeps results reproducible under np.random.seed
+        whatever order the worker threads finish in.
+        """
+        seed = np.random.randint(2**31)
+        candidate_rows = self._candidate_rows(room_counts, object_counts, numeric_values) if self.prune else None
+
+        def shard_top_k(number):
+            shard = self.shards[number]
+            rows = candidate_rows[number] if candidate_rows is not None else None
+            if rows is not None and not len(rows):
+                return []
+            rng = np.random.default_rng([seed, number])
+            shard_similarity = None
+            if text_similarity is not None:
+                shard_similarity = text_similarity[shard.start:shard.start + len(shard)]
+            scores = self._score_templates(shard, room_counts, object_counts, numeric_values, rng, rows,
+                                           shard_similarity)
+            top = self._top_k(scores, k)
+            positions = rows[top] if rows is not None else top
+            return [(shard.start + int(position), float(scores[idx])) for position, idx in zip(positions, top)]
+
+        if self.workers > 1 and len(self.shards) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            shard_results = self._executor.map(shard_top_k, range(len(self.shards)))
+        else:
+            shard_results = map(shard_top_k, range(len(self.shards)))
+
+        # Ties go to the lower template index, as with a stable sort
+        candidates = (pair for shard_result in shard_results for pair in shard_result)
+        return heapq.nlargest(k, candidates, key=lambda pair: (pair[1], -pair[0]))
 
     def validate(self, input_data: Union[str, Dict]) -> Dict:
         """Main validation workflow for handling malformed JSON inputs"""
         try:
-            # Extract text for keyword analysis
-            input_text = self._extract_text_from_input(input_data)
-            logger.info(f"Extracted text for analysis: '{input_text[:100]}...'")
-            
-            # Extract features from text
-            room_counts, object_counts, numeric_values = self._extract_keywords_and_counts(input_text)
+            # Read features from a parsed house, or extract them from its text
+            input_text, room_counts, object_counts, numeric_values = self._extract_features(input_data)
             
             logger.info(f"Extracted room counts: {room_counts}")
             logger.info(f"Extracted object counts: {object_counts}")
             logger.info(f"Extracted numeric values: {numeric_values}")
             
-            # Score all templates
-            scores = []
-            for i in range(len(self.templates)):
-                score = self._score_template(i, room_counts, object_counts, numeric_values)
-                scores.append((i, score))
+            # Cosine similarity of the input to every template description, in one sparse product
+            text_similarity = None
+            if self.text_index is not None:
+                text_similarity = self.text_index.similarity(input_text, approximate=self.text_search == "svd")
+
+            # Score all templates and keep the best 20, highest first
+            scores = self._rank_templates(room_counts, object_counts, numeric_values, k=20,
+                                          text_similarity=text_similarity)
             
-            # Sort by score descending
-            scores.sort(key=lambda x: x[1], reverse=True)
+            return self._get_template(self._select_template(scores))
+                
+        except Exception as e:
+            logger.error(f"Error during validation: {str(e)}")
+            return self._random_template()
+
+    def _select_template(self, scores: List[Tuple[int, float]]) -> int:
+        """Pick a template index from the top 20 (template index, score) pairs, highest first"""
+        # Get top 5 templates
+        top_templates = scores[:5]
+        logger.info(f"Top 5 template scores: {[(idx, round(score, 3)) for idx, score in top_templates]}")
+        
+        # If we have reasonable matches, randomly select one with weights proportional to scores
+        if top_templates[0][1] > 0.2:  # Threshold can be adjusted
+            # Extract indices and scores
+            indices = [idx for idx, _ in top_templates]
+            template_scores = [score for _, score in top_templates]
             
-            # Get top 5 templates
-            top_templates = scores[:5]
-            logger.info(f"Top 5 template scores: {[(idx, round(score, 3)) for idx, score in top_templates]}")
+            # Use scores as weights, normalize to sum to 1
+            weights = np.array(template_scores)
+            weights = weights / weights.sum()
             
-            # If we have reasonable matches, randomly select one with weights proportional to scores
-            if top_templates[0][1] > 0.2:  # Threshold can be adjusted
-                # Extract indices and scores
-                indices = [idx for idx, _ in top_templates]
-                template_scores = [score for _, score in top_templates]
-                
-                # Use scores as weights, normalize to sum to 1
-                weights = np.array(template_scores)
-                weights = weights / weights.sum()
-                
-                # Randomly select template index based on weights
-                selected_idx = np.random.choice(indices, p=weights)
-                selected_score = dict(top_templates)[selected_idx]
-                
-                logger.info(f"Selected template {selected_idx} with score {selected_score:.3f}")
-                return self.templates[selected_idx]
+            # Randomly select template index based on weights
+            selected_idx = np.random.choice(indices, p=weights)
+            selected_score = dict(top_templates)[selected_idx]
+            
+            logger.info(f"Selected template {selected_idx} with score {selected_score:.3f}")
+            return selected_idx
+        else:
+            # If no good matches, select a random template from the top 20
+            top_20_indices = [idx for idx, _ in scores[:20]]
+            selected_idx = random.choice(top_20_indices)
+            logger.info(f"No strong matches found. Randomly selected template {selected_idx}")
+            return selected_idx
+
+    def _random_template(self) -> Dict:
+        # If all else fails, select a completely random template
+        random_idx = random.randint(0, len(self.templates) - 1)
+        logger.info(f"Error occurred. Using random template {random_idx}")
+        return self._get_template(random_idx)
+
+    def _query_batch(self, features: List[Tuple[str, Dict[str, int], Dict[str, int], Dict[str, int]]]) -> Dict:
+        """Turn the features of a batch of inputs into score terms shared across queries
+
+        Each distinct (room count), (room type, count) or (object type, count)
+        requested in the batch is one term, scored once per template block;
+        terms is a sparse (queries x terms) indicator of which query asked for
+        which. Floors and types no template has add a constant per query, as
+        their template value is the same for every template.
+        """
+        size = len(features)
+        term_index = {}
+        query_terms, term_columns = [], []
+        constant = np.zeros(size)
+        total_weight = np.zeros(size)
+
+        def add_term(query, key):
+            term_columns.append(term_index.setdefault(key, len(term_index)))
+            query_terms.append(query)
+
+        no_templates = np.zeros(1, dtype=np.int16)
+        for query, (_, room_counts, object_counts, numeric_values) in enumerate(features):
+            if 'total_rooms' in numeric_values:
+                total_weight[query] += 10.0
+                add_term(query, ("rooms", numeric_values['total_rooms']))
+            for room_type, count in room_counts.items():
+                total_weight[query] += 5.0
+                col = self.templates.room_type_index.get(room_type)
+                if col is None:
+                    constant[query] += self._room_type_score(no_templates, count)[0]
+                else:
+                    add_term(query, ("room", col, count))
+            for obj_type, count in object_counts.items():
+                total_weight[query] += 2.0
+                col = self.templates.object_type_index.get(obj_type)
+                if col is None:
+                    constant[query] += self._object_score(no_templates, count)[0]
+                else:
+                    add_term(query, ("object", col, count))
+            # Templates carry no floor count, so assume single floor
+            if 'floors' in numeric_values:
+                total_weight[query] += 4.0
+                if numeric_values['floors'] == 1:
+                    constant[query] += 4.0
+                elif abs(1 - numeric_values['floors']) == 1:
+                    constant[query] += 0.5 * 4.0
+
+        terms = sparse.csr_matrix((np.ones(len(query_terms)), (query_terms, term_columns)),
+                                  shape=(size, len(term_index)))
+        return {"keys": list(term_index), "terms": terms, "constant": constant, "total_weight": total_weight}
+
+    def _score_block(self,
+                     shard: TemplateShard,
+                     rows: Union[slice, np.ndarray],
+                     batch: Dict,
+                     rng: np.random.Generator,
+                     text_similarity: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Scores of every query in batch against a block of shard rows, a slice or row array (queries x templates)
+
+        Every term is scored once for the block as in _score_templates, and the
+        queries' raw scores are one sparse matrix product of the batch's term
+        indicator with those term scores.
+        """
+        if isinstance(rows, slice):
+            positions = np.arange(shard.start + rows.start, shard.start + rows.stop)
+        else:
+            positions = shard.start + rows
+        num_queries, num_templates = len(batch["constant"]), len(positions)
+
+        term_scores = np.empty((len(batch["keys"]), num_templates))
+        for term, key in enumerate(batch["keys"]):
+            if key[0] == "rooms":
+                term_scores[term] = self._room_count_score(shard.total_rooms[rows], key[1])
+            elif key[0] == "room":
+                term_scores[term] = self._room_type_score(shard.column(shard.room_count_matrix, key[1])[rows], key[2])
             else:
-                # If no good matches, select a random template from the top 20
-                top_20_indices = [idx for idx, _ in scores[:20]]
-                selected_idx = random.choice(top_20_indices)
-                logger.info(f"No strong matches found. Randomly selected template {selected_idx}")
-                return self.templates[selected_idx]
-                
+                term_scores[term] = self._object_score(shard.column(shard.object_count_matrix, key[1])[rows], key[2])
+        score = batch["terms"] @ term_scores
+        score += batch["constant"][:, None]
+
+        # Apply a small random factor (1-5%) to break ties
+        random_factor = rng.random((num_queries, num_templates), dtype=np.float32)
+        random_factor *= 0.04
+        random_factor += 1.0
+
+        # Small bias based on template index so identical scores don't always resolve to the same template.
+        # Updated in place: the block arrays are the largest allocations of a batch.
+        total_weight = batch["total_weight"]
+        normalized_score = score
+        normalized_score /= np.where(total_weight > 0, total_weight, 1)[:, None]
+        normalized_score *= random_factor
+        normalized_score += (positions % 100) / 10000
+        # Queries with nothing to score on get small random values, as in _score_templates
+        nothing = np.flatnonzero(total_weight == 0)
+        if len(nothing):
+            normalized_score[nothing] = rng.uniform(0.01, 0.1, (len(nothing), num_templates)) * random_factor[nothing]
+
+        # === TEXT SIMILARITY ===
+        if text_similarity is not None:
+            normalized_score *= 1 - self.text_weight
+            normalized_score += self.text_weight * text_similarity
+
+        return np.clip(normalized_score, 0, 1.0, out=normalized_score)
+
+    def _batch_candidate_rows(self, features: List[Tuple[str, Dict[str, int], Dict[str, int], Dict[str, int]]]
+                              ) -> Tuple[Optional[List[np.ndarray]], List[Optional[List[np.ndarray]]]]:
+        """(per-shard union of the inputs' _candidate_rows, each input's own _candidate_rows)
+
+        The union is None if any input needs every template.
+        """
+        query_rows = [self._candidate_rows(room_counts, object_counts, numeric_values)
+                      for _, room_counts, object_counts, numeric_values in features]
+        if any(rows is None for rows in query_rows):
+            return None, query_rows
+        union = [np.unique(np.concatenate(shard_rows)) for shard_rows in zip(*query_rows)]
+        return union, query_rows
+
+    def _rank_batch(self, features: List[Tuple[str, Dict[str, int], Dict[str, int], Dict[str, int]]],
+                    k: int = 20, block_size: int = 32768) -> List[List[Tuple[int, float]]]:
+        """The k best (template index, score) pairs of every input in a batch, highest score first
+
+        All queries are scored at once against block_size templates at a
+        time, and only a running top k per query is kept, so memory is
+        bounded by queries x block_size whatever the corpus size. With
+        pruning, only the union of the inputs' candidate templates is scored,
+        and each input's scores are masked to its own candidates, so it ranks
+        the same templates as _rank_templates whatever else is in the batch.
+        """
+        batch = self._query_batch(features)
+        num_queries = len(features)
+        text_queries = None
+        approximate = self.text_search == "svd"
+        if self.text_index is not None:
+            text_queries = self.text_index.queries([text for text, _, _, _ in features], approximate=approximate)
+        seed = np.random.randint(2**31)
+        candidate_rows, query_rows = self._batch_candidate_rows(features) if self.prune else (None, None)
+
+        def shard_top_k(number):
+            shard = self.shards[number]
+            rng = np.random.default_rng([seed, number])
+            best_scores = np.full((num_queries, 0), -np.inf)
+            best_indices = np.zeros((num_queries, 0), dtype=np.int64)
+            num_rows = len(shard) if candidate_rows is None else len(candidate_rows[number])
+            for block_start in range(0, num_rows, block_size):
+                rows = slice(block_start, min(block_start + block_size, num_rows))
+                if candidate_rows is None:
+                    positions = np.arange(shard.start + rows.start, shard.start + rows.stop)
+                    templates = slice(shard.start + rows.start, shard.start + rows.stop)
+                else:
+                    rows = candidate_rows[number][rows]
+                    positions = templates = shard.start + rows
+                text_similarity = None
+                if text_queries is not None:
+                    text_similarity = self.text_index.similarity_block(text_queries, templates, approximate)
+                scores = self._score_block(shard, rows, batch, rng, text_similarity)
+                if query_rows is not None:
+                    for query, own_rows in enumerate(query_rows):
+                        if own_rows is not None:
+                            scores[query, ~np.isin(positions - shard.start, own_rows[number])] = -np.inf
+                top = self._top_k_rows(scores, k)
+                best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_indices = np.concatenate([best_indices, positions[top]], axis=1)
+                # Ties go to the lower template index, as with a stable sort
+                order = np.lexsort((best_indices, -best_scores))[:, :k]
+                best_scores = np.take_along_axis(best_scores, order, axis=1)
+                best_indices = np.take_along_axis(best_indices, order, axis=1)
+            return best_scores, best_indices
+
+        if self.workers > 1 and len(self.shards) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            shard_results = list(self._executor.map(shard_top_k, range(len(self.shards))))
+        else:
+            shard_results = [shard_top_k(number) for number in range(len(self.shards))]
+
+        scores = np.concatenate([shard_scores for shard_scores, _ in shard_results], axis=1)
+        indices = np.concatenate([shard_indices for _, shard_indices in shard_results], axis=1)
+        order = np.lexsort((indices, -scores))[:, :k]
+        # Inputs with fewer than k candidates come back with fewer pairs, as from _rank_templates
+        return [[(int(idx), float(score)) for idx, score in zip(indices[query, order[query]], scores[query, order[query]])
+                 if score > -np.inf]
+                for query in range(num_queries)]
+
+    def validate_many(self, inputs: Iterable[Union[str, Dict]], batch_size: int = 64,
+                      block_size: int = 32768) -> Iterator[Dict]:
+        """Validate many inputs, yielding one selected template per input in input order
+
+        inputs may be any iterable, e.g. a generator over a large file: it is
+        read batch_size inputs at a time, and each batch is scored against the
+        templates in one blocked computation (see _rank_batch), so memory
+        stays bounded however many inputs there are. Feature extraction is
+        pure-Python work that holds the GIL, so it runs serially; only the
+        NumPy shard scoring uses the validator's worker threads. Templates are
+        selected as in validate(); the tie-break noise is drawn per batch, so
+        results under np.random.seed differ from calling validate() in turn.
+        """
+        inputs = iter(inputs)
+        while True:
+            batch_inputs = list(itertools.islice(inputs, batch_size))
+            if not batch_inputs:
+                return
+            if not len(self.templates):
+                yield from (self.validate(input_data) for input_data in batch_inputs)
+                continue
+
+            features = [self._safe_extract_features(input_data) for input_data in batch_inputs]
+
+            valid = [query for query, feature in enumerate(features) if feature is not None]
+            try:
+                rankings = {}
+                if valid:
+                    ranked = self._rank_batch([features[query] for query in valid], block_size=block_size)
+                    rankings = dict(zip(valid, ranked))
+            except Exception as e:
+                logger.error(f"Error during batch validation, validating one by one: {str(e)}")
+                yield from (self.validate(input_data) for input_data in batch_inputs)
+                continue
+            logger.info(f"Scored a batch of {len(valid)} inputs against {len(self.templates)} templates")
+
+            for query in range(len(batch_inputs)):
+                if query in rankings:
+                    yield self._get_template(self._select_template(rankings[query]))
+                else:
+                    yield self._random_template()
+
+    def _safe_extract_features(self, input_data: Union[str, Dict]):
+        """_extract_features, or None when the input cannot be read at all"""
+        try:
+            return self._extract_features(input_data)
         except Exception as e:
             logger.error(f"Error during validation: {str(e)}")
-            # If all else fails, select a completely random template
-            random_idx = random.randint(0, len(self.templates) - 1)
-            logger.info(f"Error occurred. Using random template {random_idx}")
-            return self.templates[random_idx]
+            return None
 
     def _extract_text_from_input(self, input_data: Union[str, Dict]) -> str:
         """Extract usable text from malformed input"""
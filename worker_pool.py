@@ -0,0 +1,502 @@
+#worker_pool
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import connection
+
+from quantization import SUPPORTED_MODES
+
+# Multi-process CPU inference: N HouseModelInference replicas, each in its own
+# process with its own intra-op thread budget (and optionally pinned to its
+# own cores). The parent hands out prompts one at a time over a private pipe
+# per worker, so it always knows which prompt each worker holds, and a worker
+# that dies cannot leave a lock shared with the others held. Many short
+# prompts scale far better this way than through one model whose torch
+# threads fight over a large machine.
+#
+# torch is only imported inside the worker processes, after the thread
+# environment variables are set, so the parent stays light.
+
+READY = "ready"
+FAILED = "failed"
+# Seconds the collector waits for worker messages before rechecking its state
+LIVENESS_INTERVAL = 1.0
+
+
+class WorkerDiedError(RuntimeError):
+    """A worker process exited while generating the task's output."""
+
+
+def _available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _worker_main(worker_id, model_path, num_threads, cpus, model_kwargs, conn):
+    """Worker process: load a replica, then answer (task_id, description, max_length) tasks until None.
+
+    Tasks arrive and results leave through conn, the worker's own pipe to the parent.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+        torch.set_num_interop_threads(1)
+
+        from model_runner import HouseModelInference
+        from model_service import WARMUP_DESCRIPTION, WARMUP_MAX_LENGTH
+        cache_path = model_kwargs.pop("cache_path", None)
+        if cache_path:
+            from generation_cache import GenerationCache
+            model_kwargs["cache"] = GenerationCache(cache_path)
+
+        start = time.perf_counter()
+        model = HouseModelInference(model_path, device="cpu", **model_kwargs)
+        model.warmup(WARMUP_DESCRIPTION, max_length=WARMUP_MAX_LENGTH)
+        conn.send((READY, worker_id, time.perf_counter() - start))
+    except BaseException as e:
+        conn.send((FAILED, worker_id, repr(e)))
+        return
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            # The parent is gone
+            break
+        if task is None:
+            break
+        task_id, description, max_length = task
+        start = time.perf_counter()
+        try:
+            raw_text = model.generate_batch([description], batch_size=1, max_length=max_length)[0]
+        except Exception as e:
+            print(f"Worker {worker_id}: generation failed: {e}")
+            raw_text = None
+        conn.send((task_id, worker_id, raw_text, time.perf_counter() - start))
+
+
+class InferenceWorkerPool:
+    """Pool of model replicas in separate processes, fed one prompt at a time.
+
+    Each of the num_workers processes runs torch with threads_per_worker
+    intra-op threads; with pin_cpus=True, worker i is bound to its own
+    consecutive block of threads_per_worker cores. Extra keyword arguments go
+    to HouseModelInference in every worker (they must be picklable, so pass
+    cache_path instead of a GenerationCache). Use as a context manager, or
+    call start() and close().
+
+    The parent queues prompts and sends the next one to whichever worker
+    answers, so it tracks the prompt every worker is running. A worker
+    process that dies (e.g. killed for running out of memory) fails the
+    future of that prompt with WorkerDiedError, unless its result arrived
+    first, and is replaced by a fresh replica. If replicas stop loading and
+    no worker is left, every outstanding and later future fails instead.
+    """
+
+    def __init__(self, model_path, num_workers=2, threads_per_worker=1, pin_cpus=False, **model_kwargs):
+        self.model_path = model_path
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.pin_cpus = pin_cpus
+        self.model_kwargs = model_kwargs
+        self.load_times = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = []
+        self._conns = []
+        self._cpus = []
+        # Task each worker is running, None while it is idle
+        self._assigned = [None] * num_workers
+        self._backlog = deque()
+        self._ready = set()
+        self._failed = set()
+        self._pending = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False)
+        self._collector = None
+        self._closing = False
+        self._broken = None
+
+    def _cpu_blocks(self):
+        cpus = _available_cpus()
+        needed = self.num_workers * self.threads_per_worker
+        if not self.pin_cpus:
+            return [None] * self.num_workers
+        if needed > len(cpus):
+            print(f"Worker pool: {needed} threads requested but only {len(cpus)} CPUs available, not pinning")
+            return [None] * self.num_workers
+        return [
+            cpus[i * self.threads_per_worker:(i + 1) * self.threads_per_worker]
+            for i in range(self.num_workers)
+        ]
+
+    def _spawn(self, worker_id):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.model_path, self.threads_per_worker, self._cpus[worker_id],
+                  dict(self.model_kwargs), child_conn),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._assigned[worker_id] = None
+        return process, parent_conn
+
+    def start(self):
+        """Spawn the workers and wait until every replica is loaded and warmed up."""
+        self._cpus = self._cpu_blocks()
+        spawned = [self._spawn(worker_id) for worker_id in range(self.num_workers)]
+        self._processes = [process for process, _ in spawned]
+        self._conns = [conn for _, conn in spawned]
+
+        while len(self.load_times) < self.num_workers:
+            for worker_id, status, detail in self._startup_messages():
+                if status != READY:
+                    self.close()
+                    raise RuntimeError(f"Worker {worker_id} {detail}")
+                self.load_times[worker_id] = detail
+                self._ready.add(worker_id)
+        print(f"Worker pool: {self.num_workers} replicas x {self.threads_per_worker} threads ready "
+              f"(slowest load {max(self.load_times.values()):.2f}s)")
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def _startup_messages(self):
+        """Wait for loading workers and yield (worker_id, status, load time or error)."""
+        loading = [worker_id for worker_id in range(self.num_workers) if worker_id not in self.load_times]
+        handles = {}
+        for worker_id in loading:
+            handles[self._conns[worker_id]] = worker_id
+            handles[self._processes[worker_id].sentinel] = worker_id
+        reported = set()
+        for handle in connection.wait(list(handles)):
+            worker_id = handles[handle]
+            if worker_id in reported:
+                continue
+            reported.add(worker_id)
+            conn = self._conns[worker_id]
+            try:
+                if conn.poll():
+                    status, _, detail = conn.recv()
+                    if status == FAILED:
+                        detail = f"failed to load the model: {detail}"
+                    yield worker_id, status, detail
+                    continue
+            except (EOFError, OSError):
+                pass
+            yield worker_id, FAILED, "exited while loading the model"
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                if self._closing and not any(process.is_alive() for process in self._processes):
+                    break
+                handles = {self._wakeup_reader: None}
+                for worker_id, process in enumerate(self._processes):
+                    if worker_id in self._failed:
+                        continue
+                    handles[self._conns[worker_id]] = worker_id
+                    handles[process.sentinel] = worker_id
+            ready = connection.wait(list(handles), timeout=LIVENESS_INTERVAL)
+            if self._wakeup_reader in ready:
+                self._wakeup_reader.recv()
+            exited = set()
+            for handle in ready:
+                worker_id = handles[handle]
+                if worker_id is None:
+                    continue
+                if handle is self._conns[worker_id]:
+                    if not self._drain(worker_id):
+                        exited.add(worker_id)
+                else:
+                    exited.add(worker_id)
+            for worker_id in sorted(exited):
+                self._worker_exited(worker_id)
+            with self._lock:
+                self._dispatch()
+
+    def _drain(self, worker_id):
+        """Handle every message waiting on the worker's pipe; False once the worker closed it."""
+        conn = self._conns[worker_id]
+        try:
+            while conn.poll():
+                self._handle_message(conn.recv())
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def _handle_message(self, message):
+        if message[0] == READY:
+            _, worker_id, load_time = message
+            self.load_times[worker_id] = load_time
+            with self._lock:
+                self._ready.add(worker_id)
+            print(f"Worker pool: replacement worker {worker_id} ready ({load_time:.2f}s)")
+        elif message[0] == FAILED:
+            _, worker_id, detail = message
+            with self._lock:
+                self._failed.add(worker_id)
+            print(f"Worker pool: replacement worker {worker_id} failed to load the model: {detail}")
+        else:
+            task_id, worker_id, raw_text, _ = message
+            with self._lock:
+                self._assigned[worker_id] = None
+                future = self._pending.pop(task_id, None)
+            if future is not None:
+                future.set_result(raw_text)
+
+    def _worker_exited(self, worker_id):
+        """Fail the task of a worker process that died, and replace the process.
+
+        Whatever the worker sent before exiting is handled first, so a result
+        that made it out is kept. A worker that dies before it is ready is
+        not replaced again, and once no worker is left every outstanding
+        future fails.
+        """
+        process = self._processes[worker_id]
+        process.join()
+        self._drain(worker_id)
+        self._conns[worker_id].close()
+        lost = None
+        futures = None
+        with self._lock:
+            task = self._assigned[worker_id]
+            self._assigned[worker_id] = None
+            if self._closing:
+                self._failed.add(worker_id)
+                return
+            if worker_id in self._ready:
+                lost = self._pending.pop(task[0], None) if task is not None else None
+                print(f"Worker pool: worker {worker_id} exited with code {process.exitcode}, "
+                      f"starting a replacement")
+                self._ready.discard(worker_id)
+                self._processes[worker_id], self._conns[worker_id] = self._spawn(worker_id)
+            else:
+                if worker_id not in self._failed:
+                    # Died while loading: replacing it again would most likely fail the same way
+                    self._failed.add(worker_id)
+                    print(f"Worker pool: replacement worker {worker_id} exited with code {process.exitcode} "
+                          f"while loading the model")
+                if len(self._failed) == len(self._processes):
+                    self._broken = "Every worker process has died"
+                    futures = list(self._pending.values())
+                    self._pending.clear()
+                    self._backlog.clear()
+        if lost is not None:
+            lost.set_exception(WorkerDiedError(
+                f"Worker {worker_id} exited with code {process.exitcode} while generating"
+            ))
+        if futures is not None:
+            print(f"Worker pool: {self._broken}, failing {len(futures)} outstanding prompts")
+            for future in futures:
+                future.set_exception(WorkerDiedError(self._broken))
+
+    def _dispatch(self):
+        """Send queued prompts to idle ready workers; call with self._lock held."""
+        if self._closing:
+            return
+        for worker_id in sorted(self._ready - self._failed):
+            if not self._backlog:
+                return
+            if self._assigned[worker_id] is not None:
+                continue
+            task = self._backlog.popleft()
+            try:
+                self._conns[worker_id].send(task)
+            except OSError:
+                # The worker is exiting; the collector replaces it and the prompt waits for another
+                self._backlog.appendleft(task)
+                continue
+            self._assigned[worker_id] = task
+
+    def submit(self, description, max_length=None):
+        """Queue one prompt; returns a Future resolving to its raw text (None on failure).
+
+        The future fails with WorkerDiedError if the worker running the prompt
+        dies, or if the pool has no workers left.
+        """
+        future = Future()
+        with self._lock:
+            if self._broken:
+                future.set_exception(WorkerDiedError(self._broken))
+                return future
+            task_id = self._next_id
+            self._next_id += 1
+            self._pending[task_id] = future
+            self._backlog.append((task_id, description, max_length))
+            self._dispatch()
+        return future
+
+    def generate_many(self, descriptions, max_length=None):
+        """Generate raw text for every description, returned in input order.
+
+        Prompts whose worker died are left as None, like failed generations.
+        """
+        futures = [self.submit(description, max_length) for description in descriptions]
+        results = []
+        errors = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except WorkerDiedError as e:
+                errors.append(e)
+                results.append(None)
+        if errors:
+            print(f"Worker pool: {len(errors)} prompts lost to dead workers (last: {errors[-1]})")
+        return results
+
+    def close(self):
+        """Stop every worker process.
+
+        Prompts already running finish; prompts still queued resolve to None.
+        """
+        with self._lock:
+            self._closing = True
+            self._backlog.clear()
+            for worker_id, conn in enumerate(self._conns):
+                if worker_id in self._failed:
+                    continue
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for process in self._processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        if self._collector is not None:
+            self._wakeup_writer.send(None)
+            self._collector.join()
+            self._collector = None
+        for conn in self._conns:
+            conn.close()
+        self._processes = []
+        self._conns = []
+        with self._lock:
+            for future in self._pending.values():
+                future.set_result(None)
+            self._pending.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def candidate_configs(num_cpus):
+    """(replicas, threads per replica) pairs that fit on num_cpus cores, in powers of two."""
+    configs = []
+    threads = 1
+    while threads <= num_cpus:
+        replicas = 1
+        while replicas * threads <= num_cpus:
+            configs.append((replicas, threads))
+            replicas *= 2
+        threads *= 2
+    return configs
+
+
+def autotune(model_path, descriptions, num_cpus=None, configs=None, pin_cpus=True, max_length=None,
+             **model_kwargs):
+    """Benchmark replica x thread configurations on this host and return the fastest one.
+
+    Every configuration generates all descriptions once, after its replicas
+    are loaded and warmed up. Returns (replicas, threads per replica, prompts/sec).
+    """
+    num_cpus = num_cpus or len(_available_cpus())
+    configs = configs or candidate_configs(num_cpus)
+    print(f"Auto-tuning {len(configs)} configurations on {num_cpus} CPUs with {len(descriptions)} prompts")
+    print(f"{'replicas':>8} {'threads':>7} {'prompts/s':>10} {'wall (s)':>9}")
+
+    best = None
+    for replicas, threads in configs:
+        try:
+            with InferenceWorkerPool(model_path, replicas, threads, pin_cpus=pin_cpus, **model_kwargs) as pool:
+                start = time.perf_counter()
+                pool.generate_many(descriptions, max_length)
+                elapsed = time.perf_counter() - start
+        except RuntimeError as e:
+            print(f"{replicas:>8} {threads:>7}   failed: {e}")
+            continue
+        throughput = len(descriptions) / elapsed
+        print(f"{replicas:>8} {threads:>7} {throughput:>10.2f} {elapsed:>9.2f}")
+        if best is None or throughput > best[2]:
+            best = (replicas, threads, throughput)
+
+    if best:
+        print(f"Best: {best[0]} replicas x {best[1]} threads ({best[2]:.2f} prompts/s)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate house layouts with a multi-process CPU worker pool")
+    parser.add_argument("--model_path", type=str, required=True, help="Path to the trained model directory")
+    parser.add_argument("--descriptions_file", type=str, required=True,
+                        help="Text file with one house description per line")
+    parser.add_argument("--output_raw", type=str, default="generated_houses_raw.jsonl",
+                        help="JSON lines output of raw generations (default: generated_houses_raw.jsonl)")
+    parser.add_argument("--workers", type=int, default=2, help="Number of model replicas (default: 2)")
+    parser.add_argument("--threads_per_worker", type=int, default=1,
+                        help="torch intra-op threads per replica (default: 1)")
+    parser.add_argument("--pin_cpus", action="store_true", help="Bind each replica to its own cores")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Benchmark replica x thread combinations and use the fastest")
+    parser.add_argument("--autotune_prompts", type=int, default=32,
+                        help="Prompts from --descriptions_file used per auto-tune run (default: 32)")
+    parser.add_argument("--max_length", type=int, help="Maximum output length in tokens")
+    parser.add_argument("--quantize", type=str, choices=SUPPORTED_MODES, help="Run dynamically quantized replicas")
+    parser.add_argument("--cache_path", type=str, help="Generation cache database shared by the replicas")
+    args = parser.parse_args()
+
+    with open(args.descriptions_file, 'r') as f:
+        descriptions = [line.strip() for line in f if line.strip()]
+    if not descriptions:
+        print(f"No descriptions in {args.descriptions_file}")
+        return 1
+
+    model_kwargs = {"quantize": args.quantize, "cache_path": args.cache_path}
+    workers, threads = args.workers, args.threads_per_worker
+    if args.autotune:
+        best = autotune(args.model_path, descriptions[:args.autotune_prompts], pin_cpus=args.pin_cpus,
+                        max_length=args.max_length, **model_kwargs)
+        if best is None:
+            print("Auto-tuning failed for every configuration.")
+            return 1
+        workers, threads, _ = best
+
+    with InferenceWorkerPool(args.model_path, workers, threads, pin_cpus=args.pin_cpus, **model_kwargs) as pool:
+        start = time.perf_counter()
+        raw_texts = pool.generate_many(descriptions, args.max_length)
+        elapsed = time.perf_counter() - start
+    print(f"Generated {len(descriptions)} outputs in {elapsed:.2f}s ({len(descriptions) / elapsed:.2f} prompts/s)")
+
+    with open(args.output_raw, 'w', encoding='utf-8') as f:
+        for description, raw_text in zip(descriptions, raw_texts):
+            f.write(json.dumps({"description": description, "raw_text": raw_text}) + "\n")
+    print(f"Raw outputs saved to {args.output_raw}")
+
+    failed = sum(1 for raw_text in raw_texts if raw_text is None)
+    if failed:
+        print(f"{failed} descriptions failed to generate.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())